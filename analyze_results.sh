@@ -63,6 +63,19 @@ if start_time and end_time:
         rate = total_cases / duration.total_seconds()
         print(f"Test Rate: {rate:.2f} tests/second")
 
+# Crash-only runs (--crash-only) write only the cases around anomalies; their
+# counter snapshots hold the real totals.
+c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='counters'")
+if c.fetchone():
+    c.execute("""SELECT timestamp, test_cases, cases_written, anomalies, failures, connection, latency, asan
+                 FROM counters ORDER BY rowid DESC LIMIT 1""")
+    snapshot = c.fetchone()
+    if snapshot:
+        print(f"\nCrash-only run, last snapshot {snapshot[0]}:")
+        print(f"  Test cases run: {snapshot[1]:,} ({snapshot[2]:,} written)")
+        print(f"  Anomalies: {snapshot[3]:,} ({snapshot[4]} failures, {snapshot[5]} refused connects, "
+              f"{snapshot[6]} latency spikes, {snapshot[7]} ASAN reports)")
+
 print("\n" + "="*50)
 print("Mutation Coverage by Packet Type")
 print("="*50)
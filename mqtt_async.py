@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+MQTT Asyncio Execution Engine
+
+Sends rendered test cases to a broker over N concurrent TCP connections
+instead of boofuzz's one-case-at-a-time Session loop.
+
+Each test case gets its own connection: connect, send, collect the broker's
+answer as whole MQTT packets until it closes the socket or has nothing more
+buffered, close.
+When the broker stops accepting connections, dispatch pauses, the cases sent
+just before the outage are replayed one at a time, and the one that takes
+the broker down again is reported by its exact test case index.
+"""
+
+from mqtt_codec import MQTTDecodeError, MQTTPacketDecoder
+from mqtt_connections import LOCAL_EXHAUSTION_ERRNOS, ConnectionManager
+from mqtt_streaming import StreamedPacket, write_streamed
+import asyncio
+import collections
+import json
+import time
+
+
+class BrokerUnavailable(Exception):
+    """Raised when a connection to the broker cannot be established."""
+
+
+class AsyncFuzzEngine:
+    """
+    Drive test cases from mqtt_cases.iter_test_cases() against one broker.
+
+    Args:
+        host (str): Broker host.
+        port (int): Broker port.
+        concurrency (int): Number of test cases kept in flight.
+        recv_timeout (float): Seconds to wait for the broker to answer or close after sending a case.
+        idle_timeout (float): Once the broker has answered, wait at most this long for the rest of a partial packet.
+        connect_timeout (float): Seconds to wait for a TCP connect.
+        restart_timeout (float): Seconds to wait for the broker to come back after an outage.
+        restart_sleep_time (float): Seconds between reconnect attempts during an outage.
+        settle_time (float): Seconds to let the broker process a replayed case before probing it.
+        pacer (AdaptivePacer): Optional pacing controller fed with response latencies and refused connects.
+        results_file (str): Optional JSON lines file that crash records are appended to.
+        connections (ConnectionManager): Socket setup for connection churn (RST close, source rotation).
+        feedback: Optional object whose before_case(case) and after_case(case, responses) are called around
+            every test case (e.g. mqtt_coverage.CoverageGuide). Use concurrency 1 so cases do not overlap.
+        checkpoint (Checkpoint): Optional mqtt_checkpoint.Checkpoint whose done(case) is called once a case
+            has been sent. Cases still in flight or waiting for a retry are not done.
+    """
+
+    def __init__(self, host, port, concurrency=8, recv_timeout=0.5, idle_timeout=0.01, connect_timeout=5.0,
+                 restart_timeout=60.0, restart_sleep_time=0.5, settle_time=0.2, pacer=None, results_file=None,
+                 connections=None, feedback=None, checkpoint=None):
+        self.host = host
+        self.port = port
+        self.concurrency = max(1, concurrency)
+        self.recv_timeout = recv_timeout
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.restart_timeout = restart_timeout
+        self.restart_sleep_time = restart_sleep_time
+        self.settle_time = settle_time
+        self.pacer = pacer
+        self.results_file = results_file
+        self.connections = connections or ConnectionManager()
+        self.feedback = feedback
+        self.checkpoint = checkpoint
+
+        self.cases_sent = 0
+        self.responses = collections.Counter()
+        self.crashes = []
+        self.start_time = None
+        self.end_time = None
+
+        # Cases sent since the broker was last known to be alive; the crash suspects.
+        self._recent = collections.deque(maxlen=self.concurrency * 2)
+        self._retry = collections.deque()
+        self._in_flight = 0
+        self._outage = None
+        self._healthy = None
+        self._stopped = False
+
+    # -------------------------------------------------------------------------
+    # Public API
+    # -------------------------------------------------------------------------
+
+    def run(self, cases):
+        """Fuzz every case from the iterable. Blocks until done, returns self."""
+        asyncio.run(self._run(iter(cases)))
+        return self
+
+    @property
+    def elapsed(self):
+        if self.start_time is None:
+            return 0.0
+        return (self.end_time or time.time()) - self.start_time
+
+    @property
+    def rate(self):
+        elapsed = self.elapsed
+        return self.cases_sent / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        """Return a one-paragraph human readable summary."""
+        lines = [
+            f"[*] Sent {self.cases_sent} test cases in {self.elapsed:.1f}s "
+            f"({self.rate:.1f} cases/sec, concurrency {self.concurrency})",
+        ]
+        if self.responses:
+            counts = ", ".join(f"{name} {count}" for name, count in self.responses.most_common())
+            lines.append(f"[*] Broker responses: {counts}")
+        for crash in self.crashes:
+            if crash["reproduced"]:
+                lines.append(f"[!] Crash on test case #{crash['index']}: {crash['name']}")
+            else:
+                indices = ", ".join(str(i) for i in crash["window"])
+                lines.append(f"[!] Crash not reproduced; suspect test cases: {indices}")
+        return "\n".join(lines)
+
+    # -------------------------------------------------------------------------
+    # Dispatch
+    # -------------------------------------------------------------------------
+
+    async def _run(self, cases):
+        self._healthy = asyncio.Event()
+        self._healthy.set()
+        self.start_time = time.time()
+        try:
+            workers = [self._worker(cases) for _ in range(self.concurrency)]
+            await asyncio.gather(*workers)
+            # Cases bounced by an outage after the iterator ran dry.
+            while self._retry and not self._stopped:
+                await self._worker(iter(()))
+        finally:
+            self.end_time = time.time()
+
+    async def _worker(self, cases):
+        while not self._stopped:
+            await self._healthy.wait()
+            if self._stopped:
+                return
+            if self.pacer is not None:
+                delay = self.pacer.next_delay()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if self._retry:
+                case = self._retry.popleft()
+            else:
+                case = next(cases, None)
+                if case is None:
+                    return
+
+            if self.feedback is not None:
+                self.feedback.before_case(case)
+            try:
+                responses = await self._send_case(case.data)
+            except BrokerUnavailable:
+                # Never reached the broker; send it again once it is back.
+                if self.pacer is not None:
+                    self.pacer.record_refused()
+                self._retry.append(case)
+                await self._handle_outage()
+                continue
+
+            if self.feedback is not None:
+                self.feedback.after_case(case, responses)
+            if self.checkpoint is not None:
+                self.checkpoint.done(case)
+            self._recent.append(case)
+            self.cases_sent += 1
+            if self.cases_sent % 1000 == 0:
+                print(f"[*] {self.cases_sent} cases sent ({self.rate:.1f} cases/sec), last #{case.index}")
+
+    async def _send_case(self, data):
+        """Send one test case on a fresh connection and return the broker's MQTT packets."""
+        self._in_flight += 1
+        try:
+            reader, writer = await self._open()
+            try:
+                if isinstance(data, StreamedPacket):
+                    await write_streamed(writer, data)
+                else:
+                    writer.write(data)
+                    await writer.drain()
+                return await self._read_response(reader)
+            except (ConnectionError, OSError):
+                # Broker dropped the connection mid-case; normal for malformed input.
+                return []
+            finally:
+                await self._close(writer)
+        finally:
+            self._in_flight -= 1
+
+    async def _open(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            sock = None
+            try:
+                sock = self.connections.create_socket(blocking=False)
+                await asyncio.wait_for(loop.sock_connect(sock, (self.host, self.port)), self.connect_timeout)
+            except (asyncio.TimeoutError, ConnectionError, OSError) as e:
+                if sock is not None:
+                    sock.close()
+                self.connections.record_connect(e)
+                if getattr(e, "errno", None) in LOCAL_EXHAUSTION_ERRNOS:
+                    # Out of local ports, not a broker outage: let TIME_WAIT drain and retry.
+                    await asyncio.sleep(self.restart_sleep_time)
+                    continue
+                raise BrokerUnavailable(str(e)) from e
+            self.connections.record_connect()
+            return await asyncio.open_connection(sock=sock)
+
+    async def _close(self, writer):
+        writer.close()
+        self.connections.record_close()
+        try:
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+    async def _read_response(self, reader):
+        """
+        Collect broker output as MQTT packets. Waits up to recv_timeout for the
+        broker to answer or close; once it has answered, stops at EOF or as soon
+        as every buffered byte belongs to a complete packet.
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        decoder = MQTTPacketDecoder()
+        packets = []
+        answered = False
+        timeout = self.recv_timeout
+        while True:
+            try:
+                chunk = await asyncio.wait_for(reader.read(4096), timeout)
+            except asyncio.TimeoutError:
+                break
+            if not answered:
+                answered = True
+                if self.pacer is not None:
+                    self.pacer.record_response(loop.time() - start)
+            if not chunk:
+                break
+            try:
+                packets += decoder.feed(chunk)
+            except MQTTDecodeError:
+                break
+            if not decoder.pending:
+                break
+            timeout = self.idle_timeout
+        if not answered and self.pacer is not None:
+            self.pacer.record_silence(self.recv_timeout)
+        for packet in packets:
+            self.responses[packet.name] += 1
+        return packets
+
+    async def _probe(self):
+        """Raise BrokerUnavailable unless a TCP connect succeeds."""
+        _, writer = await self._open()
+        await self._close(writer)
+
+    # -------------------------------------------------------------------------
+    # Crash attribution
+    # -------------------------------------------------------------------------
+
+    async def _handle_outage(self):
+        if self._outage is None:
+            self._healthy.clear()
+            self._outage = asyncio.ensure_future(self._attribute_crash())
+            self._outage.add_done_callback(self._outage_done)
+        await asyncio.shield(self._outage)
+
+    def _outage_done(self, _):
+        self._outage = None
+        self._healthy.set()
+
+    async def _wait_for_broker(self):
+        deadline = time.time() + self.restart_timeout
+        while time.time() < deadline:
+            try:
+                await self._probe()
+                return True
+            except BrokerUnavailable:
+                await asyncio.sleep(self.restart_sleep_time)
+        return False
+
+    async def _attribute_crash(self):
+        print("[!] Broker unavailable, pausing dispatch")
+        # Let cases that were already on the wire finish so they count as suspects.
+        while self._in_flight:
+            await asyncio.sleep(0.01)
+        suspects = list(self._recent)
+        self._recent.clear()
+
+        if not await self._wait_for_broker():
+            print(f"[!] Broker did not come back within {self.restart_timeout}s, stopping")
+            self._record_crash(None, suspects)
+            self._stopped = True
+            return
+
+        print(f"[*] Broker back, replaying {len(suspects)} suspect cases serially")
+        for case in suspects:
+            try:
+                await self._send_case(case.data)
+                await asyncio.sleep(self.settle_time)
+                await self._probe()
+            except BrokerUnavailable:
+                self._record_crash(case, suspects)
+                if not await self._wait_for_broker():
+                    print(f"[!] Broker did not come back within {self.restart_timeout}s, stopping")
+                    self._stopped = True
+                return
+        self._record_crash(None, suspects)
+
+    def _record_crash(self, case, suspects):
+        record = {
+            "time": time.time(),
+            "reproduced": case is not None,
+            "index": case.index if case else None,
+            "name": case.name if case else None,
+            "request": case.request if case else None,
+            "data": case.data.hex() if case else None,
+            "window": [c.index for c in suspects],
+        }
+        self.crashes.append(record)
+        if case is not None:
+            print(f"[!] Crash reproduced by test case #{case.index}: {case.name}")
+        if self.results_file:
+            with open(self.results_file, "a") as f:
+                f.write(json.dumps(record) + "\n")
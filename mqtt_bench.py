@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+MQTT Fuzzer Throughput Benchmark
+
+Runs every Request of the stateless fuzzer (create_session) and the stateful
+fuzzer (create_stateful_session) for a fixed case budget against a local
+broker, and reports per request:
+
+- cases/sec
+- p50/p99 per-case time (from the end of one test case to the end of the next,
+  so connect, send, waiting for the broker and pacing are all included)
+- fuzzer CPU time per case
+
+Results are saved as JSON so runs on different commits can be compared with
+--compare. By default the in-repo stand-in broker (mqtt_broker_stub.py) is
+started in a subprocess so its CPU time is not counted against the fuzzer.
+"""
+
+from boofuzz.constants import RESULTS_DIR
+from mqtt_fuzzer import create_session, define_requests
+from mqtt_fuzzer_stateful import create_stateful_session, define_stateful_requests
+from mqtt_pacing import AdaptivePacer
+from importlib import metadata
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+
+STUB_BROKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mqtt_broker_stub.py")
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an unsorted list; 0.0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+class CaseTimer:
+    """post_test_case callback that records the time between consecutive test cases."""
+
+    def __init__(self):
+        self.durations = []
+        self._last = None
+
+    def start(self):
+        self.durations = []
+        self._last = time.perf_counter()
+
+    def post_test_case_callback(self, target, fuzz_data_logger, session, sock, *args, **kwargs):
+        now = time.perf_counter()
+        self.durations.append(now - self._last)
+        self._last = now
+
+
+# =============================================================================
+# Broker
+# =============================================================================
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_port(host, port, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1.0).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def start_stub_broker(latency=0.0):
+    """Start mqtt_broker_stub.py in a subprocess; returns (process, port)."""
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, STUB_BROKER, "-p", str(port), "--latency", str(latency)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    if not _wait_for_port("127.0.0.1", port):
+        process.kill()
+        raise RuntimeError("stand-in broker did not start")
+    return process, port
+
+
+# =============================================================================
+# Benchmarks
+# =============================================================================
+
+def bench_request(fuzzer, request_name, session_factory, budget):
+    """Fuzz the first `budget` cases of one request and return its measurements."""
+    timer = CaseTimer()
+    with tempfile.TemporaryDirectory() as tmp:
+        session = session_factory(os.path.join(tmp, "bench.db"))
+        session.register_post_test_case_callback(timer.post_test_case_callback)
+        timer.start()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        error = None
+        try:
+            session.fuzz(name=request_name)
+        except Exception as e:
+            error = str(e)
+        elapsed = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        pool = getattr(session, "_mqtt_pool", None)
+        if pool is not None:
+            pool.close()
+
+    cases = len(timer.durations)
+    result = {
+        "fuzzer": fuzzer,
+        "request": request_name,
+        "cases": cases,
+        "elapsed": elapsed,
+        "cases_per_sec": cases / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": percentile(timer.durations, 0.50) * 1000,
+        "p99_ms": percentile(timer.durations, 0.99) * 1000,
+        "cpu_per_case_ms": cpu / cases * 1000 if cases else 0.0,
+    }
+    if error:
+        result["error"] = error
+    return result
+
+
+def _session_options(budget, db_filename):
+    return dict(
+        index_end=budget,
+        web_port=None,
+        keep_web_open=False,
+        fuzz_loggers=[],
+        db_filename=db_filename,
+    )
+
+
+def run_benchmarks(host, port, budget=200, fuzzers=("stateless", "stateful"), request_name=None,
+                   sleep_time=None):
+    """Benchmark every request of the selected fuzzers; returns a list of result dicts."""
+    results = []
+
+    def pacing():
+        if sleep_time is None:
+            return {"pacer": AdaptivePacer()}
+        return {"sleep_time": sleep_time}
+
+    if "stateless" in fuzzers:
+        for request in define_requests(fuzz_all=True):
+            if request_name and request.name != request_name:
+                continue
+            results.append(bench_request(
+                "stateless", request.name,
+                lambda db: create_session(host, port, fuzz_all=True, **pacing(), **_session_options(budget, db)),
+                budget,
+            ))
+            _print_result(results[-1])
+
+    if "stateful" in fuzzers:
+        for request in define_stateful_requests():
+            if request_name and request.name != request_name:
+                continue
+            results.append(bench_request(
+                "stateful", request.name,
+                lambda db: create_stateful_session(host, port, **pacing(), **_session_options(budget, db)),
+                budget,
+            ))
+            _print_result(results[-1])
+
+    return results
+
+
+def _print_result(r):
+    status = f" ({r['error']})" if r.get("error") else ""
+    print(f"  {r['fuzzer']:<9} {r['request']:<32} {r['cases']:>6} cases {r['cases_per_sec']:>9.1f}/sec "
+          f"p50 {r['p50_ms']:>7.2f} ms  p99 {r['p99_ms']:>7.2f} ms  cpu {r['cpu_per_case_ms']:>6.3f} ms/case{status}")
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current, threshold=0.10):
+    """Print per-request throughput change against a previous run; returns the regressions."""
+    before = {(r["fuzzer"], r["request"]): r for r in previous["results"]}
+    regressions = []
+    print(f"\n[*] Compared with {previous.get('commit') or 'previous run'} ({previous.get('time')}):")
+    for r in current["results"]:
+        old = before.get((r["fuzzer"], r["request"]))
+        if not old or not old["cases_per_sec"]:
+            continue
+        change = r["cases_per_sec"] / old["cases_per_sec"] - 1
+        marker = ""
+        if change < -threshold:
+            marker = "  [!] regression"
+            regressions.append(r)
+        print(f"  {r['fuzzer']:<9} {r['request']:<32} {old['cases_per_sec']:>9.1f} -> "
+              f"{r['cases_per_sec']:>9.1f}/sec ({change * 100:+.1f}%){marker}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Throughput benchmark for the MQTT fuzzers, one entry per Request",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s
+  %(prog)s --budget 500 --fuzzer stateless
+  %(prog)s --compare boofuzz-results/bench-2024-01-01T00-00-00.json
+  %(prog)s -t localhost -p 1883   # against a real broker instead of the stand-in
+        """
+    )
+    parser.add_argument("-t", "--target", default=None,
+                        help="Broker host (default: start the stand-in broker locally)")
+    parser.add_argument("-p", "--port", type=int, default=1883, help="Broker port when --target is given")
+    parser.add_argument("-n", "--budget", type=int, default=200, help="Test cases per request (default: 200)")
+    parser.add_argument("-f", "--fuzzer", choices=["stateless", "stateful", "both"], default="both",
+                        help="Which fuzzer's requests to benchmark")
+    parser.add_argument("-r", "--request", type=str, help="Benchmark only this request")
+    parser.add_argument("-s", "--sleep-time", type=float, default=None,
+                        help="Fixed delay between test cases instead of response-driven pacing")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Response latency of the stand-in broker in seconds")
+    parser.add_argument("-o", "--output", help="JSON file to write (default: boofuzz-results/bench-<timestamp>.json)")
+    parser.add_argument("--compare", metavar="JSON", help="Previous benchmark JSON to compare throughput against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Throughput drop that counts as a regression (default: 0.10)")
+    args = parser.parse_args()
+
+    fuzzers = ("stateless", "stateful") if args.fuzzer == "both" else (args.fuzzer,)
+    broker = None
+    if args.target:
+        host, port = args.target, args.port
+    else:
+        broker, port = start_stub_broker(latency=args.latency)
+        host = "127.0.0.1"
+    print(f"[*] Benchmarking against {host}:{port}, {args.budget} cases per request")
+
+    try:
+        results = run_benchmarks(host, port, budget=args.budget, fuzzers=fuzzers,
+                                 request_name=args.request, sleep_time=args.sleep_time)
+    finally:
+        if broker is not None:
+            broker.terminate()
+            broker.wait()
+
+    report = {
+        "commit": _git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "boofuzz": metadata.version("boofuzz"),
+        "broker": f"{host}:{port}" if args.target else f"stand-in (latency {args.latency}s)",
+        "budget": args.budget,
+        "sleep_time": args.sleep_time,
+        "results": results,
+    }
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"bench-{time.strftime('%Y-%m-%dT%H-%M-%S')}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n[*] Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if compare(previous, report, threshold=args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+MQTT 3.1.1 Stand-in Broker
+
+A small asyncio broker for measuring fuzzer throughput offline, without
+Docker or the QEMU VM. It frames incoming packets like a real broker and
+answers CONNECT, PUBLISH (QoS 1/2), PUBREC, PUBREL, SUBSCRIBE, UNSUBSCRIBE
+and PINGREQ with CONNACK, PUBACK, PUBREC, PUBREL, PUBCOMP, SUBACK, UNSUBACK
+and PINGRESP. It does not route messages between clients.
+
+Misbehaviour can be injected to exercise the fuzzers' crash handling:
+
+- latency: every response is delayed (optionally with jitter)
+- crash: the whole broker goes down, either exiting the process or closing
+  every connection and refusing new ones for --restart-time seconds
+- hang: the connection stops being served but stays open
+- reset: the connection is aborted with RST
+
+Faults fire when a packet contains a --crash-on/--hang-on/--reset-on byte
+pattern, at random with --crash-rate/--hang-rate/--reset-rate, or on command
+when a client publishes to $stub/crash, $stub/hang or $stub/reset.
+"""
+
+from mqtt_codec import MQTTDecodeError, MQTTPacketDecoder, encode_remaining_length
+import argparse
+import asyncio
+import collections
+import os
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+
+
+# Control packet types (upper 4 bits of the first byte)
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+# CONNACK return codes (Section 3.2.2.3)
+CONNACK_ACCEPTED = 0x00
+CONNACK_UNACCEPTABLE_PROTOCOL = 0x01
+CONNACK_IDENTIFIER_REJECTED = 0x02
+
+COMMAND_TOPIC_PREFIX = b"$stub/"
+FAULTS = ("crash", "hang", "reset")
+
+
+class ProtocolViolation(Exception):
+    """The client broke the protocol; a real broker closes the connection."""
+
+
+def build_packet(packet_type, flags=0, body=b""):
+    return bytes([packet_type << 4 | flags]) + encode_remaining_length(len(body)) + body
+
+
+def _read_string(body, offset):
+    if offset + 2 > len(body):
+        raise ProtocolViolation("truncated string length")
+    (length,) = struct.unpack_from(">H", body, offset)
+    end = offset + 2 + length
+    if end > len(body):
+        raise ProtocolViolation("string runs past end of packet")
+    return body[offset + 2:end], end
+
+
+def _read_packet_id(body, offset):
+    if offset + 2 > len(body):
+        raise ProtocolViolation("missing packet identifier")
+    return body[offset:offset + 2], offset + 2
+
+
+class MQTTStubBroker:
+    """
+    Stand-in MQTT 3.1.1 broker.
+
+    Args:
+        host (str): Address to listen on.
+        port (int): Port to listen on; 0 picks a free one (see .port once started).
+        latency (float): Seconds to delay every response.
+        jitter (float): Up to this many extra seconds of random delay per response.
+        crash_on (list): Byte patterns that crash the broker when seen in a packet.
+        hang_on (list): Byte patterns that hang the connection they arrive on.
+        reset_on (list): Byte patterns that reset the connection they arrive on.
+        crash_rate (float): Probability per packet of a crash.
+        hang_rate (float): Probability per packet of a hang.
+        reset_rate (float): Probability per packet of a reset.
+        restart_time (float): After a crash, refuse connections for this long and then come back.
+            None exits the process instead, like a real crash.
+        hang_time (float): How long a hung connection stays unserved; None hangs until the client gives up.
+        seed (int): Seed for the fault and jitter RNG.
+    """
+
+    def __init__(self, host="127.0.0.1", port=1883, latency=0.0, jitter=0.0, crash_on=(), hang_on=(),
+                 reset_on=(), crash_rate=0.0, hang_rate=0.0, reset_rate=0.0, restart_time=None,
+                 hang_time=None, seed=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.crash_on = [bytes(p) for p in crash_on]
+        self.hang_on = [bytes(p) for p in hang_on]
+        self.reset_on = [bytes(p) for p in reset_on]
+        self.crash_rate = crash_rate
+        self.hang_rate = hang_rate
+        self.reset_rate = reset_rate
+        self.restart_time = restart_time
+        self.hang_time = hang_time
+        self.random = random.Random(seed)
+
+        self.connections = 0
+        self.packets = collections.Counter()
+        self.faults = collections.Counter()
+
+        self._server = None
+        self._writers = set()
+        self._loop = None
+        self._thread = None
+        self._stopped = None
+
+    # -------------------------------------------------------------------------
+    # Server lifecycle
+    # -------------------------------------------------------------------------
+
+    async def start(self):
+        """Start listening. Safe to call again after a simulated crash."""
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self, ready=None):
+        """Serve until stop(); ready (a threading.Event) is set once listening."""
+        self._stopped = asyncio.Event()
+        await self.start()
+        if ready is not None:
+            ready.set()
+        await self._stopped.wait()
+        self._server.close()
+        for writer in list(self._writers):
+            writer.transport.abort()
+
+    def run(self):
+        """Serve in the current thread until interrupted."""
+        asyncio.run(self.serve_forever())
+
+    def start_in_thread(self):
+        """Serve from a daemon thread; returns once the broker is listening."""
+        ready = threading.Event()
+        self._thread = threading.Thread(target=asyncio.run, args=(self.serve_forever(ready),),
+                                        name="mqtt-broker-stub", daemon=True)
+        self._thread.start()
+        if not ready.wait(timeout=5.0):
+            raise RuntimeError("stand-in broker did not start")
+        return self
+
+    def stop(self):
+        if self._loop is not None and self._stopped is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+
+    def summary(self):
+        packets = ", ".join(f"{name} {count}" for name, count in self.packets.most_common()) or "none"
+        faults = ", ".join(f"{name} {count}" for name, count in self.faults.items()) or "none"
+        return f"[*] Stand-in broker: {self.connections} connections, packets: {packets}, faults: {faults}"
+
+    # -------------------------------------------------------------------------
+    # Connection handling
+    # -------------------------------------------------------------------------
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self._writers.add(writer)
+        decoder = MQTTPacketDecoder()
+        session = {"connected": False}
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                fault = self._fault_for(data)
+                if fault:
+                    await self._inject(fault, reader, writer)
+                    return
+                for packet in decoder.feed(data):
+                    self.packets[packet.name] += 1
+                    responses = self._respond(packet, session)
+                    command = session.pop("command", None)
+                    if command in FAULTS:
+                        await self._inject(command, reader, writer)
+                        return
+                    if responses:
+                        await self._delay()
+                        writer.write(b"".join(responses))
+                        await writer.drain()
+                    if packet.packet_type == DISCONNECT:
+                        return
+        except (MQTTDecodeError, ProtocolViolation):
+            self.faults["protocol-close"] += 1
+        except (ConnectionError, OSError, asyncio.CancelledError):
+            pass  # client went away, or the broker is shutting down
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _delay(self):
+        delay = self.latency
+        if self.jitter:
+            delay += self.random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _respond(self, packet, session):
+        """Return the list of packets to send back, or raise ProtocolViolation."""
+        kind = packet.packet_type
+        body = packet.body
+
+        if not session["connected"]:
+            if kind != CONNECT:
+                raise ProtocolViolation("first packet was not CONNECT")
+            return [self._connack(body, session)]
+        if kind == CONNECT:
+            raise ProtocolViolation("second CONNECT")
+
+        if kind == PUBLISH:
+            qos = (packet.flags >> 1) & 0x03
+            if qos == 3:
+                raise ProtocolViolation("PUBLISH with QoS 3")
+            topic, offset = _read_string(body, 0)
+            if topic.startswith(COMMAND_TOPIC_PREFIX):
+                session["command"] = topic[len(COMMAND_TOPIC_PREFIX):].decode("ascii", "replace")
+            if qos == 0:
+                return []
+            packet_id, _ = _read_packet_id(body, offset)
+            return [build_packet(PUBACK if qos == 1 else PUBREC, 0, packet_id)]
+        if kind == PUBREC:
+            return [build_packet(PUBREL, 0x02, _read_packet_id(body, 0)[0])]
+        if kind == PUBREL:
+            return [build_packet(PUBCOMP, 0, _read_packet_id(body, 0)[0])]
+        if kind in (PUBACK, PUBCOMP):
+            _read_packet_id(body, 0)
+            return []
+        if kind == SUBSCRIBE:
+            packet_id, offset = _read_packet_id(body, 0)
+            granted = bytearray()
+            while offset < len(body):
+                topic_filter, offset = _read_string(body, offset)
+                if offset >= len(body):
+                    raise ProtocolViolation("topic filter without requested QoS")
+                qos = body[offset]
+                offset += 1
+                granted.append(qos if qos <= 2 and topic_filter else 0x80)
+            if not granted:
+                raise ProtocolViolation("SUBSCRIBE without topic filters")
+            return [build_packet(SUBACK, 0, packet_id + bytes(granted))]
+        if kind == UNSUBSCRIBE:
+            packet_id, offset = _read_packet_id(body, 0)
+            while offset < len(body):
+                _, offset = _read_string(body, offset)
+            return [build_packet(UNSUBACK, 0, packet_id)]
+        if kind == PINGREQ:
+            return [build_packet(PINGRESP)]
+        if kind == DISCONNECT:
+            return []
+        raise ProtocolViolation(f"unexpected packet type {kind}")
+
+    def _connack(self, body, session):
+        protocol, offset = _read_string(body, 0)
+        if offset + 4 > len(body):
+            raise ProtocolViolation("truncated CONNECT variable header")
+        level = body[offset]
+        client_id, _ = _read_string(body, offset + 4)
+        if protocol != b"MQTT" or level != 4:
+            return_code = CONNACK_UNACCEPTABLE_PROTOCOL
+        elif not client_id and not body[offset + 1] & 0x02:
+            return_code = CONNACK_IDENTIFIER_REJECTED
+        else:
+            return_code = CONNACK_ACCEPTED
+            session["connected"] = True
+        return build_packet(CONNACK, 0, bytes([0x00, return_code]))
+
+    # -------------------------------------------------------------------------
+    # Fault injection
+    # -------------------------------------------------------------------------
+
+    def _fault_for(self, data):
+        for fault, patterns, rate in zip(FAULTS, (self.crash_on, self.hang_on, self.reset_on),
+                                         (self.crash_rate, self.hang_rate, self.reset_rate)):
+            if any(pattern in data for pattern in patterns):
+                return fault
+            if rate and self.random.random() < rate:
+                return fault
+        return None
+
+    async def _inject(self, fault, reader, writer):
+        self.faults[fault] += 1
+        if fault == "reset":
+            sock = writer.get_extra_info("socket")
+            if sock is not None:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            writer.transport.abort()
+        elif fault == "hang":
+            if self.hang_time is not None:
+                await asyncio.sleep(self.hang_time)
+                return
+            # Swallow everything without answering until the client gives up.
+            while await reader.read(65536):
+                pass
+        elif fault == "crash":
+            await self._crash()
+
+    async def _crash(self):
+        print(f"[!] Stand-in broker crashing ({time.strftime('%H:%M:%S')})", flush=True)
+        if self.restart_time is None:
+            os._exit(1)
+        self._server.close()
+        for writer in list(self._writers):
+            writer.transport.abort()
+        await asyncio.sleep(self.restart_time)
+        await self.start()
+        print("[*] Stand-in broker restarted", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="MQTT 3.1.1 stand-in broker for offline fuzzer benchmarking",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s -p 1883
+  %(prog)s -p 1883 --latency 0.002 --jitter 0.003
+  %(prog)s -p 1883 --crash-on ffffffff --restart-time 2
+  %(prog)s -p 1883 --reset-rate 0.001 --hang-rate 0.001 --seed 1
+        """
+    )
+    parser.add_argument("-H", "--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("-p", "--port", type=int, default=1883, help="Port to listen on")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to delay every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random delay of up to this many seconds")
+    parser.add_argument("--crash-on", action="append", default=[], type=bytes.fromhex, metavar="HEX",
+                        help="Crash when a packet contains this byte pattern (repeatable)")
+    parser.add_argument("--hang-on", action="append", default=[], type=bytes.fromhex, metavar="HEX",
+                        help="Hang the connection when a packet contains this byte pattern (repeatable)")
+    parser.add_argument("--reset-on", action="append", default=[], type=bytes.fromhex, metavar="HEX",
+                        help="Reset the connection when a packet contains this byte pattern (repeatable)")
+    parser.add_argument("--crash-rate", type=float, default=0.0, help="Probability per packet of a crash")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Probability per packet of a hang")
+    parser.add_argument("--reset-rate", type=float, default=0.0, help="Probability per packet of a reset")
+    parser.add_argument("--restart-time", type=float, default=None,
+                        help="After a crash, come back after this many seconds instead of exiting")
+    parser.add_argument("--hang-time", type=float, default=None,
+                        help="Seconds a hung connection stays unserved (default: until the client closes it)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for fault injection and jitter")
+    args = parser.parse_args()
+
+    broker = MQTTStubBroker(
+        args.host, args.port,
+        latency=args.latency, jitter=args.jitter,
+        crash_on=args.crash_on, hang_on=args.hang_on, reset_on=args.reset_on,
+        crash_rate=args.crash_rate, hang_rate=args.hang_rate, reset_rate=args.reset_rate,
+        restart_time=args.restart_time, hang_time=args.hang_time, seed=args.seed,
+    )
+    print(f"[*] Stand-in broker listening on {args.host}:{args.port}")
+    try:
+        broker.run()
+    except KeyboardInterrupt:
+        pass
+    print(broker.summary())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
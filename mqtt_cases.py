@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+MQTT Test Case Enumeration
+
+Walks boofuzz Request definitions outside of a boofuzz Session and yields
+rendered test cases. Indices and names match what Session.fuzz() produces for
+the first (single mutation) pass, so a case found here can be replayed by
+its index with ``mqtt_fuzzer.py --case N`` (plus ``-r <request name>`` if the
+cases were enumerated for that request alone).
+"""
+
+from boofuzz.mutation_context import MutationContext
+import collections
+
+
+TestCase = collections.namedtuple("TestCase", ["index", "name", "request", "data"])
+
+
+def test_case_name(request, mutations):
+    """
+    Format a test case name the way boofuzz does.
+    Example: MQTT-CONNECT:[MQTT-CONNECT.Fixed-Header.packet_type:3]
+    """
+    mutation_names = ("{0}:{1}".format(m.qualified_name, m.index) for m in mutations)
+    return "{0}:[{1}]".format(request.name, ", ".join(mutation_names))
+
+
+def select_requests(requests, name=None):
+    """Return the requests to fuzz, optionally restricted to one request name."""
+    if not name:
+        return list(requests)
+    selected = [request for request in requests if request.name == name]
+    if not selected:
+        raise ValueError(f"Unknown request: {name}")
+    return selected
+
+
+def num_test_cases(requests):
+    """Total number of single-mutation test cases over the given requests."""
+    return sum(request.get_num_mutations() for request in requests)
+
+
+def iter_test_cases(requests, index_start=1, index_end=None):
+    """
+    Yield a TestCase for every mutation of every request, in session order.
+
+    Indices are 1-based and global across all requests, matching boofuzz's
+    total_mutant_index. Cases outside [index_start, index_end] are skipped
+    without being rendered.
+    """
+    index = 0
+    for request in requests:
+        for mutations in request.get_mutations():
+            index += 1
+            if index < index_start:
+                continue
+            if index_end is not None and index > index_end:
+                return
+            context = MutationContext(mutations={m.qualified_name: m for m in mutations})
+            yield TestCase(
+                index=index,
+                name=test_case_name(request, mutations),
+                request=request.name,
+                data=request.render(mutation_context=context),
+            )
+
+
+def shard_ranges(total, shards):
+    """
+    Split test case indices 1..total into contiguous, disjoint (start, end) ranges.
+    Sizes differ by at most one; empty shards are dropped.
+    """
+    if total <= 0:
+        return []
+    shards = max(1, min(shards, total))
+    size, extra = divmod(total, shards)
+    ranges = []
+    start = 1
+    for shard in range(shards):
+        end = start + size - 1 + (1 if shard < extra else 0)
+        ranges.append((start, end))
+        start = end + 1
+    return ranges
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+MQTT Campaign Checkpoints
+
+A fuzzer restart used to start the campaign again from the first test case.
+With --checkpoint FILE, mqtt_fuzzer.py records its progress every few
+seconds: the campaign settings, the current request, the first test case
+not yet sent, the havoc RNG state and the hashes of the payload
+deduplicator. --resume continues at that case, with the same deduplication,
+so nothing already sent is sent again. Jumping to the case costs nothing
+(see mqtt_index). With --concurrency, cases finish out of order; progress is
+the first case that has not finished, and the cases in flight after it are
+sent again on resume.
+
+The file is written next to the old one and renamed over it, after an
+fsync, so a crash or power loss leaves either the previous checkpoint or
+the new one, never a torn file. Format: a magic line, one line of JSON, then
+the deduplicator's hashes as little-endian 64-bit integers.
+
+Run this module with a checkpoint file to print what it holds.
+"""
+
+import array
+import collections
+import json
+import os
+import sys
+import time
+
+
+CHECKPOINT_MAGIC = b"MQTT-FUZZ-CHECKPOINT 1\n"
+DEFAULT_CHECKPOINT_INTERVAL = 10.0
+
+# A case handed out by Checkpoint.track() and not yet done: where to resume to
+# send it again, the RNG state to resume with, and its deduplicator hash.
+PendingCase = collections.namedtuple("PendingCase", ["next_case", "rng_state", "digest", "request"])
+
+
+class Checkpoint:
+    """
+    Campaign progress, written to path at most every interval seconds.
+
+    Args:
+        path (str): Checkpoint file.
+        interval (float): Seconds between writes. Default 10.
+        dedup (PayloadDeduplicator): Deduplicator whose hashes are saved too. Default: none.
+        rng (random.Random): RNG whose state is saved too. Default: none.
+        **settings: Campaign settings saved with every write (mode, fuzz_all, request, ...).
+    """
+
+    def __init__(self, path, interval=DEFAULT_CHECKPOINT_INTERVAL, dedup=None, rng=None, **settings):
+        self.path = path
+        self.interval = interval
+        self.dedup = dedup
+        self.rng = rng
+        self.state = dict(settings)
+        self.saves = 0
+        self.save_time = 0.0
+        self._last_save = time.monotonic()
+        self._dedup_last = None
+        self._rng_state = None
+        self._pending = collections.OrderedDict()
+        self._next_pull = None
+
+    def update(self, **progress):
+        """Record progress; write the checkpoint if interval has passed since the last write."""
+        # The state after the recorded case, not after a case that is
+        # generated or sent later and then interrupted.
+        if self.dedup is not None:
+            self._dedup_last = self.dedup.last
+        if self.rng is not None:
+            self._rng_state = self.rng.getstate()
+        self._record(progress)
+
+    def _record(self, progress):
+        self.state.update(progress)
+        if time.monotonic() - self._last_save >= self.interval:
+            self.save()
+
+    def track(self, cases):
+        """
+        Yield TestCases, already filtered by the deduplicator if there is one,
+        to a consumer that may send several at once and calls done(case) for
+        each one it has sent. Progress only moves past a case once it is done.
+        """
+        cases = iter(cases)
+        self._next_pull = self.state.get("next_case", 1)
+        while True:
+            rng_state = self.rng.getstate() if self.rng is not None else None
+            case = next(cases, None)
+            if case is None:
+                return
+            digest = self.dedup.last if self.dedup is not None else None
+            self._pending[case.index] = PendingCase(self._next_pull, rng_state, digest, case.request)
+            self._dedup_last = digest
+            self._next_pull = case.index + 1
+            yield case
+
+    def done(self, case):
+        """Record that a case from track() was sent."""
+        self._pending.pop(case.index, None)
+        if self._pending:
+            first = next(iter(self._pending.values()))
+            next_case, self._rng_state, request = first.next_case, first.rng_state, first.request
+        else:
+            next_case, request = self._next_pull, case.request
+            if self.rng is not None:
+                self._rng_state = self.rng.getstate()
+        self._record(dict(case=next_case - 1, next_case=next_case, current_request=request))
+
+    def _unsent(self):
+        """Deduplicator hashes of payloads that were not sent as of the recorded progress."""
+        unsent = {pending.digest for pending in self._pending.values()}
+        if self.dedup.last != self._dedup_last:
+            # Generated after the last recorded case, then interrupted.
+            unsent.add(self.dedup.last)
+        return unsent
+
+    def save(self):
+        start = time.monotonic()
+        state = dict(self.state, saved_at=time.time())
+        if self.rng is not None:
+            version, internal, gauss_next = self._rng_state or self.rng.getstate()
+            state["rng"] = [version, list(internal), gauss_next]
+        if self.dedup is None:
+            hashes = array.array("Q")
+        else:
+            # Cases not sent (or not completely) are sent again on resume.
+            hashes = self.dedup.dump(exclude=self._unsent())
+        if sys.byteorder == "big":
+            hashes.byteswap()
+        state["dedup_hashes"] = len(hashes) if self.dedup is not None else None
+
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(CHECKPOINT_MAGIC)
+            f.write(json.dumps(state, sort_keys=True).encode() + b"\n")
+            f.write(hashes.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+        self.saves += 1
+        self._last_save = time.monotonic()
+        self.save_time += self._last_save - start
+
+    def summary(self):
+        mean = self.save_time / self.saves * 1000 if self.saves else 0.0
+        return (f"[*] Checkpoint: {self.saves} writes to {self.path} ({mean:.1f} ms each), "
+                f"last case {self.state.get('case', 0)}")
+
+
+def load_checkpoint(path):
+    """
+    Read a checkpoint file. Returns (state, hashes): the saved JSON state,
+    with "rng" turned back into a random.Random state, and the dedup hashes
+    as an array (None if none were saved).
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(CHECKPOINT_MAGIC):
+        raise ValueError(f"{path}: not a fuzzer checkpoint")
+    end = data.index(b"\n", len(CHECKPOINT_MAGIC))
+    state = json.loads(data[len(CHECKPOINT_MAGIC):end])
+    if state.get("rng") is not None:
+        version, internal, gauss_next = state["rng"]
+        state["rng"] = (version, tuple(internal), gauss_next)
+    hashes = None
+    if state.get("dedup_hashes") is not None:
+        hashes = array.array("Q")
+        hashes.frombytes(data[end + 1:])
+        if sys.byteorder == "big":
+            hashes.byteswap()
+        if len(hashes) != state["dedup_hashes"]:
+            raise ValueError(f"{path}: expected {state['dedup_hashes']} dedup hashes, found {len(hashes)}")
+    return state, hashes
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(f"usage: {sys.argv[0]} CHECKPOINT")
+        return 1
+    state, _ = load_checkpoint(sys.argv[1])
+    print(f"[*] {sys.argv[1]}, saved {time.ctime(state.pop('saved_at'))}")
+    state.pop("rng", None)
+    for key, value in sorted(state.items()):
+        print(f"  {key:<16} {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
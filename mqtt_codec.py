@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+MQTT Control Packet Framing
+
+Incremental decoder that splits a byte stream from a broker into whole MQTT
+3.1.1 control packets (Section 2.2: fixed header with a variable-length
+remaining length). Bytes are buffered in a bytearray and parsed through a
+memoryview, so partial reads can be fed as they arrive and nothing is copied
+until a packet is complete.
+"""
+
+import collections
+import select
+import time
+
+
+PACKET_TYPE_NAMES = {
+    1: "CONNECT",
+    2: "CONNACK",
+    3: "PUBLISH",
+    4: "PUBACK",
+    5: "PUBREC",
+    6: "PUBREL",
+    7: "PUBCOMP",
+    8: "SUBSCRIBE",
+    9: "SUBACK",
+    10: "UNSUBSCRIBE",
+    11: "UNSUBACK",
+    12: "PINGREQ",
+    13: "PINGRESP",
+    14: "DISCONNECT",
+}
+
+# At most four remaining length bytes, 268,435,455 (Section 2.2.3).
+MAX_REMAINING_LENGTH_BYTES = 4
+
+
+class MQTTPacket(collections.namedtuple("MQTTPacket", ["packet_type", "flags", "body"])):
+    """One decoded control packet: 4-bit type, 4-bit flags and the bytes after the fixed header."""
+
+    __slots__ = ()
+
+    @property
+    def name(self):
+        return PACKET_TYPE_NAMES.get(self.packet_type, f"RESERVED-{self.packet_type}")
+
+    def to_bytes(self):
+        """Re-encode the packet exactly as it appeared on the wire."""
+        return bytes([self.packet_type << 4 | self.flags]) + encode_remaining_length(len(self.body)) + self.body
+
+
+class MQTTDecodeError(ValueError):
+    """The stream is not valid MQTT framing (e.g. a remaining length over four bytes)."""
+
+
+def encode_remaining_length(length):
+    """Encode remaining length per MQTT spec Section 2.2.3."""
+    encoded = bytearray()
+    while True:
+        digit = length % 128
+        length = length // 128
+        if length > 0:
+            digit |= 0x80
+        encoded.append(digit)
+        if length == 0:
+            break
+    return bytes(encoded)
+
+
+def decode_remaining_length(buf, offset=1):
+    """
+    Decode the remaining length starting at buf[offset].
+    Returns (length, bytes used), or None if buf ends before the last length byte.
+    """
+    length = 0
+    multiplier = 1
+    for used in range(1, MAX_REMAINING_LENGTH_BYTES + 1):
+        if offset + used > len(buf):
+            return None
+        digit = buf[offset + used - 1]
+        length += (digit & 0x7F) * multiplier
+        if not digit & 0x80:
+            return length, used
+        multiplier *= 128
+    raise MQTTDecodeError("remaining length longer than four bytes")
+
+
+class MQTTPacketDecoder:
+    """
+    Incremental MQTT control packet decoder.
+
+    feed() any chunk of received bytes and get back every packet completed by
+    it. Bytes of a packet that has not fully arrived yet stay buffered.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.packets_decoded = 0
+
+    def feed(self, data):
+        """Append data and return the list of complete MQTTPackets it finished."""
+        self._buffer += data
+        packets = []
+        view = memoryview(self._buffer)
+        offset = 0
+        try:
+            while len(view) - offset >= 2:
+                header = decode_remaining_length(view, offset + 1)
+                if header is None:
+                    break
+                length, used = header
+                start = offset + 1 + used
+                end = start + length
+                if end > len(view):
+                    break
+                first = view[offset]
+                packets.append(MQTTPacket(first >> 4, first & 0x0F, bytes(view[start:end])))
+                offset = end
+        finally:
+            view.release()
+        if offset:
+            del self._buffer[:offset]
+        self.packets_decoded += len(packets)
+        return packets
+
+    @property
+    def pending(self):
+        """Number of buffered bytes belonging to a packet that is not complete yet."""
+        return len(self._buffer)
+
+    def reset(self):
+        self._buffer.clear()
+
+
+def collect_responses(sock, decoder=None, timeout=0.0, partial_timeout=0.1):
+    """
+    Read every complete packet the broker has sent on sock.
+
+    Waits up to timeout for the first bytes, then keeps reading only while a
+    packet is still partially buffered (for at most partial_timeout), so a
+    response that has fully arrived costs no extra wait.
+    Returns (packets, closed): closed is True on EOF or reset.
+    """
+    decoder = decoder or MQTTPacketDecoder()
+    packets = []
+    wait = timeout
+    deadline = None
+    while True:
+        try:
+            readable, _, _ = select.select([sock], [], [], wait)
+        except (OSError, ValueError):
+            return packets, True
+        if not readable:
+            return packets, False
+        try:
+            chunk = sock.recv(4096)
+        except OSError:
+            return packets, True
+        if not chunk:
+            return packets, True
+        try:
+            packets += decoder.feed(chunk)
+        except MQTTDecodeError:
+            decoder.reset()
+            return packets, False
+        if decoder.pending:
+            if deadline is None:
+                deadline = time.monotonic() + partial_timeout
+            wait = max(0.0, deadline - time.monotonic())
+        else:
+            wait = 0.0
+
+
+def describe(packets):
+    """Short human readable list of packet types, e.g. "CONNACK, SUBACK"."""
+    return ", ".join(packet.name for packet in packets)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+MQTT Fuzzer Connection Churn Management
+
+The stateless fuzzers open and close one TCP connection per test case. At
+1000+ cases/sec against a single broker port that exhausts the ephemeral
+port range: every actively closed connection parks its 4-tuple in TIME_WAIT
+for a minute. Two knobs avoid that:
+
+- abort close: SO_LINGER with a zero timeout makes close() send RST, so the
+  connection skips TIME_WAIT entirely.
+- source address rotation: binding each connection to the next of several
+  local addresses (on Linux all of 127.0.0.0/8 is routed to lo, no alias
+  configuration needed) multiplies the usable 4-tuples per broker port.
+
+ConnectionManager applies both and counts what happens; ChurnTCPConnection
+plugs it into boofuzz sessions, AsyncFuzzEngine uses it directly.
+"""
+
+from boofuzz import exception
+from mqtt_streaming import StreamingTCPConnection
+import errno
+import ipaddress
+import itertools
+import socket
+import struct
+import sys
+import time
+
+
+# Linux only: let connect() pick the port for a bound address (4-tuple
+# uniqueness) instead of bind() reserving one per address (2-tuple).
+IP_BIND_ADDRESS_NO_PORT = getattr(socket, "IP_BIND_ADDRESS_NO_PORT", 24)
+
+# errnos meaning the local side ran out of ports, not that the broker is down
+LOCAL_EXHAUSTION_ERRNOS = (errno.EADDRNOTAVAIL, errno.EADDRINUSE)
+
+
+def loopback_aliases(count, first="127.0.0.1"):
+    """Return count consecutive loopback addresses starting at first."""
+    start = ipaddress.IPv4Address(first)
+    return [str(start + i) for i in range(count)]
+
+
+class ConnectionManager:
+    """
+    Prepares fuzzer sockets for high connection churn and keeps counters.
+
+    Args:
+        abort_close (bool): Close connections with RST (SO_LINGER 0) instead of FIN, leaving no TIME_WAIT.
+        source_addresses (list): Local addresses to bind outgoing connections to, used in rotation.
+    """
+
+    def __init__(self, abort_close=False, source_addresses=None):
+        self.abort_close = abort_close
+        self.source_addresses = list(source_addresses or [])
+        self._sources = itertools.cycle(self.source_addresses) if self.source_addresses else None
+
+        self.connects = 0
+        self.connect_failures = 0
+        self.ports_exhausted = 0
+        self.aborts = 0
+        self.closes = 0
+        self.start_time = time.time()
+
+    def prepare(self, sock):
+        """Apply linger and source address settings to a new, unconnected socket."""
+        if self.abort_close:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        if self._sources is not None:
+            if sys.platform.startswith("linux"):
+                sock.setsockopt(socket.IPPROTO_IP, IP_BIND_ADDRESS_NO_PORT, 1)
+            sock.bind((next(self._sources), 0))
+        return sock
+
+    def create_socket(self, blocking=True):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(blocking)
+        return self.prepare(sock)
+
+    def record_connect(self, error=None):
+        """Count a connect attempt; error is the OSError it failed with, if any."""
+        if error is None:
+            self.connects += 1
+        elif getattr(error, "errno", None) in LOCAL_EXHAUSTION_ERRNOS:
+            self.ports_exhausted += 1
+        else:
+            self.connect_failures += 1
+
+    def record_close(self):
+        if self.abort_close:
+            self.aborts += 1
+        else:
+            self.closes += 1
+
+    @property
+    def connect_rate(self):
+        elapsed = time.time() - self.start_time
+        return self.connects / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        sources = len(self.source_addresses) or 1
+        return (
+            f"[*] Connections: {self.connects} connects ({self.connect_rate:.1f}/sec) from {sources} source "
+            f"address(es), {self.aborts} closed with RST, {self.closes} closed with FIN, "
+            f"{self.connect_failures} failed, {self.ports_exhausted} local port exhaustion errors"
+        )
+
+
+class ChurnTCPConnection(StreamingTCPConnection):
+    """
+    StreamingTCPConnection whose sockets are prepared by a ConnectionManager.
+    Local port exhaustion is reported as BoofuzzOutOfAvailableSockets rather
+    than as an unexpected socket error. Other failed connects are fed into
+    the optional AdaptivePacer as refused connects.
+    """
+
+    def __init__(self, host, port, manager, send_timeout=5.0, recv_timeout=5.0, pacer=None):
+        super(ChurnTCPConnection, self).__init__(host, port, send_timeout, recv_timeout)
+        self.manager = manager
+        self.pacer = pacer
+        self._connected = False
+
+    def _open_socket(self):
+        super(ChurnTCPConnection, self)._open_socket()
+        try:
+            self.manager.prepare(self._sock)
+        except OSError as e:
+            self.manager.record_connect(e)
+            if e.errno in LOCAL_EXHAUSTION_ERRNOS:
+                raise exception.BoofuzzOutOfAvailableSockets()
+            raise
+
+    def _connect_socket(self):
+        try:
+            self._sock.connect((self.host, self.port))
+        except OSError as e:
+            self.manager.record_connect(e)
+            if e.errno in LOCAL_EXHAUSTION_ERRNOS:
+                raise exception.BoofuzzOutOfAvailableSockets()
+            if self.pacer is not None:
+                self.pacer.record_refused()
+            if e.errno in [errno.ECONNREFUSED, errno.EINPROGRESS, errno.ETIMEDOUT]:
+                raise exception.BoofuzzTargetConnectionFailedError(str(e))
+            raise
+        self.manager.record_connect()
+        self._connected = True
+
+    def close(self):
+        if self._connected:
+            self.manager.record_close()
+            self._connected = False
+        super(ChurnTCPConnection, self).close()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+MQTT Pre-rendered Test Case Corpus
+
+Renders every test case once into an append-only binary corpus file, so a
+campaign against a new broker build only costs socket I/O.
+
+Corpus file layout (little endian):
+
+    magic   8 bytes  b"MQTTCORP"
+    version u32
+    records, each:
+        index    u32  boofuzz test case index
+        name_len u16
+        data_len u32
+        name     name_len bytes (UTF-8 test case name)
+        data     data_len bytes (rendered packet)
+
+The offset index lives next to the corpus as "<corpus>.idx": a flat array of
+u64 record offsets. If it is missing it is rebuilt by scanning the corpus.
+"""
+
+from mqtt_cases import TestCase
+import array
+import mmap
+import struct
+import sys
+
+
+CORPUS_MAGIC = b"MQTTCORP"
+CORPUS_VERSION = 1
+
+_HEADER = struct.Struct("<8sI")
+_RECORD = struct.Struct("<IHI")
+
+
+def index_path(path):
+    return path + ".idx"
+
+
+def compile_corpus(cases, path):
+    """
+    Write every TestCase from the iterable into a corpus file and its offset index.
+    Returns the number of cases written.
+    """
+    offsets = array.array("Q")
+    with open(path, "wb") as f:
+        f.write(_HEADER.pack(CORPUS_MAGIC, CORPUS_VERSION))
+        offset = _HEADER.size
+        for case in cases:
+            name = case.name.encode("utf-8")
+            f.write(_RECORD.pack(case.index, len(name), len(case.data)))
+            f.write(name)
+            f.write(case.data)
+            offsets.append(offset)
+            offset += _RECORD.size + len(name) + len(case.data)
+
+    _write_index(path, offsets)
+    return len(offsets)
+
+
+def _write_index(path, offsets):
+    if sys.byteorder != "little":
+        offsets.byteswap()
+    with open(index_path(path), "wb") as f:
+        offsets.tofile(f)
+
+
+class Corpus:
+    """
+    Read-only, memory-mapped view of a compiled corpus.
+
+    Test case data is returned as memoryview slices of the mapping, so
+    replaying a case never copies or re-renders it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+        magic, version = _HEADER.unpack_from(self._map, 0)
+        if magic != CORPUS_MAGIC or version != CORPUS_VERSION:
+            raise ValueError(f"{path}: not an MQTT corpus (version {CORPUS_VERSION})")
+
+        self._offsets = self._load_index()
+
+    def _load_index(self):
+        offsets = array.array("Q")
+        try:
+            with open(index_path(self.path), "rb") as f:
+                offsets.frombytes(f.read())
+            if sys.byteorder != "little":
+                offsets.byteswap()
+            return offsets
+        except FileNotFoundError:
+            pass
+
+        print(f"[*] No index for {self.path}, rebuilding")
+        offset = _HEADER.size
+        while offset < len(self._map):
+            offsets.append(offset)
+            _, name_len, data_len = _RECORD.unpack_from(self._map, offset)
+            offset += _RECORD.size + name_len + data_len
+        _write_index(self.path, array.array("Q", offsets))
+        return offsets
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, position):
+        offset = self._offsets[position]
+        index, name_len, data_len = _RECORD.unpack_from(self._map, offset)
+        name_start = offset + _RECORD.size
+        data_start = name_start + name_len
+        name = bytes(self._view[name_start:data_start]).decode("utf-8")
+        return TestCase(
+            index=index,
+            name=name,
+            request=name.split(":", 1)[0],
+            data=self._view[data_start:data_start + data_len],
+        )
+
+    def iter_test_cases(self, request_name=None, index_start=1, index_end=None):
+        """Yield TestCases in corpus order, optionally filtered by request and index."""
+        for position in range(len(self)):
+            case = self[position]
+            if case.index < index_start:
+                continue
+            if index_end is not None and case.index > index_end:
+                return
+            if request_name and case.request != request_name:
+                continue
+            yield case
+
+    def close(self):
+        """Unmap the corpus. Fails if memoryviews of test case data are still alive."""
+        self._view.release()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self.close()
+        except BufferError:
+            pass  # case data still referenced; the mapping goes away with the process
+        return False
+
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+MQTT Coverage-Guided Fuzzing
+
+A broker built with COVERAGE=1 (see Dockerfile.mosquitto-asan and
+Dockerfile.nanomq-asan) counts every edge it executes in a shared bitmap:
+65536 one-byte hit counters in /dev/shm/mqtt-coverage, written by the
+SanitizerCoverage callbacks in sancov_bitmap.c.
+
+The fuzzer maps the same file. The map is cleared before each test case
+and read after the broker has answered. Hit counts are folded into
+AFL-style buckets (1, 2, 3, 4-7, 8-15, 16-31, 32-127, 128+), so a loop that
+runs more often also counts as new behaviour. A test case whose buckets
+were never seen before is interesting.
+
+CoverageGuide feeds the asyncio engine (with one case in flight, so every
+map reading belongs to exactly one case). It starts with the regular
+boofuzz test cases. Interesting cases go into a queue ordered by how much
+new coverage they found. Before continuing with the regular cases, it
+expands the best queued case: its mutations are kept and one mutation of
+each other field of the same request is added in turn, up to
+expansion_budget cases and max_depth mutations per case. Expansions that
+find new coverage are queued as well.
+"""
+
+from boofuzz.mutation_context import MutationContext
+from mqtt_cases import TestCase, test_case_name
+import heapq
+import itertools
+import mmap
+import os
+
+
+COVERAGE_MAP_SIZE = 1 << 16
+DEFAULT_COVERAGE_MAP = "/dev/shm/mqtt-coverage"
+
+# Hit count -> bucket bit, as in AFL.
+_BUCKETS = bytes(
+    0 if n == 0 else
+    1 if n == 1 else
+    2 if n == 2 else
+    4 if n == 3 else
+    8 if n < 8 else
+    16 if n < 16 else
+    32 if n < 32 else
+    64 if n < 128 else
+    128
+    for n in range(256)
+)
+
+
+class CoverageMap:
+    """
+    The broker's edge hit counters, memory-mapped from the shared file.
+
+    Args:
+        path (str): Bitmap file shared with the broker. Default /dev/shm/mqtt-coverage.
+        size (int): Number of counters. Default 65536.
+    """
+
+    def __init__(self, path=DEFAULT_COVERAGE_MAP, size=COVERAGE_MAP_SIZE):
+        self.path = path
+        self.size = size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        self._zeros = bytes(size)
+
+    def reset(self):
+        self._map[:] = self._zeros
+
+    def read(self):
+        """Current counters, folded into bucket bits."""
+        return self._map[:].translate(_BUCKETS)
+
+    def close(self):
+        self._map.close()
+
+
+class CoverageTracker:
+    """Bucket bits seen so far in the campaign."""
+
+    def __init__(self):
+        self._seen = 0
+        self.edges = 0
+        self.cases = 0
+        self.interesting = 0
+
+    def observe(self, buckets):
+        """Record the bucket bits of one test case; return how many were never seen before."""
+        self.cases += 1
+        current = int.from_bytes(buckets, "little")
+        new = current & ~self._seen
+        if not new:
+            return 0
+        self._seen |= current
+        self.edges = len(buckets) - self._seen.to_bytes(len(buckets), "little").count(0)
+        self.interesting += 1
+        return new.bit_count()
+
+    def summary(self):
+        return (f"[*] Coverage: {self.edges} edges covered, {self.interesting} of {self.cases} test cases "
+                f"found new coverage")
+
+
+# =============================================================================
+# Guided case source
+# =============================================================================
+
+class CoverageGuide:
+    """
+    Test case source and AsyncFuzzEngine feedback that prefers expanding
+    cases which found new coverage over walking on.
+
+    Args:
+        requests (list): Requests to fuzz.
+        coverage_map (CoverageMap): The broker's shared bitmap.
+        expansion_budget (int): Cases derived from each interesting case. Default 256.
+        max_depth (int): Most mutations combined in one case. Default 3.
+    """
+
+    def __init__(self, requests, coverage_map, expansion_budget=256, max_depth=3):
+        self.requests = requests
+        self.coverage_map = coverage_map
+        self.expansion_budget = expansion_budget
+        self.max_depth = max_depth
+        self.tracker = CoverageTracker()
+        self.expanded = 0
+        self._queue = []
+        self._sequence = itertools.count()
+        self._last = None
+        self._index = 0
+
+    # Feedback -----------------------------------------------------------------
+
+    def before_case(self, case):
+        self.coverage_map.reset()
+
+    def after_case(self, case, responses):
+        new = self.tracker.observe(self.coverage_map.read())
+        # Cases are generated one at a time, so the last one generated is the one sent
+        # (unless the engine is resending a case after an outage).
+        if new and self._last is not None and self._last[0] == case.index:
+            _, request, mutations = self._last
+            if len(mutations) < self.max_depth:
+                heapq.heappush(self._queue, (-new, next(self._sequence), request, mutations))
+
+    # Cases ------------------------------------------------------------------
+
+    def cases(self):
+        """Yield TestCases: queued expansions first, then the next regular boofuzz case."""
+        regular = self._regular()
+        while True:
+            while self._queue:
+                _, _, request, mutations = heapq.heappop(self._queue)
+                for case in self._expand(request, mutations):
+                    self.expanded += 1
+                    yield case
+            case = next(regular, None)
+            if case is None:
+                return
+            yield case
+
+    def _regular(self):
+        for request in self.requests:
+            for mutations in request.get_mutations():
+                yield self._case(request, mutations)
+
+    def _expand(self, request, mutations):
+        """One more mutation of every other field, round robin, up to expansion_budget cases."""
+        taken = {m.qualified_name for m in mutations}
+        fields = [
+            item.get_mutations() for item in request.walk()
+            if item.fuzzable and item.qualified_name not in taken
+        ]
+        count = 0
+        while fields and count < self.expansion_budget:
+            for field in list(fields):
+                extra = next(field, None)
+                if extra is None:
+                    fields.remove(field)
+                    continue
+                yield self._case(request, list(mutations) + extra)
+                count += 1
+                if count >= self.expansion_budget:
+                    return
+
+    def _case(self, request, mutations):
+        self._index += 1
+        self._last = (self._index, request, mutations)
+        context = MutationContext(mutations={m.qualified_name: m for m in mutations})
+        return TestCase(
+            index=self._index,
+            name=test_case_name(request, mutations),
+            request=request.name,
+            data=request.render(mutation_context=context),
+        )
+
+    def summary(self):
+        return f"{self.tracker.summary()}, {self.expanded} test cases derived from them"
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+MQTT Test Case Deduplication
+
+Different Requests often render to the same bytes: mutating packet_type of
+MQTT-CONNECT, MQTT-Zero-Length and MQTT-Duplicate-CONNECT, or of the
+PUBACK/PUBREC/PUBCOMP trio, produces identical packets once the other
+fields are at their defaults. Sending the same bytes twice over a fresh
+connection tests nothing new.
+
+PayloadDeduplicator remembers a 64-bit BLAKE2b hash of every payload sent in
+the campaign and reports repeats; DedupSession applies it to a boofuzz
+Session, skipping a repeated test case before any connection is opened.
+"""
+
+from boofuzz import Session
+import array
+import hashlib
+
+
+def payload_hash(data, context=b""):
+    """64-bit content hash of a rendered payload, including the segments of a streamed one."""
+    digest = hashlib.blake2b(context, digest_size=8)
+    digest.update(data)
+    segments = getattr(data, "segments", None)
+    if segments:
+        digest.update(repr(segments).encode())
+    return int.from_bytes(digest.digest(), "little")
+
+
+class PayloadDeduplicator:
+    """
+    Remembers which rendered payloads were already sent in this campaign.
+
+    Only 8-byte hashes are kept, not the payloads; a false "already sent"
+    needs a 64-bit collision, which is negligible for the few million cases
+    of a campaign.
+    """
+
+    def __init__(self):
+        self._seen = set()
+        self.checked = 0
+        self.skipped = 0
+        self.bytes_skipped = 0
+        self.last = None
+
+    def is_duplicate(self, data, context=b""):
+        """Record data and return True if the same bytes were seen before (in the same context)."""
+        self.checked += 1
+        digest = payload_hash(data, context)
+        if digest in self._seen:
+            self.skipped += 1
+            self.bytes_skipped += len(data)
+            return True
+        self._seen.add(digest)
+        self.last = digest
+        return False
+
+    def filter(self, test_cases):
+        """Yield only the TestCases (see mqtt_cases) whose data was not seen before."""
+        for case in test_cases:
+            if not self.is_duplicate(case.data):
+                yield case
+
+    def dump(self, exclude=None):
+        """
+        The hashes seen so far, as an array of 64-bit integers (for
+        checkpoints), without the hashes in the set exclude.
+        """
+        if not exclude or self._seen.isdisjoint(exclude):
+            return array.array("Q", self._seen)
+        return array.array("Q", self._seen - exclude)
+
+    def load(self, hashes):
+        """Add hashes from dump(), e.g. when resuming a campaign."""
+        self._seen.update(hashes)
+
+    def __len__(self):
+        return len(self._seen)
+
+    def summary(self):
+        percent = self.skipped / self.checked * 100 if self.checked else 0.0
+        return (
+            f"[*] Dedup: skipped {self.skipped} of {self.checked} test cases ({percent:.1f}%) as repeats "
+            f"of an earlier payload, {self.bytes_skipped} bytes not sent"
+        )
+
+
+class DedupSession(Session):
+    """
+    boofuzz Session that skips test cases whose rendered fuzz node repeats an
+    earlier one. The message path is part of the key, so identical bytes sent
+    after different prerequisite messages are still fuzzed.
+
+    Args:
+        dedup (PayloadDeduplicator): Deduplicator to use; default: a new one.
+        All other arguments are passed to Session.
+    """
+
+    def __init__(self, dedup=None, *args, **kwargs):
+        super(DedupSession, self).__init__(*args, **kwargs)
+        self.dedup = dedup if dedup is not None else PayloadDeduplicator()
+
+    def _main_fuzz_loop(self, fuzz_case_iterator):
+        super(DedupSession, self)._main_fuzz_loop(self._unique_cases(fuzz_case_iterator))
+
+    def _unique_cases(self, fuzz_case_iterator):
+        """
+        Drop repeated test cases before the fuzz loop sees them, so they count
+        neither as fuzzed cases nor towards restart_interval.
+        """
+        for mutation_context in fuzz_case_iterator:
+            if self.total_mutant_index >= self._index_start and self._is_repeat(mutation_context):
+                if self._index_end is not None and self.total_mutant_index >= self._index_end:
+                    return
+                continue
+            yield mutation_context
+
+    def _is_repeat(self, mutation_context):
+        path = "/".join(self.nodes[edge.dst].name for edge in mutation_context.message_path[:-1])
+        data = self.fuzz_node.render(mutation_context=mutation_context)
+        return self.dedup.is_duplicate(data, context=path.encode() + b"\x00")
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+MQTT Token Dictionary
+
+Byte strings that mean something to an MQTT parser: protocol names and
+levels, topic wildcard fragments, flag bytes and UTF-8 sequences that
+Section 1.5.3 forbids or that decoders get wrong. Generic string mutations
+reach these only by chance; string fields built with a dictionary (see
+mqtt_primitives) try them before anything else, and havoc mode splices them
+into packets.
+
+Extra tokens can be loaded from an AFL/libFuzzer dictionary file
+(name="value" lines with \\xNN escapes) with load_dictionary().
+"""
+
+import collections
+import itertools
+import re
+import sys
+
+
+PROTOCOL_NAMES = (
+    b"MQTT",
+    b"MQIsdp",          # MQTT 3.1
+    b"mqtt",
+    b"MQTT\x00",
+    b"MQT",
+    b"MQTTT",
+    b"MQIsd",
+)
+
+PROTOCOL_LEVELS = (
+    b"\x00",
+    b"\x03",            # 3.1
+    b"\x04",            # 3.1.1
+    b"\x05",            # 5.0
+    b"\x06",
+    b"\x7f",
+    b"\x80",
+    b"\xff",
+)
+
+WILDCARDS = (
+    b"#", b"+", b"/",
+    b"$SYS/", b"$SYS/#", b"$SYS/+", b"$", b"$share/", b"$share/g/#", b"$share//#",
+    b"+/#", b"+/+", b"#/", b"#/+", b"/#", b"/+", b"//", b"///", b"+#", b"#+", b"##", b"++",
+    b"a+", b"+a", b"a#", b"#a", b"a/#/b", b"a/+b/c",
+)
+
+# Connect flags and fixed header flags: reserved bits, will QoS 3, password without
+# username, and the PUBLISH DUP/QoS/RETAIN combinations.
+FLAG_BYTES = (
+    b"\x01", b"\x02", b"\x04", b"\x06", b"\x18", b"\x1c", b"\x20", b"\x3e", b"\x40", b"\x80", b"\xc2",
+    b"\xce", b"\xf6", b"\xfe", b"\xff",
+    b"\x30", b"\x31", b"\x38", b"\x3b", b"\x3f",
+)
+
+UTF8_EDGES = (
+    b"\x00",                    # U+0000, not allowed in MQTT strings
+    b"\xc0\x80",                # overlong U+0000
+    b"\xc0\xaf",                # overlong '/'
+    b"\xe0\x80\xaf",            # overlong '/', three bytes
+    b"\xf0\x80\x80\xaf",        # overlong '/', four bytes
+    b"\xc0\xa3",                # overlong '#'
+    b"\xc0\xab",                # overlong '+'
+    b"\xed\xa0\x80",            # U+D800, high surrogate
+    b"\xed\xbf\xbf",            # U+DFFF, low surrogate
+    b"\xed\xa0\x80\xed\xb0\x80",  # surrogate pair encoded as two code points
+    b"\xef\xbb\xbf",            # U+FEFF, must not be skipped or stripped
+    b"\xef\xbf\xbe",            # U+FFFE, noncharacter
+    b"\xef\xbf\xbf",            # U+FFFF, noncharacter
+    b"\xf4\x8f\xbf\xbf",        # U+10FFFF, the last code point
+    b"\xf4\x90\x80\x80",        # past U+10FFFF
+    b"\x01", b"\x1f", b"\x7f",  # control characters
+    b"\xc2\x80", b"\xc2\x9f",   # C1 control characters
+    b"\x80", b"\xbf",           # lone continuation bytes
+    b"\xc2", b"\xe0\xa0", b"\xf0\x90\x80",  # truncated sequences
+    b"\xf8\x88\x80\x80\x80",    # five-byte form
+    b"\xfe", b"\xff",           # never valid in UTF-8
+)
+
+TOKEN_CATEGORIES = collections.OrderedDict((
+    ("protocol_names", PROTOCOL_NAMES),
+    ("protocol_levels", PROTOCOL_LEVELS),
+    ("wildcards", WILDCARDS),
+    ("flags", FLAG_BYTES),
+    ("utf8", UTF8_EDGES),
+))
+
+
+_DICTIONARY_LINE = re.compile(r'^\s*(?:[\w.-]+\s*=\s*)?"(.*)"\s*$')
+
+
+def load_dictionary(path):
+    """Tokens of an AFL/libFuzzer dictionary file: name="value" lines, \\xNN escapes, # comments."""
+    tokens = []
+    with open(path, encoding="latin-1") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            match = _DICTIONARY_LINE.match(line)
+            if match is None:
+                raise ValueError(f"{path}:{number}: not a dictionary entry")
+            tokens.append(match.group(1).encode("latin-1").decode("unicode_escape").encode("latin-1"))
+    return tokens
+
+
+class MQTTDictionary:
+    """
+    Ordered, duplicate-free selection of MQTT tokens.
+
+    Args:
+        categories (iterable): Names from TOKEN_CATEGORIES to include. Default: all of them.
+        extra (iterable): More tokens (bytes). Default: none.
+    """
+
+    def __init__(self, categories=None, extra=()):
+        categories = list(TOKEN_CATEGORIES) if categories is None else list(categories)
+        unknown = [name for name in categories if name not in TOKEN_CATEGORIES]
+        if unknown:
+            raise ValueError(f"Unknown token categories: {', '.join(unknown)}")
+        self.categories = categories
+        self.extra = tuple(extra)
+        tokens = [token for name in categories for token in TOKEN_CATEGORIES[name]]
+        self.tokens = tuple(dict.fromkeys(tokens + list(self.extra)))
+
+    def extended(self, extra):
+        """A copy of this dictionary with the tokens extra (bytes) added."""
+        return MQTTDictionary(self.categories, self.extra + tuple(extra))
+
+    def values(self, default_value):
+        """Every token on its own, then appended to and prepended to default_value (bytes)."""
+        seen = set()
+        for value in itertools.chain(
+            self.tokens,
+            (default_value + token for token in self.tokens),
+            (token + default_value for token in self.tokens),
+        ):
+            if value not in seen:
+                seen.add(value)
+                yield value
+
+    def num_values(self, default_value):
+        return sum(1 for _ in self.values(default_value))
+
+    def __len__(self):
+        return len(self.tokens)
+
+
+def main():
+    print(f"[*] {sum(len(tokens) for tokens in TOKEN_CATEGORIES.values())} built-in tokens")
+    for name, tokens in TOKEN_CATEGORIES.items():
+        print(f"  {name:<16} {len(tokens):>3}  {b' '.join(tokens)[:60]!r}")
+    for path in sys.argv[1:]:
+        print(f"  {path}: {len(load_dictionary(path))} tokens")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
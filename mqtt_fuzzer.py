@@ -11,19 +11,40 @@ Protocol reference: https://docs.oasis-open.org/mqtt/mqtt/v3.1.1/os/mqtt-v3.1.1-
 from boofuzz import (
     Session,
     Target,
-    TCPSocketConnection,
     Request,
     Block,
     Byte,
     Bytes,
     Word,
-    String,
     Static,
     s_get,
     BIG_ENDIAN,
 )
+from boofuzz.constants import RESULTS_DIR
+from mqtt_async import AsyncFuzzEngine
+from mqtt_codec import collect_responses, describe
+from mqtt_connections import ChurnTCPConnection, ConnectionManager, loopback_aliases
+from mqtt_corpus import Corpus, compile_corpus
+from mqtt_coverage import DEFAULT_COVERAGE_MAP, CoverageGuide, CoverageMap
+from mqtt_dedup import DedupSession, PayloadDeduplicator
+from mqtt_dictionary import MQTTDictionary, load_dictionary
+from mqtt_havoc import DEFAULT_CPU_BUDGET, HavocMutator, havoc_seeds
+from mqtt_index import CaseIndex, fuzz_range, session_requests
+from mqtt_pacing import AdaptivePacer
+from mqtt_primitives import (DEFAULT_LIE_BUDGET, DictionaryBytes, LengthPrefix, RemainingLength, SharedString,
+                             add_dictionary_tokens, set_lie_budget)
+from mqtt_results import DEFAULT_RING_SIZE, BatchedFuzzLoggerDb, batch_results
+from mqtt_scheduler import DEFAULT_SLICE_TIME, RequestScheduler
+from mqtt_streaming import StreamedPacket, StreamedPayload, StreamedRequest, StreamingTCPConnection
+from mqtt_templates import TemplateRequest
+from mqtt_sweep import SWEEP_FIELDS, find_sweep_fields, iter_sweep_cases, num_sweep_cases
+from mqtt_cases import iter_test_cases, num_test_cases, select_requests, shard_ranges
+from mqtt_checkpoint import DEFAULT_CHECKPOINT_INTERVAL, Checkpoint, load_checkpoint
 import argparse
+import multiprocessing
+import os
 import sys
+import time
 
 
 # =============================================================================
@@ -66,11 +87,11 @@ def define_mqtt_connect():
         # Fixed Header
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_CONNECT, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x00, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         # Variable Header
         Block("Variable-Header", children=(
-            Word(name="protocol_name_length", default_value=0x0004, endian=BIG_ENDIAN, fuzzable=True),
+            LengthPrefix(name="protocol_name_length", string_name="protocol_name", fuzzable=True),
             Static(name="protocol_name", default_value=MQTT_PROTOCOL_NAME),
             Byte(name="protocol_level", default_value=MQTT_PROTOCOL_LEVEL, fuzzable=True),
             Byte(name="connect_flags", default_value=0x02, fuzzable=True),  # Clean Session
@@ -78,8 +99,8 @@ def define_mqtt_connect():
         )),
         # Payload
         Block("Payload", children=(
-            Word(name="client_id_length", default_value=0x0007, endian=BIG_ENDIAN, fuzzable=True),
-            String(name="client_id", default_value="fuzzer1", fuzzable=True, max_len=65535),
+            LengthPrefix(name="client_id_length", string_name="client_id", fuzzable=True),
+            SharedString(name="client_id", default_value="fuzzer1", fuzzable=True, max_len=65535),
         )),
     ))
 
@@ -92,10 +113,10 @@ def define_mqtt_connect_full():
     return Request("MQTT-CONNECT-Full", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_CONNECT, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x00, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
-            Word(name="protocol_name_length", default_value=0x0004, endian=BIG_ENDIAN, fuzzable=True),
+            LengthPrefix(name="protocol_name_length", string_name="protocol_name", fuzzable=True),
             Static(name="protocol_name", default_value=MQTT_PROTOCOL_NAME),
             Byte(name="protocol_level", default_value=MQTT_PROTOCOL_LEVEL, fuzzable=True),
             # Flags: Username(1) + Password(1) + Will Retain(1) + Will QoS 2(10) + Will(1) + Clean(1)
@@ -104,20 +125,20 @@ def define_mqtt_connect_full():
         )),
         Block("Payload", children=(
             # Client ID
-            Word(name="client_id_length", default_value=0x0008, endian=BIG_ENDIAN, fuzzable=True),
-            String(name="client_id", default_value="fuzzfull", fuzzable=True, max_len=65535),
+            LengthPrefix(name="client_id_length", string_name="client_id", fuzzable=True),
+            SharedString(name="client_id", default_value="fuzzfull", fuzzable=True, max_len=65535),
             # Will Topic
-            Word(name="will_topic_length", default_value=0x000A, endian=BIG_ENDIAN, fuzzable=True),
-            String(name="will_topic", default_value="will/topic", fuzzable=True, max_len=65535),
+            LengthPrefix(name="will_topic_length", string_name="will_topic", fuzzable=True),
+            SharedString(name="will_topic", default_value="will/topic", fuzzable=True, max_len=65535),
             # Will Message
-            Word(name="will_message_length", default_value=0x000C, endian=BIG_ENDIAN, fuzzable=True),
-            String(name="will_message", default_value="will message", fuzzable=True, max_len=65535),
+            LengthPrefix(name="will_message_length", string_name="will_message", fuzzable=True),
+            SharedString(name="will_message", default_value="will message", fuzzable=True, max_len=65535),
             # Username
-            Word(name="username_length", default_value=0x0008, endian=BIG_ENDIAN, fuzzable=True),
-            String(name="username", default_value="testuser", fuzzable=True, max_len=65535),
+            LengthPrefix(name="username_length", string_name="username", fuzzable=True),
+            SharedString(name="username", default_value="testuser", fuzzable=True, max_len=65535),
             # Password
-            Word(name="password_length", default_value=0x0008, endian=BIG_ENDIAN, fuzzable=True),
-            String(name="password", default_value="testpass", fuzzable=True, max_len=65535),
+            LengthPrefix(name="password_length", string_name="password", fuzzable=True),
+            SharedString(name="password", default_value="testpass", fuzzable=True, max_len=65535),
         )),
     ))
 
@@ -130,15 +151,15 @@ def define_mqtt_publish_qos0():
     return Request("MQTT-PUBLISH-QoS0", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_PUBLISH, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x00, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
-            Word(name="topic_length", default_value=0x000A, endian=BIG_ENDIAN, fuzzable=True),
-            String(name="topic_name", default_value="test/topic", fuzzable=True, max_len=65535),
+            LengthPrefix(name="topic_length", string_name="topic_name", fuzzable=True),
+            SharedString(name="topic_name", default_value="test/topic", fuzzable=True, max_len=65535),
             # No Packet Identifier for QoS 0
         )),
         Block("Payload", children=(
-            String(name="application_message", default_value="Hello MQTT", fuzzable=True, max_len=65535),
+            SharedString(name="application_message", default_value="Hello MQTT", fuzzable=True, max_len=65535),
         )),
     ))
 
@@ -152,15 +173,15 @@ def define_mqtt_publish_qos1():
         Block("Fixed-Header", children=(
             # PUBLISH + QoS 1 (0x32 = 0x30 | 0x02)
             Byte(name="packet_type", default_value=0x32, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x00, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
-            Word(name="topic_length", default_value=0x000B, endian=BIG_ENDIAN, fuzzable=True),
-            String(name="topic_name", default_value="test/topic1", fuzzable=True, max_len=65535),
+            LengthPrefix(name="topic_length", string_name="topic_name", fuzzable=True),
+            SharedString(name="topic_name", default_value="test/topic1", fuzzable=True, max_len=65535),
             Word(name="packet_identifier", default_value=0x0001, endian=BIG_ENDIAN, fuzzable=True),
         )),
         Block("Payload", children=(
-            String(name="application_message", default_value="QoS 1 Message", fuzzable=True, max_len=65535),
+            SharedString(name="application_message", default_value="QoS 1 Message", fuzzable=True, max_len=65535),
         )),
     ))
 
@@ -174,15 +195,15 @@ def define_mqtt_publish_qos2():
         Block("Fixed-Header", children=(
             # PUBLISH + QoS 2 (0x34 = 0x30 | 0x04)
             Byte(name="packet_type", default_value=0x34, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x00, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
-            Word(name="topic_length", default_value=0x000B, endian=BIG_ENDIAN, fuzzable=True),
-            String(name="topic_name", default_value="test/topic2", fuzzable=True, max_len=65535),
+            LengthPrefix(name="topic_length", string_name="topic_name", fuzzable=True),
+            SharedString(name="topic_name", default_value="test/topic2", fuzzable=True, max_len=65535),
             Word(name="packet_identifier", default_value=0x0002, endian=BIG_ENDIAN, fuzzable=True),
         )),
         Block("Payload", children=(
-            String(name="application_message", default_value="QoS 2 Message", fuzzable=True, max_len=65535),
+            SharedString(name="application_message", default_value="QoS 2 Message", fuzzable=True, max_len=65535),
         )),
     ))
 
@@ -195,14 +216,14 @@ def define_mqtt_subscribe():
     return Request("MQTT-SUBSCRIBE", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_SUBSCRIBE, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x00, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
             Word(name="packet_identifier", default_value=0x0001, endian=BIG_ENDIAN, fuzzable=True),
         )),
         Block("Payload", children=(
-            Word(name="topic_filter_length", default_value=0x000A, endian=BIG_ENDIAN, fuzzable=True),
-            String(name="topic_filter", default_value="test/topic", fuzzable=True, max_len=65535),
+            LengthPrefix(name="topic_filter_length", string_name="topic_filter", fuzzable=True),
+            SharedString(name="topic_filter", default_value="test/topic", fuzzable=True, max_len=65535),
             Byte(name="requested_qos", default_value=0x00, fuzzable=True),
         )),
     ))
@@ -216,23 +237,23 @@ def define_mqtt_subscribe_multi():
     return Request("MQTT-SUBSCRIBE-Multi", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_SUBSCRIBE, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x00, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
             Word(name="packet_identifier", default_value=0x0002, endian=BIG_ENDIAN, fuzzable=True),
         )),
         Block("Payload", children=(
             # Topic Filter 1
-            Word(name="topic1_length", default_value=0x0007, endian=BIG_ENDIAN, fuzzable=True),
-            String(name="topic1", default_value="topic/1", fuzzable=True, max_len=65535),
+            LengthPrefix(name="topic1_length", string_name="topic1", fuzzable=True),
+            SharedString(name="topic1", default_value="topic/1", fuzzable=True, max_len=65535),
             Byte(name="qos1", default_value=0x00, fuzzable=True),
             # Topic Filter 2
-            Word(name="topic2_length", default_value=0x0007, endian=BIG_ENDIAN, fuzzable=True),
-            String(name="topic2", default_value="topic/2", fuzzable=True, max_len=65535),
+            LengthPrefix(name="topic2_length", string_name="topic2", fuzzable=True),
+            SharedString(name="topic2", default_value="topic/2", fuzzable=True, max_len=65535),
             Byte(name="qos2", default_value=0x01, fuzzable=True),
             # Topic Filter 3 (with wildcard)
-            Word(name="topic3_length", default_value=0x0008, endian=BIG_ENDIAN, fuzzable=True),
-            String(name="topic3", default_value="topic/#", fuzzable=True, max_len=65535),
+            LengthPrefix(name="topic3_length", string_name="topic3", fuzzable=True),
+            SharedString(name="topic3", default_value="topic/#", fuzzable=True, max_len=65535),
             Byte(name="qos3", default_value=0x02, fuzzable=True),
         )),
     ))
@@ -246,14 +267,14 @@ def define_mqtt_unsubscribe():
     return Request("MQTT-UNSUBSCRIBE", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_UNSUBSCRIBE, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x00, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
             Word(name="packet_identifier", default_value=0x0001, endian=BIG_ENDIAN, fuzzable=True),
         )),
         Block("Payload", children=(
-            Word(name="topic_filter_length", default_value=0x000A, endian=BIG_ENDIAN, fuzzable=True),
-            String(name="topic_filter", default_value="test/topic", fuzzable=True, max_len=65535),
+            LengthPrefix(name="topic_filter_length", string_name="topic_filter", fuzzable=True),
+            SharedString(name="topic_filter", default_value="test/topic", fuzzable=True, max_len=65535),
         )),
     ))
 
@@ -263,10 +284,10 @@ def define_mqtt_pingreq():
     MQTT-PINGREQ: Client ping to keep connection alive.
     Per MQTT 3.1.1 Section 3.12.
     """
-    return Request("MQTT-PINGREQ", children=(
+    return TemplateRequest("MQTT-PINGREQ", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_PINGREQ, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x00, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
     ))
 
@@ -276,10 +297,10 @@ def define_mqtt_disconnect():
     MQTT-DISCONNECT: Client graceful disconnect.
     Per MQTT 3.1.1 Section 3.14.
     """
-    return Request("MQTT-DISCONNECT", children=(
+    return TemplateRequest("MQTT-DISCONNECT", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_DISCONNECT, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x00, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
     ))
 
@@ -289,10 +310,10 @@ def define_mqtt_puback():
     MQTT-PUBACK: Acknowledgment for QoS 1 PUBLISH.
     Per MQTT 3.1.1 Section 3.4.
     """
-    return Request("MQTT-PUBACK", children=(
+    return TemplateRequest("MQTT-PUBACK", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_PUBACK, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x02, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
             Word(name="packet_identifier", default_value=0x0001, endian=BIG_ENDIAN, fuzzable=True),
@@ -305,10 +326,10 @@ def define_mqtt_pubrec():
     MQTT-PUBREC: Part of QoS 2 handshake.
     Per MQTT 3.1.1 Section 3.5.
     """
-    return Request("MQTT-PUBREC", children=(
+    return TemplateRequest("MQTT-PUBREC", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_PUBREC, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x02, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
             Word(name="packet_identifier", default_value=0x0001, endian=BIG_ENDIAN, fuzzable=True),
@@ -321,10 +342,10 @@ def define_mqtt_pubrel():
     MQTT-PUBREL: Part of QoS 2 handshake.
     Per MQTT 3.1.1 Section 3.6. Fixed flags MUST be 0010.
     """
-    return Request("MQTT-PUBREL", children=(
+    return TemplateRequest("MQTT-PUBREL", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_PUBREL, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x02, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
             Word(name="packet_identifier", default_value=0x0001, endian=BIG_ENDIAN, fuzzable=True),
@@ -337,10 +358,10 @@ def define_mqtt_pubcomp():
     MQTT-PUBCOMP: Final part of QoS 2 handshake.
     Per MQTT 3.1.1 Section 3.7.
     """
-    return Request("MQTT-PUBCOMP", children=(
+    return TemplateRequest("MQTT-PUBCOMP", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_PUBCOMP, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x02, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
             Word(name="packet_identifier", default_value=0x0001, endian=BIG_ENDIAN, fuzzable=True),
@@ -374,22 +395,23 @@ def define_mqtt_malformed_utf8():
     return Request("MQTT-Malformed-UTF8", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_CONNECT, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x20, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
-            Word(name="protocol_name_length", default_value=0x0004, endian=BIG_ENDIAN, fuzzable=True),
+            LengthPrefix(name="protocol_name_length", string_name="protocol_name", fuzzable=True),
             # Invalid UTF-8 bytes
-            Bytes(name="protocol_name", default_value=b"\xFF\xFE\x00\x00", fuzzable=True, max_len=256),
+            DictionaryBytes(name="protocol_name", default_value=b"\xFF\xFE\x00\x00", fuzzable=True, max_len=256,
+                            dictionary=MQTTDictionary(["protocol_names", "utf8"])),
             Byte(name="protocol_level", default_value=MQTT_PROTOCOL_LEVEL, fuzzable=True),
             Byte(name="connect_flags", default_value=0x02, fuzzable=True),
             Word(name="keep_alive", default_value=60, endian=BIG_ENDIAN, fuzzable=True),
         )),
         Block("Payload", children=(
-            Word(name="client_id_length", default_value=0x0010, endian=BIG_ENDIAN, fuzzable=True),
+            LengthPrefix(name="client_id_length", string_name="client_id", fuzzable=True),
             # Invalid UTF-8 continuation bytes
-            Bytes(name="client_id",
-                  default_value=b"\x80\x81\x82\x83\x84\x85\x86\x87\x88\x89\x8A\x8B\x8C\x8D\x8E\x8F",
-                  fuzzable=True, max_len=65535),
+            DictionaryBytes(name="client_id",
+                            default_value=b"\x80\x81\x82\x83\x84\x85\x86\x87\x88\x89\x8A\x8B\x8C\x8D\x8E\x8F",
+                            fuzzable=True, max_len=65535, dictionary=MQTTDictionary(["utf8"])),
         )),
     ))
 
@@ -402,15 +424,16 @@ def define_mqtt_topic_wildcards():
     return Request("MQTT-Topic-Wildcards", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_SUBSCRIBE, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x00, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
             Word(name="packet_identifier", default_value=0x0003, endian=BIG_ENDIAN, fuzzable=True),
         )),
         Block("Payload", children=(
-            Word(name="topic_filter_length", default_value=0x0011, endian=BIG_ENDIAN, fuzzable=True),
+            LengthPrefix(name="topic_filter_length", string_name="topic_filter", fuzzable=True),
             # Invalid: # must be last, + cannot be adjacent to non-separator
-            String(name="topic_filter", default_value="test/+/data/#/bad", fuzzable=True, max_len=65535),
+            SharedString(name="topic_filter", default_value="test/+/data/#/bad", fuzzable=True, max_len=65535,
+                         dictionary=MQTTDictionary(["wildcards", "utf8"])),
             Byte(name="requested_qos", default_value=0x00, fuzzable=True),
         )),
     ))
@@ -423,10 +446,10 @@ def define_mqtt_zero_length():
     return Request("MQTT-Zero-Length", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_CONNECT, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x0C, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
-            Word(name="protocol_name_length", default_value=0x0004, endian=BIG_ENDIAN, fuzzable=True),
+            LengthPrefix(name="protocol_name_length", string_name="protocol_name", fuzzable=True),
             Static(name="protocol_name", default_value=MQTT_PROTOCOL_NAME),
             Byte(name="protocol_level", default_value=MQTT_PROTOCOL_LEVEL, fuzzable=True),
             Byte(name="connect_flags", default_value=0x02, fuzzable=True),
@@ -459,15 +482,37 @@ def define_mqtt_oversized():
     ))
 
 
+def define_mqtt_oversized_streamed(payload_file=None):
+    """
+    MQTT-Oversized-Streamed: PUBLISH bodies up to and past the 256 MB limit.
+    The payload is streamed from a reusable buffer (or payload_file, see
+    --payload-file) instead of being rendered, and the remaining length
+    matches what is sent.
+    """
+    return StreamedRequest("MQTT-Oversized-Streamed", children=(
+        Block("Fixed-Header", children=(
+            Byte(name="packet_type", default_value=MQTT_PUBLISH, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
+        )),
+        Block("Variable-Header", children=(
+            LengthPrefix(name="topic_length", string_name="topic_name", fuzzable=True),
+            SharedString(name="topic_name", default_value="test/oversized", fuzzable=True, max_len=65535),
+        )),
+        Block("Payload", children=(
+            StreamedPayload(name="application_message", path=payload_file, fuzzable=True),
+        )),
+    ))
+
+
 def define_mqtt_invalid_type():
     """
     MQTT-Invalid-Type: Test reserved/invalid packet types.
     Packet types 0 and 15 are reserved.
     """
-    return Request("MQTT-Invalid-Type", children=(
+    return TemplateRequest("MQTT-Invalid-Type", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=0x00, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x00, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
     ))
 
@@ -480,18 +525,18 @@ def define_mqtt_duplicate_connect():
     return Request("MQTT-Duplicate-CONNECT", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_CONNECT, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x10, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
-            Word(name="protocol_name_length", default_value=0x0004, endian=BIG_ENDIAN, fuzzable=True),
+            LengthPrefix(name="protocol_name_length", string_name="protocol_name", fuzzable=True),
             Static(name="protocol_name", default_value=MQTT_PROTOCOL_NAME),
             Byte(name="protocol_level", default_value=MQTT_PROTOCOL_LEVEL, fuzzable=True),
             Byte(name="connect_flags", default_value=0x02, fuzzable=True),
             Word(name="keep_alive", default_value=60, endian=BIG_ENDIAN, fuzzable=True),
         )),
         Block("Payload", children=(
-            Word(name="client_id_length", default_value=0x0004, endian=BIG_ENDIAN, fuzzable=True),
-            String(name="client_id", default_value="dup1", fuzzable=True),
+            LengthPrefix(name="client_id_length", string_name="client_id", fuzzable=True),
+            SharedString(name="client_id", default_value="dup1", fuzzable=True),
         )),
     ))
 
@@ -500,60 +545,421 @@ def define_mqtt_duplicate_connect():
 # Session Configuration and Main
 # =============================================================================
 
-def create_session(host, port, fuzz_all=False):
+def define_requests(fuzz_all=False, lie_budget=None, extra_tokens=None, payload_file=None):
     """
-    Create a boofuzz session with all MQTT packet definitions.
+    Return all MQTT packet definitions in session order. lie_budget limits
+    the wrong length prefixes per field (see LengthPrefix); default: all.
+    extra_tokens (bytes) are added to the dictionary-driven fields (--dictionary);
+    MQTT-Oversized-Streamed streams payload_file if given (--payload-file).
     """
-    session = Session(
-        target=Target(
-            connection=TCPSocketConnection(host, port),
-        ),
-        sleep_time=0.1,
-        restart_sleep_time=0.5,
-        web_port=26000,
-        keep_web_open=True,
-        crash_threshold_element=3,
-        crash_threshold_request=10,
-    )
+    requests = []
 
     # Core protocol packets
     print("[*] Defining CONNECT packets...")
-    session.connect(define_mqtt_connect())
-    session.connect(define_mqtt_connect_full())
+    requests.append(define_mqtt_connect())
+    requests.append(define_mqtt_connect_full())
 
     print("[*] Defining PUBLISH packets...")
-    session.connect(define_mqtt_publish_qos0())
-    session.connect(define_mqtt_publish_qos1())
-    session.connect(define_mqtt_publish_qos2())
+    requests.append(define_mqtt_publish_qos0())
+    requests.append(define_mqtt_publish_qos1())
+    requests.append(define_mqtt_publish_qos2())
 
     print("[*] Defining SUBSCRIBE/UNSUBSCRIBE packets...")
-    session.connect(define_mqtt_subscribe())
-    session.connect(define_mqtt_subscribe_multi())
-    session.connect(define_mqtt_unsubscribe())
+    requests.append(define_mqtt_subscribe())
+    requests.append(define_mqtt_subscribe_multi())
+    requests.append(define_mqtt_unsubscribe())
 
     print("[*] Defining control packets...")
-    session.connect(define_mqtt_pingreq())
-    session.connect(define_mqtt_disconnect())
+    requests.append(define_mqtt_pingreq())
+    requests.append(define_mqtt_disconnect())
 
     print("[*] Defining QoS handshake packets...")
-    session.connect(define_mqtt_puback())
-    session.connect(define_mqtt_pubrec())
-    session.connect(define_mqtt_pubrel())
-    session.connect(define_mqtt_pubcomp())
+    requests.append(define_mqtt_puback())
+    requests.append(define_mqtt_pubrec())
+    requests.append(define_mqtt_pubrel())
+    requests.append(define_mqtt_pubcomp())
 
     if fuzz_all:
         print("[*] Defining edge case / malformed packets...")
-        session.connect(define_mqtt_malformed_remaining_length())
-        session.connect(define_mqtt_malformed_utf8())
-        session.connect(define_mqtt_topic_wildcards())
-        session.connect(define_mqtt_zero_length())
-        session.connect(define_mqtt_oversized())
-        session.connect(define_mqtt_invalid_type())
-        session.connect(define_mqtt_duplicate_connect())
+        requests.append(define_mqtt_malformed_remaining_length())
+        requests.append(define_mqtt_malformed_utf8())
+        requests.append(define_mqtt_topic_wildcards())
+        requests.append(define_mqtt_zero_length())
+        requests.append(define_mqtt_oversized())
+        requests.append(define_mqtt_oversized_streamed(payload_file=payload_file))
+        requests.append(define_mqtt_invalid_type())
+        requests.append(define_mqtt_duplicate_connect())
+
+    if lie_budget is not None:
+        set_lie_budget(requests, lie_budget)
+    if extra_tokens:
+        add_dictionary_tokens(requests, extra_tokens)
+    return requests
+
+
+# =============================================================================
+# Callbacks
+# =============================================================================
+
+def log_broker_responses(target, fuzz_data_logger, session, sock, *args, **kwargs):
+    """
+    Callback that runs after each test case.
+    Logs every complete MQTT packet the broker has already answered with,
+    and keeps their types in session._mqtt_responses for the RequestScheduler.
+    """
+    raw_sock = getattr(target._target_connection, "_sock", None)
+    if raw_sock is None:
+        return
+    packets, closed = collect_responses(raw_sock)
+    for packet in packets:
+        fuzz_data_logger.log_recv(packet.to_bytes())
+    if packets:
+        fuzz_data_logger.log_info(f"Broker responses: {describe(packets)}")
+    if closed:
+        fuzz_data_logger.log_info("Broker closed the connection")
+    session._mqtt_responses = describe(packets) + (" + close" if closed else "")
+
+
+def create_session(host, port, fuzz_all=False, pacer=None, connections=None, dedup=None, batched_results=True,
+                   crash_only=False, ring_size=DEFAULT_RING_SIZE, asan_log=None, lie_budget=None, extra_tokens=None,
+                   payload_file=None, **session_options):
+    """
+    Create a boofuzz session with all MQTT packet definitions.
+    With a pacer, the fixed sleep_time is replaced by response-driven pacing.
+    With a ConnectionManager, per-case connections use its RST close and source rotation.
+    The pacer also backs off on refused connects, so it always connects through one.
+    With a PayloadDeduplicator, test cases that render to already sent bytes are skipped.
+    With batched_results, the results database is written by a BatchedFuzzLoggerDb;
+    with crash_only too, only the test cases around anomalies are written, keeping the
+    last ring_size in memory and watching the sanitizer logs matching asan_log.
+    Extra keyword arguments override the Session defaults below.
+    """
+    options = dict(
+        sleep_time=0.1,
+        restart_sleep_time=0.5,
+        web_port=26000,
+        keep_web_open=True,
+        crash_threshold_element=3,
+        crash_threshold_request=10,
+        post_test_case_callbacks=[log_broker_responses],
+    )
+    if pacer is not None:
+        # Wait for the broker to react before collecting its responses.
+        options.update(sleep_time=0, post_test_case_callbacks=[pacer.post_test_case_callback, log_broker_responses])
+    options.update(session_options)
+    if pacer is not None and connections is None:
+        connections = ConnectionManager()
+    if connections is not None:
+        connection = ChurnTCPConnection(host, port, connections, pacer=pacer)
+    else:
+        connection = StreamingTCPConnection(host, port)
+    session_class = Session
+    if dedup is not None:
+        session_class = DedupSession
+        options["dedup"] = dedup
+    session = session_class(
+        target=Target(
+            connection=connection,
+        ),
+        **options
+    )
+    if batched_results:
+        batch_results(session, crash_only=crash_only, ring_size=ring_size, asan_log=asan_log)
+
+    for request in define_requests(fuzz_all=fuzz_all, lie_budget=lie_budget, extra_tokens=extra_tokens,
+                                   payload_file=payload_file):
+        session.connect(request)
 
     return session
 
 
+def fuzz_indexed(session, request_name=None, index_start=1, index_end=None, checkpoint=None):
+    """
+    Fuzz test cases index_start..index_end of the session's requests (or of
+    request_name only) without generating the cases before index_start.
+    """
+    index = CaseIndex(select_requests(session_requests(session), request_name))
+    fuzz_range(session, index, index_start, index_end, checkpoint=checkpoint)
+
+
+def run_shard(host, port, fuzz_all, request_name, shard, index_start, index_end, db_filename, results,
+              sleep_time=None, connection_options=None, dedup=True, batched_results=True, crash_only=False,
+              ring_size=DEFAULT_RING_SIZE, asan_log=None, lie_budget=None, extra_tokens=None, payload_file=None):
+    """
+    Worker process body: fuzz test cases index_start..index_end with a private
+    boofuzz Session and results DB, then report throughput on the results queue.
+    The shard starts straight at index_start (see mqtt_index).
+    Deduplication only sees this shard's cases.
+    """
+    pacer = AdaptivePacer() if sleep_time is None else None
+    connections = ConnectionManager(**(connection_options or {}))
+    deduplicator = PayloadDeduplicator() if dedup else None
+    session_options = {} if sleep_time is None else {"sleep_time": sleep_time}
+    session = create_session(
+        host, port, fuzz_all=fuzz_all, pacer=pacer, connections=connections, dedup=deduplicator,
+        batched_results=batched_results,
+        crash_only=crash_only,
+        ring_size=ring_size,
+        asan_log=asan_log,
+        lie_budget=lie_budget,
+        extra_tokens=extra_tokens,
+        payload_file=payload_file,
+        index_start=index_start,
+        index_end=index_end,
+        web_port=None,
+        keep_web_open=False,
+        fuzz_loggers=[],
+        db_filename=db_filename,
+        **session_options
+    )
+    start = time.time()
+    error = None
+    try:
+        fuzz_indexed(session, request_name, index_start, index_end)
+    except KeyboardInterrupt:
+        error = "interrupted"
+    except Exception as e:
+        error = str(e)
+    results.put({
+        "shard": shard,
+        "index_start": index_start,
+        "index_end": index_end,
+        "cases": session.num_cases_actually_fuzzed,
+        "elapsed": time.time() - start,
+        "db_filename": db_filename,
+        "delay": pacer.effective_delay if pacer else sleep_time,
+        "connects": connections.connects,
+        "ports_exhausted": connections.ports_exhausted,
+        "duplicates": deduplicator.skipped if deduplicator else 0,
+        "error": error,
+    })
+
+
+def run_sharded(host, port, fuzz_all=False, request_name=None, workers=4, sleep_time=None,
+                connection_options=None, dedup=True, batched_results=True, crash_only=False,
+                ring_size=DEFAULT_RING_SIZE, asan_log=None, lie_budget=None, extra_tokens=None, payload_file=None):
+    """
+    Split the test case index space of the selected requests into disjoint
+    shards and fuzz each one in its own process. Prints per-shard throughput.
+    """
+    requests = define_requests(fuzz_all=fuzz_all, lie_budget=lie_budget, extra_tokens=extra_tokens,
+                               payload_file=payload_file)
+    requests = select_requests(requests, request_name)
+    total = num_test_cases(requests)
+    run_id = time.strftime("%Y-%m-%dT%H-%M-%S")
+    results = multiprocessing.Queue()
+    processes = []
+    for shard, (index_start, index_end) in enumerate(shard_ranges(total, workers)):
+        db_filename = os.path.join(RESULTS_DIR, f"run-{run_id}-shard{shard}.db")
+        print(f"[*] Shard {shard}: test cases {index_start}-{index_end} -> {db_filename}")
+        process = multiprocessing.Process(
+            target=run_shard,
+            args=(host, port, fuzz_all, request_name, shard, index_start, index_end, db_filename, results,
+                  sleep_time, connection_options, dedup, batched_results, crash_only, ring_size, asan_log,
+                  lie_budget, extra_tokens, payload_file),
+            name=f"mqtt-shard-{shard}",
+        )
+        process.start()
+        processes.append(process)
+
+    reports = []
+    try:
+        while len(reports) < len(processes):
+            reports.append(results.get())
+    finally:
+        for process in processes:
+            process.join()
+
+    print("\n[*] Shard summary:")
+    total_cases = 0
+    wall_time = max((r["elapsed"] for r in reports), default=0.0)
+    for r in sorted(reports, key=lambda r: r["shard"]):
+        rate = r["cases"] / r["elapsed"] if r["elapsed"] > 0 else 0.0
+        status = f" ({r['error']})" if r["error"] else ""
+        print(f"  shard {r['shard']}: cases {r['index_start']}-{r['index_end']}, "
+              f"{r['cases']} fuzzed in {r['elapsed']:.1f}s, {rate:.1f} cases/sec, "
+              f"delay {r['delay'] * 1000:.1f} ms, {r['connects']} connects, "
+              f"{r['ports_exhausted']} port exhaustion errors, {r['duplicates']} repeats skipped{status}")
+        total_cases += r["cases"]
+    if wall_time > 0:
+        print(f"  total: {total_cases} of {total} cases in {wall_time:.1f}s, "
+              f"{total_cases / wall_time:.1f} cases/sec")
+    return reports
+
+
+def compile_requests(path, fuzz_all=False, request_name=None, dedup=None, sweep=None, lie_budget=None,
+                     extra_tokens=None, payload_file=None):
+    """
+    Render every test case of the selected requests once into a corpus file
+    that --replay can send without touching boofuzz. With a
+    PayloadDeduplicator, repeated payloads are left out of the corpus.
+    With sweep (a list of field names), the corpus holds the exhaustive
+    sweeps of those fields instead of the boofuzz mutations.
+    """
+    requests = define_requests(fuzz_all=fuzz_all, lie_budget=lie_budget, extra_tokens=extra_tokens,
+                               payload_file=payload_file)
+    requests = select_requests(requests, request_name)
+    start = time.time()
+    if sweep:
+        fields = find_sweep_fields(requests, sweep)
+        print(f"[*] Compiling {len(fields)} sweeps ({num_sweep_cases(fields)} test cases) into {path}")
+        cases = iter_sweep_cases(fields)
+        if dedup is not None:
+            cases = dedup.filter(cases)
+        count = compile_corpus(cases, path)
+        print(f"[*] Wrote {count} test cases ({os.path.getsize(path)} bytes) in {time.time() - start:.1f}s")
+        if dedup is not None:
+            print(dedup.summary())
+        return count
+
+    print(f"[*] Compiling {num_test_cases(requests)} test cases into {path}")
+    streamed = []
+
+    def rendered_cases():
+        for case in iter_test_cases(requests):
+            if isinstance(case.data, StreamedPacket):
+                streamed.append(case.index)
+            else:
+                yield case
+
+    cases = rendered_cases()
+    if dedup is not None:
+        cases = dedup.filter(cases)
+    count = compile_corpus(cases, path)
+    print(f"[*] Wrote {count} test cases ({os.path.getsize(path)} bytes) in {time.time() - start:.1f}s")
+    if streamed:
+        print(f"[*] Left out {len(streamed)} streamed test cases; fuzz them with a session or --concurrency")
+    if dedup is not None:
+        print(dedup.summary())
+    return count
+
+
+def run_replay(host, port, path, request_name=None, concurrency=1, connections=None, dedup=None):
+    """
+    Send the test cases of a compiled corpus straight from the memory-mapped file.
+    """
+    corpus = Corpus(path)
+    print(f"[*] Replaying {len(corpus)} test cases from {path}")
+    return _run_engine(host, port, corpus.iter_test_cases(request_name=request_name), concurrency, connections,
+                       dedup)
+
+
+def run_async(host, port, fuzz_all=False, request_name=None, concurrency=8, connections=None, dedup=None,
+              index_start=1, checkpoint=None, lie_budget=None, extra_tokens=None, payload_file=None):
+    """
+    Fuzz with the asyncio engine: N test cases in flight over separate connections.
+    Starts at test case index_start; with a Checkpoint, progress is recorded.
+    """
+    requests = define_requests(fuzz_all=fuzz_all, lie_budget=lie_budget, extra_tokens=extra_tokens,
+                               payload_file=payload_file)
+    requests = select_requests(requests, request_name)
+    print(f"[*] {num_test_cases(requests)} test cases, concurrency {concurrency}")
+    if index_start > 1:
+        cases = CaseIndex(requests).cases(index_start)
+    else:
+        cases = iter_test_cases(requests)
+    return _run_engine(host, port, cases, concurrency, connections, dedup, checkpoint=checkpoint)
+
+
+def run_sweep(host, port, fuzz_all=False, request_name=None, fields=SWEEP_FIELDS, concurrency=1,
+              connections=None, dedup=None, lie_budget=None, extra_tokens=None, payload_file=None):
+    """
+    Send every value of the named Byte/Word fields with the asyncio engine,
+    rendered a block at a time (see mqtt_sweep).
+    """
+    requests = define_requests(fuzz_all=fuzz_all, lie_budget=lie_budget, extra_tokens=extra_tokens,
+                               payload_file=payload_file)
+    requests = select_requests(requests, request_name)
+    sweeps = find_sweep_fields(requests, fields)
+    if not sweeps:
+        raise ValueError(f"No Byte/Word fields named {', '.join(fields)} in the selected requests")
+    for sweep in sweeps:
+        print(f"[*] Sweeping {sweep.primitive.qualified_name}: {1 << (8 * sweep.width)} values")
+    print(f"[*] {num_sweep_cases(sweeps)} test cases, concurrency {concurrency}")
+    return _run_engine(host, port, iter_sweep_cases(sweeps), concurrency, connections, dedup)
+
+
+def run_coverage(host, port, fuzz_all=False, request_name=None, coverage_map=DEFAULT_COVERAGE_MAP,
+                 connections=None, dedup=None, lie_budget=None, extra_tokens=None, payload_file=None):
+    """
+    Coverage-guided fuzzing against a broker built with COVERAGE=1: one test
+    case at a time, expanding the cases that hit new edges first (see mqtt_coverage).
+    """
+    requests = define_requests(fuzz_all=fuzz_all, lie_budget=lie_budget, extra_tokens=extra_tokens,
+                               payload_file=payload_file)
+    requests = select_requests(requests, request_name)
+    guide = CoverageGuide(requests, CoverageMap(coverage_map))
+    print(f"[*] {num_test_cases(requests)} test cases plus expansions, coverage from {coverage_map}")
+    try:
+        return _run_engine(host, port, guide.cases(), 1, connections, dedup, feedback=guide)
+    finally:
+        print(guide.summary())
+        if not guide.tracker.edges:
+            print(f"[!] No edges recorded; is the broker built with COVERAGE=1 and sharing {coverage_map}?")
+        guide.coverage_map.close()
+
+
+def run_havoc(host, port, fuzz_all=False, request_name=None, seed=None, duration=None, max_cases=None,
+              cpu_budget=DEFAULT_CPU_BUDGET, concurrency=1, connections=None, dedup=None, checkpoint=None,
+              resume=None, lie_budget=None, extra_tokens=None, payload_file=None):
+    """
+    Havoc mode: stacked random mutations of each request's default packet
+    (see mqtt_havoc), until duration seconds or max_cases; with neither,
+    until interrupted. With a Checkpoint, the case number and RNG state are
+    recorded; resume is a loaded checkpoint state to continue from.
+    """
+    requests = define_requests(fuzz_all=fuzz_all, lie_budget=lie_budget, extra_tokens=extra_tokens,
+                               payload_file=payload_file)
+    requests = select_requests(requests, request_name)
+    mutator = HavocMutator(havoc_seeds(requests), tokens=MQTTDictionary(extra=extra_tokens or ()).tokens, seed=seed,
+                           cpu_budget=cpu_budget)
+    index_start = 1
+    if resume is not None:
+        mutator.rng.setstate(resume["rng"])
+        index_start = resume["next_case"]
+    limit = f"for {duration:.0f}s" if duration else "until interrupted"
+    print(f"[*] Havoc on {len(mutator.seeds)} seed packets, seed {mutator.seed}, {limit}")
+    cases = mutator.cases(duration=duration, max_cases=max_cases, index_start=index_start)
+    if checkpoint is not None:
+        checkpoint.rng = mutator.rng
+        checkpoint.state["seed"] = mutator.seed
+    try:
+        return _run_engine(host, port, cases, concurrency, connections, dedup, checkpoint=checkpoint)
+    finally:
+        print(mutator.summary())
+
+
+def _run_engine(host, port, cases, concurrency, connections=None, dedup=None, feedback=None, checkpoint=None):
+    """
+    Run cases on an AsyncFuzzEngine; crash records go next to the boofuzz results.
+    With a Checkpoint, progress is recorded as the engine finishes cases.
+    """
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    run_id = time.strftime("%Y-%m-%dT%H-%M-%S")
+    engine = AsyncFuzzEngine(
+        host, port,
+        concurrency=concurrency,
+        pacer=AdaptivePacer(),
+        results_file=os.path.join(RESULTS_DIR, f"async-{run_id}.jsonl"),
+        connections=connections,
+        feedback=feedback,
+        checkpoint=checkpoint,
+    )
+    if dedup is not None:
+        cases = dedup.filter(cases)
+    if checkpoint is not None:
+        cases = checkpoint.track(cases)
+    try:
+        engine.run(cases)
+    finally:
+        print(engine.summary())
+        print(engine.pacer.summary())
+        print(engine.connections.summary())
+        if dedup is not None:
+            print(dedup.summary())
+    return engine
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="MQTT 3.1.1 Protocol Fuzzer",
@@ -563,6 +969,15 @@ Examples:
   %(prog)s -t localhost -p 1883
   %(prog)s -t 192.168.1.100 -p 1883 --all
   %(prog)s -t localhost -p 1883 -r MQTT-CONNECT
+  %(prog)s -t localhost -p 1883 --all --case 150000
+  %(prog)s -t localhost -p 1883 --all --concurrency 32
+  %(prog)s -t localhost -p 1883 --all --workers 8
+  %(prog)s --all --compile mqtt-all.corpus
+  %(prog)s -t localhost -p 1883 --replay mqtt-all.corpus --concurrency 32
+  %(prog)s -t localhost -p 1883 -r MQTT-CONNECT --sweep connect_flags,keep_alive --concurrency 32
+  %(prog)s -t localhost -p 1883 --all --coverage
+  %(prog)s -t localhost -p 1883 --all --havoc --seed 1234 --duration 3600 --concurrency 16
+  %(prog)s -t localhost -p 1883 --all --duration 7200 --slice 5
 
 Recommended test setup:
   docker run -it --rm -p 1883:1883 eclipse-mosquitto:latest
@@ -583,8 +998,151 @@ Or with AddressSanitizer:
                         help="Fuzz only a specific request by name")
     parser.add_argument("-l", "--list", action="store_true",
                         help="List available request names and exit")
+    parser.add_argument("-c", "--concurrency", type=int, default=1,
+                        help="Test cases in flight at once; above 1 uses the asyncio engine "
+                             "instead of a boofuzz Session (default: 1)")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Split the test cases into N shards, each fuzzed by its own process "
+                             "with its own boofuzz Session and results DB (default: 1)")
+
+    parser.add_argument("--case", type=int, default=None, metavar="N",
+                        help="Send only test case N (numbered as in the logs and web UI, within -r if given)")
+    parser.add_argument("-s", "--sleep-time", type=float, default=None,
+                        help="Fixed delay between test cases instead of response-driven pacing")
+    parser.add_argument("--compile", metavar="CORPUS",
+                        help="Render every test case into a corpus file and exit")
+    parser.add_argument("--replay", metavar="CORPUS",
+                        help="Send test cases from a compiled corpus instead of rendering them "
+                             "(uses the asyncio engine; combine with --concurrency)")
+    parser.add_argument("--abort-close", action="store_true",
+                        help="Close each test case connection with RST (SO_LINGER 0) so no "
+                             "TIME_WAIT entries build up")
+    parser.add_argument("--source-addresses", type=int, default=0, metavar="N",
+                        help="Rotate connections across N loopback source addresses starting at "
+                             "127.0.0.1 (loopback targets only)")
+    parser.add_argument("--length-lie-budget", type=int, default=DEFAULT_LIE_BUDGET, metavar="N",
+                        help="Wrong string length prefixes to try per field: +1, -1, 0, 0xFFFF, past the "
+                             "packet end, in that order (default: all 5; 0 keeps every prefix correct)")
+
+    parser.add_argument("--payload-file", metavar="PATH",
+                        help="Stream MQTT-Oversized-Streamed payloads from this file (zero copy), padded "
+                             "with a fill pattern past its end")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Send every test case, even if it renders to the same bytes as an earlier one")
+    parser.add_argument("--sync-results", action="store_true",
+                        help="Write the results database with boofuzz's own writer: one synchronous "
+                             "transaction per test case")
+    parser.add_argument("--crash-only", action="store_true",
+                        help="Keep the last test cases in memory and write them to the results database only "
+                             "around anomalies (failures, refused connects, latency spikes, ASAN reports), "
+                             "plus periodic counter snapshots")
+    parser.add_argument("--ring-size", type=int, default=DEFAULT_RING_SIZE, metavar="N",
+                        help=f"Test cases kept in memory by --crash-only (default: {DEFAULT_RING_SIZE})")
+    parser.add_argument("--asan-log", metavar="GLOB",
+                        help="Sanitizer log files for --crash-only to watch for new reports, "
+                             "e.g. 'logs/asan.*'")
+    parser.add_argument("--dictionary", metavar="FILE",
+                        help="Extra tokens (AFL/libFuzzer dictionary format) for the dictionary-driven string "
+                             "fields and --havoc")
+    parser.add_argument("--sweep", nargs="?", const=",".join(SWEEP_FIELDS), metavar="FIELDS",
+                        help="Send every value of these comma-separated Byte/Word fields instead of the "
+                             f"boofuzz mutations (default: {','.join(SWEEP_FIELDS)}); uses the asyncio engine, "
+                             "or writes the sweep with --compile")
+    parser.add_argument("--coverage", nargs="?", const=DEFAULT_COVERAGE_MAP, metavar="MAP",
+                        help="Coverage-guided mode against a broker built with COVERAGE=1: read its edge bitmap "
+                             f"(default: {DEFAULT_COVERAGE_MAP}) and expand test cases that hit new edges first")
+    parser.add_argument("--havoc", action="store_true",
+                        help="Stack random bit flips, block edits, splices and MQTT tokens on each request's "
+                             "default packet instead of walking boofuzz mutations (uses the asyncio engine)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="RNG seed for --havoc (default: random, printed at start)")
+    parser.add_argument("--duration", type=float, default=None, metavar="SECONDS",
+                        help="Stop after this many seconds; without --havoc, interleave the requests in "
+                             "yield-weighted time slices (default: run until interrupted)")
+    parser.add_argument("--slice", type=float, default=None, metavar="SECONDS",
+                        help="Interleave the requests in time slices of about this many seconds, longer for "
+                             "requests that find crashes, new or slow responses "
+                             f"(default: {DEFAULT_SLICE_TIME:g} with --duration)")
+    parser.add_argument("--havoc-budget", type=float, default=DEFAULT_CPU_BUDGET * 1e6, metavar="US",
+                        help="CPU microseconds one havoc case may spend being mutated "
+                             f"(default: {DEFAULT_CPU_BUDGET * 1e6:.0f})")
+    parser.add_argument("--checkpoint", metavar="FILE",
+                        help="Record progress (request, case number, havoc RNG state, dedup hashes) in FILE")
+    parser.add_argument("--checkpoint-interval", type=float, default=DEFAULT_CHECKPOINT_INTERVAL, metavar="SECONDS",
+                        help=f"Seconds between checkpoint writes (default: {DEFAULT_CHECKPOINT_INTERVAL:g})")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the campaign recorded in --checkpoint FILE after its last test case, "
+                             "with its --all, -r, --havoc and --seed settings")
 
     args = parser.parse_args()
+    extra_tokens = tuple(load_dictionary(args.dictionary)) if args.dictionary else ()
+    if args.crash_only and (args.sync_results or args.ring_size < 1):
+        parser.error("--crash-only needs a --ring-size of at least 1 and cannot be combined with --sync-results")
+    if args.crash_only and (args.concurrency > 1 or args.havoc or args.replay or args.sweep or args.coverage
+                            or args.compile):
+        parser.error("--crash-only applies to boofuzz sessions; the asyncio engine modes record only "
+                     "crashes already")
+    if args.workers > 1 and (args.concurrency > 1 or args.replay or args.sweep):
+        parser.error("--workers cannot be combined with --concurrency, --replay or --sweep")
+    if args.workers > 1 and (args.duration or args.slice) and not args.havoc:
+        parser.error("--duration and --slice cannot be combined with --workers")
+    if args.case is not None and (args.workers > 1 or args.duration or args.slice):
+        parser.error("--case cannot be combined with --workers, --duration or --slice")
+    if args.sweep and args.replay:
+        parser.error("--sweep cannot be combined with --replay")
+    if args.havoc and (args.workers > 1 or args.replay or args.sweep or args.compile or args.coverage):
+        parser.error("--havoc cannot be combined with --workers, --replay, --sweep, --compile or --coverage")
+    if args.coverage and (args.workers > 1 or args.concurrency > 1 or args.replay or args.sweep or args.compile):
+        parser.error("--coverage runs one test case at a time and cannot be combined with --workers, "
+                     "--concurrency, --replay, --sweep or --compile")
+    if args.resume and not args.checkpoint:
+        parser.error("--resume needs --checkpoint FILE")
+    if args.checkpoint and (args.workers > 1 or args.replay or args.sweep or args.compile or args.coverage
+                            or args.case is not None or (not args.havoc and (args.duration or args.slice))):
+        parser.error("--checkpoint works with the sequential, --concurrency and --havoc modes only")
+    resume = None
+    dedup_hashes = None
+    if args.resume:
+        resume, dedup_hashes = load_checkpoint(args.checkpoint)
+        args.all = resume["fuzz_all"]
+        args.request = resume["request"]
+        args.havoc = resume["mode"] == "havoc"
+        args.seed = resume.get("seed")
+    sweep = args.sweep.split(",") if args.sweep else None
+    connection_options = {
+        "abort_close": args.abort_close,
+        "source_addresses": loopback_aliases(args.source_addresses),
+    }
+    connections = ConnectionManager(**connection_options)
+    dedup = None if args.no_dedup else PayloadDeduplicator()
+    if dedup is not None and dedup_hashes is not None:
+        dedup.load(dedup_hashes)
+    checkpoint = None
+    index_start = 1
+    if args.checkpoint:
+        total = None
+        if not args.havoc:
+            requests = define_requests(fuzz_all=args.all, lie_budget=args.length_lie_budget, extra_tokens=extra_tokens,
+                                       payload_file=args.payload_file)
+            total = num_test_cases(select_requests(requests, args.request))
+        if resume is not None:
+            if resume.get("total") != total:
+                print(f"[!] The checkpoint is for {resume.get('total')} test cases, these requests have {total}; "
+                      "were --length-lie-budget or --dictionary changed?")
+                return 1
+            index_start = resume["next_case"]
+            if total is not None and index_start > total:
+                print(f"[*] {args.checkpoint}: all {total} test cases were already sent")
+                return 0
+            print(f"[*] Resuming from {args.checkpoint}: test case {index_start}"
+                  f"{f' of {total}' if total else ''}, request {resume.get('current_request')}, "
+                  f"{len(dedup_hashes) if dedup_hashes is not None else 0} payloads already sent")
+        checkpoint = Checkpoint(args.checkpoint, interval=args.checkpoint_interval, dedup=dedup,
+                                mode="havoc" if args.havoc else "mutations", fuzz_all=args.all,
+                                request=args.request, total=total)
+        if resume is not None:
+            checkpoint.state.update(case=resume.get("case", 0), next_case=index_start,
+                                    current_request=resume.get("current_request"))
 
     print("""
     ╔══════════════════════════════════════════════════════════════╗
@@ -595,19 +1153,147 @@ Or with AddressSanitizer:
     ╚══════════════════════════════════════════════════════════════╝
     """.format(host=args.target, port=args.port))
 
-    session = create_session(args.target, args.port, fuzz_all=args.all)
-
     if args.list:
         print("\nAvailable requests:")
-        for name in session.fuzz_node_names():
-            print(f"  - {name}")
+        for request in define_requests(fuzz_all=args.all, lie_budget=args.length_lie_budget, extra_tokens=extra_tokens,
+                                       payload_file=args.payload_file):
+            print(f"  - {request.name}")
+        return 0
+
+    if args.compile:
+        compile_requests(args.compile, fuzz_all=args.all, request_name=args.request, dedup=dedup, sweep=sweep,
+                         lie_budget=args.length_lie_budget, extra_tokens=extra_tokens, payload_file=args.payload_file)
+        return 0
+
+    if args.replay:
+        print(f"\n[*] Replaying corpus against {args.target}:{args.port}")
+        print("[*] Press Ctrl+C to stop\n")
+        try:
+            run_replay(args.target, args.port, args.replay,
+                       request_name=args.request, concurrency=args.concurrency, connections=connections,
+                       dedup=dedup)
+        except KeyboardInterrupt:
+            print("\n[!] Replay interrupted by user")
+        except Exception as e:
+            print(f"\n[!] Error: {e}")
+            return 1
+        print("\n[*] Replay complete!")
+        return 0
+
+    if args.havoc:
+        print(f"\n[*] Starting havoc mode against {args.target}:{args.port}")
+        print("[*] Press Ctrl+C to stop\n")
+        try:
+            run_havoc(args.target, args.port, fuzz_all=args.all, request_name=args.request, seed=args.seed,
+                      duration=args.duration, cpu_budget=args.havoc_budget / 1e6, concurrency=args.concurrency,
+                      connections=connections, dedup=dedup, checkpoint=checkpoint, resume=resume,
+                      lie_budget=args.length_lie_budget, extra_tokens=extra_tokens, payload_file=args.payload_file)
+        except KeyboardInterrupt:
+            print("\n[!] Fuzzing interrupted by user")
+        except Exception as e:
+            print(f"\n[!] Error: {e}")
+            return 1
+        finally:
+            if checkpoint is not None:
+                checkpoint.save()
+                print(checkpoint.summary())
+        print("\n[*] Fuzzing complete!")
+        return 0
+
+    if args.coverage:
+        print(f"\n[*] Starting coverage-guided fuzzing against {args.target}:{args.port}")
+        print("[*] Press Ctrl+C to stop\n")
+        try:
+            run_coverage(args.target, args.port, fuzz_all=args.all, request_name=args.request,
+                         coverage_map=args.coverage, connections=connections, dedup=dedup,
+                         lie_budget=args.length_lie_budget, extra_tokens=extra_tokens, payload_file=args.payload_file)
+        except KeyboardInterrupt:
+            print("\n[!] Fuzzing interrupted by user")
+        except Exception as e:
+            print(f"\n[!] Error: {e}")
+            return 1
+        print("\n[*] Fuzzing complete!")
+        return 0
+
+    if sweep:
+        print(f"\n[*] Starting sweep against {args.target}:{args.port}")
+        print("[*] Press Ctrl+C to stop\n")
+        try:
+            run_sweep(args.target, args.port, fuzz_all=args.all, request_name=args.request, fields=sweep,
+                      concurrency=args.concurrency, connections=connections, dedup=dedup,
+                      lie_budget=args.length_lie_budget, extra_tokens=extra_tokens, payload_file=args.payload_file)
+        except KeyboardInterrupt:
+            print("\n[!] Sweep interrupted by user")
+        except Exception as e:
+            print(f"\n[!] Error: {e}")
+            return 1
+        print("\n[*] Sweep complete!")
+        return 0
+
+    if args.concurrency > 1:
+        print(f"\n[*] Starting asyncio engine against {args.target}:{args.port}")
+        print("[*] Press Ctrl+C to stop\n")
+        try:
+            run_async(args.target, args.port, fuzz_all=args.all,
+                      request_name=args.request, concurrency=args.concurrency, connections=connections,
+                      dedup=dedup, index_start=index_start, checkpoint=checkpoint, lie_budget=args.length_lie_budget,
+                      extra_tokens=extra_tokens, payload_file=args.payload_file)
+        except KeyboardInterrupt:
+            print("\n[!] Fuzzing interrupted by user")
+        except Exception as e:
+            print(f"\n[!] Error: {e}")
+            return 1
+        finally:
+            if checkpoint is not None:
+                checkpoint.save()
+                print(checkpoint.summary())
+        print("\n[*] Fuzzing complete!")
         return 0
 
+    if args.workers > 1:
+        print(f"\n[*] Starting {args.workers} worker processes against {args.target}:{args.port}")
+        print("[*] Press Ctrl+C to stop\n")
+        try:
+            run_sharded(args.target, args.port, fuzz_all=args.all,
+                        request_name=args.request, workers=args.workers, sleep_time=args.sleep_time,
+                        connection_options=connection_options, dedup=dedup is not None,
+                        batched_results=not args.sync_results, crash_only=args.crash_only,
+                        ring_size=args.ring_size, asan_log=args.asan_log, lie_budget=args.length_lie_budget,
+                        extra_tokens=extra_tokens, payload_file=args.payload_file)
+        except KeyboardInterrupt:
+            print("\n[!] Fuzzing interrupted by user")
+        print("\n[*] Fuzzing complete!")
+        return 0
+
+    pacer = None
+    session_options = {}
+    if args.sleep_time is None:
+        pacer = AdaptivePacer()
+    else:
+        session_options["sleep_time"] = args.sleep_time
+    scheduler = None
+    if args.duration or args.slice:
+        scheduler = RequestScheduler(budget=args.duration, slice_time=args.slice or DEFAULT_SLICE_TIME)
+        # A time-budgeted campaign ends on its own.
+        session_options["keep_web_open"] = not args.duration
+    if args.case is not None or checkpoint is not None:
+        session_options["keep_web_open"] = False
+    session = create_session(args.target, args.port, fuzz_all=args.all, pacer=pacer, connections=connections,
+                             dedup=dedup, batched_results=not args.sync_results, crash_only=args.crash_only,
+                             ring_size=args.ring_size, asan_log=args.asan_log, lie_budget=args.length_lie_budget,
+                             extra_tokens=extra_tokens, payload_file=args.payload_file, **session_options)
+
     print(f"\n[*] Starting fuzzer against {args.target}:{args.port}")
     print("[*] Press Ctrl+C to stop\n")
 
     try:
-        if args.request:
+        if scheduler is not None:
+            scheduler.fuzz(session, name=args.request)
+        elif args.case is not None:
+            fuzz_indexed(session, args.request, args.case, args.case)
+        elif checkpoint is not None:
+            fuzz_indexed(session, args.request, index_start, checkpoint=checkpoint)
+        elif args.request:
             session.fuzz(name=args.request)
         else:
             session.fuzz()
@@ -616,6 +1302,19 @@ Or with AddressSanitizer:
     except Exception as e:
         print(f"\n[!] Error: {e}")
         return 1
+    finally:
+        if scheduler is not None:
+            print(scheduler.summary())
+        if checkpoint is not None:
+            checkpoint.save()
+            print(checkpoint.summary())
+        if pacer is not None:
+            print(pacer.summary())
+        if isinstance(session._db_logger, BatchedFuzzLoggerDb):
+            print(session._db_logger.summary())
+        print(connections.summary())
+        if dedup is not None:
+            print(dedup.summary())
 
     print("\n[*] Fuzzing complete!")
     return 0
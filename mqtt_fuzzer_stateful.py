@@ -22,14 +22,28 @@ from boofuzz import (
     Byte,
     Bytes,
     Word,
-    String,
     Static,
     BIG_ENDIAN,
 )
+from boofuzz.exception import BoofuzzTargetConnectionFailedError
+from mqtt_codec import MQTTPacketDecoder, collect_responses, describe, encode_remaining_length
+from mqtt_dedup import DedupSession, PayloadDeduplicator
+from mqtt_dictionary import MQTTDictionary, load_dictionary
+from mqtt_pacing import AdaptivePacer
+from mqtt_primitives import (DEFAULT_LIE_BUDGET, LengthPrefix, RemainingLength, SharedString, add_dictionary_tokens,
+                             set_lie_budget)
+from mqtt_results import DEFAULT_RING_SIZE, BatchedFuzzLoggerDb, batch_results
+from mqtt_scheduler import DEFAULT_SLICE_TIME, RequestScheduler
+from mqtt_templates import TemplateRequest
 import struct
 import socket
 import argparse
+import itertools
+import os
+import queue
+import select
 import sys
+import threading
 import time
 
 
@@ -48,6 +62,7 @@ MQTT_PUBREL      = 0x62
 
 MQTT_PROTOCOL_NAME = b"MQTT"
 MQTT_PROTOCOL_LEVEL = 0x04
+MQTT_KEEP_ALIVE = 60
 
 
 # =============================================================================
@@ -66,6 +81,11 @@ class MQTTConnection:
         self.client_id = client_id
         self.sock = None
         self.connected = False
+        self.last_activity = 0.0
+        self.last_received = 0.0
+        self.case_start = 0.0
+        self.decoder = MQTTPacketDecoder()
+        self.responses = []
 
     def build_connect_packet(self):
         """Build a valid CONNECT packet per MQTT 3.1.1 Section 3.1."""
@@ -74,33 +94,20 @@ class MQTTConnection:
         var_header += struct.pack(">H", 4) + MQTT_PROTOCOL_NAME
         var_header += bytes([MQTT_PROTOCOL_LEVEL])
         var_header += bytes([0x02])  # Clean Session
-        var_header += struct.pack(">H", 60)
+        var_header += struct.pack(">H", MQTT_KEEP_ALIVE)
 
         # Payload
         payload = struct.pack(">H", len(self.client_id)) + self.client_id.encode()
 
         # Remaining length
         remaining = len(var_header) + len(payload)
-        remaining_bytes = self._encode_remaining_length(remaining)
+        remaining_bytes = encode_remaining_length(remaining)
 
         # Fixed header
         fixed_header = bytes([MQTT_CONNECT]) + remaining_bytes
 
         return fixed_header + var_header + payload
 
-    def _encode_remaining_length(self, length):
-        """Encode remaining length per MQTT spec."""
-        encoded = bytearray()
-        while True:
-            digit = length % 128
-            length = length // 128
-            if length > 0:
-                digit |= 0x80
-            encoded.append(digit)
-            if length == 0:
-                break
-        return bytes(encoded)
-
     def connect(self):
         """Establish MQTT connection."""
         try:
@@ -112,17 +119,26 @@ class MQTTConnection:
             connect_packet = self.build_connect_packet()
             self.sock.sendall(connect_packet)
 
-            # Wait for CONNACK
-            response = self.sock.recv(4)
-            if len(response) >= 4:
-                packet_type = response[0] >> 4
-                if packet_type == 2:  # CONNACK
-                    return_code = response[3]
-                    if return_code == 0:
-                        self.connected = True
-                        return True
-                    else:
-                        print(f"[!] CONNACK return code: {return_code}")
+            # Wait for CONNACK, however the broker splits it across reads
+            packets = []
+            while not packets:
+                chunk = self.sock.recv(4096)
+                if not chunk:
+                    return False
+                packets = self.decoder.feed(chunk)
+
+            connack = packets[0]
+            if connack.packet_type == 2 and len(connack.body) == 2:
+                return_code = connack.body[1]
+                if return_code == 0:
+                    self.connected = True
+                    self.last_activity = time.time()
+                    self.responses = packets[1:]
+                    return True
+                else:
+                    print(f"[!] CONNACK return code: {return_code}")
+            else:
+                print(f"[!] Expected CONNACK, got {describe(packets)}")
 
             return False
 
@@ -148,51 +164,241 @@ class MQTTConnection:
         """Return the connected socket for boofuzz to use."""
         return self.sock
 
+    def is_stale(self):
+        """True if the broker may already have dropped us for exceeding the keep alive."""
+        return time.time() - self.last_activity > MQTT_KEEP_ALIVE * 0.75
 
-# =============================================================================
-# Callbacks for Stateful Protocols
-# =============================================================================
+    def start_case(self):
+        """Discard leftover broker output and mark the start of a new test case."""
+        self.drain()
+        self.responses = []
+        self.case_start = time.time()
 
-def pre_send_connect(target, fuzz_data_logger, session, sock):
+    def wait_readable(self, timeout):
+        """Wait up to timeout for broker output, EOF or reset. Consumes nothing."""
+        try:
+            readable, _, _ = select.select([self.sock], [], [], timeout)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def drain(self):
+        """
+        Read whatever the broker has already sent without blocking.
+        Returns False once the broker has closed or reset the connection.
+        """
+        if self.sock is None:
+            self.connected = False
+            return False
+        pending = self.decoder.pending
+        packets, closed = collect_responses(self.sock, self.decoder)
+        if packets or self.decoder.pending != pending:
+            self.last_received = time.time()
+        self.responses += packets
+        if closed:
+            self.connected = False
+        return not closed
+
+    def answered_case(self):
+        """True if the broker sent anything since start_case()."""
+        return self.last_received >= self.case_start
+
+
+class MQTTSessionPool:
     """
-    Callback that runs before each test case.
-    Ensures we have a valid MQTT connection established.
+    Pool of warm, already CONNACKed MQTT sessions.
+
+    A background thread keeps `size` sessions connected and ready, so the
+    CONNECT/CONNACK round trip happens off the critical path. Each test case
+    acquires a session and releases it afterwards; dead sessions are dropped
+    and replaced in the background.
     """
-    mqtt = getattr(session, '_mqtt_connection', None)
-    if mqtt is None:
-        mqtt = MQTTConnection(
-            target.connection.host,
-            target.connection.port,
-            client_id=f"fuzz_{int(time.time())}"
-        )
-        session._mqtt_connection = mqtt
 
-    if not mqtt.connected:
-        if mqtt.connect():
-            fuzz_data_logger.log_info("MQTT connection established")
+    def __init__(self, host, port, size=4, client_id_prefix="fuzz"):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.client_id_prefix = f"{client_id_prefix}_{os.getpid()}"
+        self.handshakes = 0
+        self.handshake_failures = 0
+        self._ready = queue.Queue()
+        self._ids = itertools.count(1)
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._refill, name="mqtt-session-pool", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._running = False
+        self._wakeup.set()
+        while True:
+            try:
+                self._ready.get_nowait().disconnect()
+            except queue.Empty:
+                break
+
+    def _refill(self):
+        while self._running:
+            if self._ready.qsize() >= self.size:
+                self._wakeup.wait(timeout=1.0)
+                self._wakeup.clear()
+                continue
+            mqtt = MQTTConnection(self.host, self.port,
+                                  client_id=f"{self.client_id_prefix}_{next(self._ids)}")
+            if mqtt.connect():
+                self.handshakes += 1
+                self._ready.put(mqtt)
+            else:
+                self.handshake_failures += 1
+                mqtt.disconnect()
+                time.sleep(0.5)
+
+    def acquire(self, timeout=5.0):
+        """Return a connected MQTTConnection, or None if none became ready in time."""
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            try:
+                mqtt = self._ready.get(timeout=remaining)
+            except queue.Empty:
+                return None
+            self._wakeup.set()
+            if mqtt.connected and not mqtt.is_stale():
+                return mqtt
+            mqtt.disconnect()
+
+    def release(self, mqtt):
+        """Return a session after a test case; it is reused only if still connected."""
+        if mqtt.connected:
+            mqtt.last_activity = time.time()
+            self._ready.put(mqtt)
         else:
-            fuzz_data_logger.log_error("Failed to establish MQTT connection")
+            mqtt.disconnect()
+            self._wakeup.set()
+
+
+class PooledMQTTConnection(TCPSocketConnection):
+    """
+    boofuzz target connection backed by an MQTTSessionPool.
+    open() hands boofuzz the socket of a session that is already past
+    CONNECT/CONNACK; close() gives the session back to the pool. When no
+    session becomes ready, the optional AdaptivePacer counts a refused connect.
+    """
+
+    def __init__(self, pool, send_timeout=5.0, recv_timeout=5.0, pacer=None):
+        super(PooledMQTTConnection, self).__init__(pool.host, pool.port, send_timeout, recv_timeout)
+        self.pool = pool
+        self.pacer = pacer
+        self.mqtt = None
+
+    def open(self):
+        self.mqtt = self.pool.acquire()
+        if self.mqtt is None:
+            if self.pacer is not None:
+                self.pacer.record_refused()
+            raise BoofuzzTargetConnectionFailedError("No MQTT session became ready")
+        self._sock = self.mqtt.sock
 
+    def close(self):
+        if self.mqtt is not None:
+            self.pool.release(self.mqtt)
+        self.mqtt = None
+        self._sock = None
 
-def post_test_case_callback(target, fuzz_data_logger, session, sock):
+
+# =============================================================================
+# Callbacks for Stateful Protocols
+# =============================================================================
+
+class LivenessChecker:
     """
-    Callback that runs after each test case.
-    Check if connection is still alive.
+    Decides after each test case whether the MQTT session survived it.
+
+    Passive first: an EOF or reset means the broker dropped us, and any output
+    the broker sent in answer to the case proves the session is alive. Only
+    when the broker stayed silent and kept the socket open is a PINGREQ sent.
+
+    Args:
+        settle_time (float): How long to wait for the broker to react before the state counts as ambiguous.
+        probe_timeout (float): How long to wait for any answer to the PINGREQ probe.
     """
-    mqtt = getattr(session, '_mqtt_connection', None)
-    if mqtt and mqtt.sock:
+
+    def __init__(self, settle_time=0.05, probe_timeout=1.0):
+        self.settle_time = settle_time
+        self.probe_timeout = probe_timeout
+        self.passive_alive = 0
+        self.passive_dead = 0
+        self.probes = 0
+        self.probe_failures = 0
+
+    def check(self, mqtt):
+        """Return True if the session is still usable."""
+        if self.settle_time and not mqtt.answered_case():
+            mqtt.wait_readable(self.settle_time)
+        if not mqtt.drain():
+            self.passive_dead += 1
+            return False
+        if mqtt.answered_case():
+            self.passive_alive += 1
+            return True
+        return self._probe(mqtt)
+
+    def _probe(self, mqtt):
+        self.probes += 1
+        probe_start = time.time()
         try:
-            mqtt.sock.settimeout(1.0)
             mqtt.sock.sendall(bytes([MQTT_PINGREQ, 0x00]))
-            response = mqtt.sock.recv(2)
-            if len(response) == 2 and response[0] == 0xD0:
-                return
-        except:
-            pass
+        except OSError:
+            mqtt.connected = False
+        else:
+            mqtt.last_activity = probe_start
+            if mqtt.wait_readable(self.probe_timeout) and mqtt.drain() and mqtt.last_received >= probe_start:
+                return True
+        self.probe_failures += 1
+        return False
+
+    def post_test_case_callback(self, target, fuzz_data_logger, session, sock, *args, **kwargs):
+        """
+        boofuzz post_test_case callback: retire the session if the broker dropped it.
+        The response types are kept in session._mqtt_responses for the RequestScheduler.
+        """
+        mqtt = getattr(session, "_mqtt_connection", None)
+        if mqtt is None or mqtt.sock is None:
+            return
+        alive = self.check(mqtt)
+        if mqtt.responses:
+            fuzz_data_logger.log_info(f"Broker responses: {describe(mqtt.responses)}")
+        session._mqtt_responses = describe(mqtt.responses) + ("" if alive else " + close")
+        if not alive:
+            fuzz_data_logger.log_info("Connection lost, session will be replaced")
+            mqtt.disconnect()
+
+    def summary(self):
+        return (
+            f"[*] Liveness: {self.passive_alive} alive and {self.passive_dead} dropped detected passively, "
+            f"{self.probes} PINGREQ probes ({self.probe_failures} unanswered)"
+        )
 
-        fuzz_data_logger.log_info("Connection lost, reconnecting...")
-        mqtt.disconnect()
-        mqtt.connected = False
+
+def pre_send_connect(target, fuzz_data_logger, session, sock):
+    """
+    Callback that runs before each test case.
+    Picks up the warm MQTT session the pooled connection handed to this case.
+    """
+    mqtt = target._target_connection.mqtt
+    session._mqtt_connection = mqtt
+    if mqtt is not None and mqtt.connected:
+        mqtt.start_case()
+        fuzz_data_logger.log_info(f"Using MQTT session {mqtt.client_id}")
+    else:
+        fuzz_data_logger.log_error("No established MQTT session for this test case")
 
 
 # =============================================================================
@@ -204,14 +410,14 @@ def define_mqtt_publish_connected():
     return Request("MQTT-PUBLISH-Connected", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_PUBLISH, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x00, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
-            Word(name="topic_length", default_value=0x000A, endian=BIG_ENDIAN, fuzzable=True),
-            String(name="topic_name", default_value="fuzz/topic", fuzzable=True, max_len=65535),
+            LengthPrefix(name="topic_length", string_name="topic_name", fuzzable=True),
+            SharedString(name="topic_name", default_value="fuzz/topic", fuzzable=True, max_len=65535),
         )),
         Block("Payload", children=(
-            String(name="application_message", default_value="fuzz_message", fuzzable=True, max_len=65535),
+            SharedString(name="application_message", default_value="fuzz_message", fuzzable=True, max_len=65535),
         )),
     ))
 
@@ -221,14 +427,14 @@ def define_mqtt_subscribe_connected():
     return Request("MQTT-SUBSCRIBE-Connected", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_SUBSCRIBE, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x00, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
             Word(name="packet_identifier", default_value=0x0001, endian=BIG_ENDIAN, fuzzable=True),
         )),
         Block("Payload", children=(
-            Word(name="topic_filter_length", default_value=0x000A, endian=BIG_ENDIAN, fuzzable=True),
-            String(name="topic_filter", default_value="fuzz/topic", fuzzable=True, max_len=65535),
+            LengthPrefix(name="topic_filter_length", string_name="topic_filter", fuzzable=True),
+            SharedString(name="topic_filter", default_value="fuzz/topic", fuzzable=True, max_len=65535),
             Byte(name="requested_qos", default_value=0x00, fuzzable=True),
         )),
     ))
@@ -239,14 +445,14 @@ def define_mqtt_unsubscribe_connected():
     return Request("MQTT-UNSUBSCRIBE-Connected", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_UNSUBSCRIBE, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x00, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
             Word(name="packet_identifier", default_value=0x0001, endian=BIG_ENDIAN, fuzzable=True),
         )),
         Block("Payload", children=(
-            Word(name="topic_filter_length", default_value=0x000A, endian=BIG_ENDIAN, fuzzable=True),
-            String(name="topic_filter", default_value="fuzz/topic", fuzzable=True),
+            LengthPrefix(name="topic_filter_length", string_name="topic_filter", fuzzable=True),
+            SharedString(name="topic_filter", default_value="fuzz/topic", fuzzable=True),
         )),
     ))
 
@@ -257,15 +463,15 @@ def define_mqtt_publish_qos1_connected():
         Block("Fixed-Header", children=(
             # PUBLISH + QoS 1
             Byte(name="packet_type", default_value=0x32, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x00, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
-            Word(name="topic_length", default_value=0x0006, endian=BIG_ENDIAN, fuzzable=True),
-            String(name="topic_name", default_value="qos1/t", fuzzable=True),
+            LengthPrefix(name="topic_length", string_name="topic_name", fuzzable=True),
+            SharedString(name="topic_name", default_value="qos1/t", fuzzable=True),
             Word(name="packet_identifier", default_value=0x0001, endian=BIG_ENDIAN, fuzzable=True),
         )),
         Block("Payload", children=(
-            String(name="application_message", default_value="qos1_msg", fuzzable=True),
+            SharedString(name="application_message", default_value="qos1_msg", fuzzable=True),
         )),
     ))
 
@@ -276,25 +482,25 @@ def define_mqtt_publish_qos2_connected():
         Block("Fixed-Header", children=(
             # PUBLISH + QoS 2
             Byte(name="packet_type", default_value=0x34, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x00, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
-            Word(name="topic_length", default_value=0x0006, endian=BIG_ENDIAN, fuzzable=True),
-            String(name="topic_name", default_value="qos2/t", fuzzable=True),
+            LengthPrefix(name="topic_length", string_name="topic_name", fuzzable=True),
+            SharedString(name="topic_name", default_value="qos2/t", fuzzable=True),
             Word(name="packet_identifier", default_value=0x0002, endian=BIG_ENDIAN, fuzzable=True),
         )),
         Block("Payload", children=(
-            String(name="application_message", default_value="qos2_msg", fuzzable=True),
+            SharedString(name="application_message", default_value="qos2_msg", fuzzable=True),
         )),
     ))
 
 
 def define_mqtt_pubrel_connected():
     """MQTT-PUBREL-Connected: PUBREL without prior PUBREC (protocol violation)."""
-    return Request("MQTT-PUBREL-Connected", children=(
+    return TemplateRequest("MQTT-PUBREL-Connected", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_PUBREL, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x02, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
             Word(name="packet_identifier", default_value=0xFFFF, endian=BIG_ENDIAN, fuzzable=True),
@@ -307,7 +513,7 @@ def define_mqtt_pingreq_connected():
     return Request("MQTT-PINGREQ-Connected", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_PINGREQ, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x00, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Extra-Bytes", children=(
             Bytes(name="extra_data", default_value=b"", fuzzable=True, max_len=100),
@@ -320,18 +526,18 @@ def define_mqtt_second_connect():
     return Request("MQTT-Second-CONNECT", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_CONNECT, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x10, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
-            Word(name="protocol_name_length", default_value=0x0004, endian=BIG_ENDIAN, fuzzable=True),
+            LengthPrefix(name="protocol_name_length", string_name="protocol_name", fuzzable=True),
             Static(name="protocol_name", default_value=MQTT_PROTOCOL_NAME),
             Byte(name="protocol_level", default_value=MQTT_PROTOCOL_LEVEL, fuzzable=True),
             Byte(name="connect_flags", default_value=0x02, fuzzable=True),
             Word(name="keep_alive", default_value=60, endian=BIG_ENDIAN, fuzzable=True),
         )),
         Block("Payload", children=(
-            Word(name="client_id_length", default_value=0x0006, endian=BIG_ENDIAN, fuzzable=True),
-            String(name="client_id", default_value="second", fuzzable=True),
+            LengthPrefix(name="client_id_length", string_name="client_id", fuzzable=True),
+            SharedString(name="client_id", default_value="second", fuzzable=True),
         )),
     ))
 
@@ -342,10 +548,10 @@ def define_mqtt_massive_topic():
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_PUBLISH, fuzzable=True),
             # Multi-byte remaining length
-            Bytes(name="remaining_length", default_value=b"\x80\x80\x01", fuzzable=True, max_len=4),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
-            Word(name="topic_length", default_value=0x4000, endian=BIG_ENDIAN, fuzzable=True),
+            LengthPrefix(name="topic_length", string_name="topic_name", fuzzable=True),
             Bytes(name="topic_name", default_value=b"A" * 0x4000, fuzzable=True, max_len=0x10000),
         )),
     ))
@@ -356,15 +562,16 @@ def define_mqtt_subscribe_wildcards():
     return Request("MQTT-SUBSCRIBE-Wildcards", children=(
         Block("Fixed-Header", children=(
             Byte(name="packet_type", default_value=MQTT_SUBSCRIBE, fuzzable=True),
-            Byte(name="remaining_length", default_value=0x00, fuzzable=True),
+            RemainingLength(name="remaining_length", fuzzable=True),
         )),
         Block("Variable-Header", children=(
             Word(name="packet_identifier", default_value=0x0005, endian=BIG_ENDIAN, fuzzable=True),
         )),
         Block("Payload", children=(
-            Word(name="topic_filter_length", default_value=0x0017, endian=BIG_ENDIAN, fuzzable=True),
+            LengthPrefix(name="topic_filter_length", string_name="topic_filter", fuzzable=True),
             # Invalid: multiple # wildcards, + adjacent to non-separator
-            String(name="topic_filter", default_value="sport/+/+/#/invalid/+/#", fuzzable=True),
+            SharedString(name="topic_filter", default_value="sport/+/+/#/invalid/+/#", fuzzable=True,
+                         dictionary=MQTTDictionary(["wildcards", "utf8"])),
             Byte(name="requested_qos", default_value=0x02, fuzzable=True),
         )),
     ))
@@ -374,33 +581,82 @@ def define_mqtt_subscribe_wildcards():
 # Session Configuration and Main
 # =============================================================================
 
-def create_stateful_session(host, port):
-    """Create a session for stateful fuzzing with callbacks."""
-    session = Session(
-        target=Target(
-            connection=TCPSocketConnection(host, port),
-        ),
-        sleep_time=0.05,
+def define_stateful_requests(lie_budget=None, extra_tokens=None):
+    """
+    Return the connected-state packet definitions in session order. lie_budget
+    limits the wrong length prefixes per field (see LengthPrefix); default: all.
+    extra_tokens (bytes) are added to the dictionary-driven fields (--dictionary).
+    """
+    print("[*] Defining connected-state packets...")
+    requests = [
+        define_mqtt_publish_connected(),
+        define_mqtt_subscribe_connected(),
+        define_mqtt_unsubscribe_connected(),
+        define_mqtt_publish_qos1_connected(),
+        define_mqtt_publish_qos2_connected(),
+        define_mqtt_pubrel_connected(),
+        define_mqtt_pingreq_connected(),
+        define_mqtt_second_connect(),
+        define_mqtt_massive_topic(),
+        define_mqtt_subscribe_wildcards(),
+    ]
+    if lie_budget is not None:
+        set_lie_budget(requests, lie_budget)
+    if extra_tokens:
+        add_dictionary_tokens(requests, extra_tokens)
+    return requests
+
+
+def create_stateful_session(host, port, pacer=None, sleep_time=0.05, pool_size=4, dedup=None, batched_results=True,
+                            crash_only=False, ring_size=DEFAULT_RING_SIZE, asan_log=None, lie_budget=None,
+                            extra_tokens=None, **session_options):
+    """
+    Create a session for stateful fuzzing with callbacks.
+    Test cases are sent on warm sessions from an MQTTSessionPool.
+    With a pacer, the fixed sleep_time is replaced by response-driven pacing.
+    With a PayloadDeduplicator, test cases that render to already sent bytes are skipped.
+    With batched_results, the results database is written by a BatchedFuzzLoggerDb;
+    with crash_only too, only the test cases around anomalies are written, keeping the
+    last ring_size in memory and watching the sanitizer logs matching asan_log.
+    Extra keyword arguments override the Session defaults below.
+    """
+    pool = MQTTSessionPool(host, port, size=pool_size).start()
+    # The pacer already waits for the broker to react, so the checker need not.
+    liveness = LivenessChecker(settle_time=0 if pacer is not None else 0.05)
+    post_test_case_callbacks = [liveness.post_test_case_callback]
+    if pacer is not None:
+        # Pace on the fuzzed socket before the liveness check touches the connection.
+        post_test_case_callbacks.insert(0, pacer.post_test_case_callback)
+        sleep_time = 0
+
+    options = dict(
+        sleep_time=sleep_time,
         restart_sleep_time=0.5,
         web_port=26001,  # Different port from basic fuzzer
         keep_web_open=True,
         crash_threshold_element=3,
         crash_threshold_request=10,
         pre_send_callbacks=[pre_send_connect],
-        post_test_case_callbacks=[post_test_case_callback],
+        post_test_case_callbacks=post_test_case_callbacks,
+    )
+    options.update(session_options)
+    session_class = Session
+    if dedup is not None:
+        session_class = DedupSession
+        options["dedup"] = dedup
+    session = session_class(
+        target=Target(
+            connection=PooledMQTTConnection(pool, pacer=pacer),
+        ),
+        **options
     )
+    if batched_results:
+        batch_results(session, crash_only=crash_only, ring_size=ring_size, asan_log=asan_log)
+    session._mqtt_pool = pool
+    session._liveness = liveness
 
-    print("[*] Defining connected-state packets...")
-    session.connect(define_mqtt_publish_connected())
-    session.connect(define_mqtt_subscribe_connected())
-    session.connect(define_mqtt_unsubscribe_connected())
-    session.connect(define_mqtt_publish_qos1_connected())
-    session.connect(define_mqtt_publish_qos2_connected())
-    session.connect(define_mqtt_pubrel_connected())
-    session.connect(define_mqtt_pingreq_connected())
-    session.connect(define_mqtt_second_connect())
-    session.connect(define_mqtt_massive_topic())
-    session.connect(define_mqtt_subscribe_wildcards())
+    for request in define_stateful_requests(lie_budget=lie_budget, extra_tokens=extra_tokens):
+        session.connect(request)
 
     return session
 
@@ -416,6 +672,7 @@ Finds bugs that only manifest in authenticated/connected state.
 Examples:
   %(prog)s -t localhost -p 1883
   %(prog)s -t 10.0.2.2 -p 1883 -r MQTT-PUBLISH-Connected
+  %(prog)s -t localhost -p 1883 --duration 3600
 
 Protocol reference:
   https://docs.oasis-open.org/mqtt/mqtt/v3.1.1/os/mqtt-v3.1.1-os.html
@@ -430,8 +687,42 @@ Protocol reference:
                         help="Fuzz only a specific request")
     parser.add_argument("-l", "--list", action="store_true",
                         help="List available requests")
+    parser.add_argument("-s", "--sleep-time", type=float, default=None,
+                        help="Fixed delay between test cases instead of response-driven pacing")
+    parser.add_argument("--pool-size", type=int, default=4,
+                        help="Number of warm, already connected MQTT sessions to keep ready")
+    parser.add_argument("--length-lie-budget", type=int, default=DEFAULT_LIE_BUDGET, metavar="N",
+                        help="Wrong string length prefixes to try per field: +1, -1, 0, 0xFFFF, past the "
+                             "packet end, in that order (default: all 5; 0 keeps every prefix correct)")
+
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Send every test case, even if it renders to the same bytes as an earlier one")
+    parser.add_argument("--sync-results", action="store_true",
+                        help="Write the results database with boofuzz's own writer: one synchronous "
+                             "transaction per test case")
+    parser.add_argument("--crash-only", action="store_true",
+                        help="Keep the last test cases in memory and write them to the results database only "
+                             "around anomalies (failures, refused connects, latency spikes, ASAN reports), "
+                             "plus periodic counter snapshots")
+    parser.add_argument("--ring-size", type=int, default=DEFAULT_RING_SIZE, metavar="N",
+                        help=f"Test cases kept in memory by --crash-only (default: {DEFAULT_RING_SIZE})")
+    parser.add_argument("--asan-log", metavar="GLOB",
+                        help="Sanitizer log files for --crash-only to watch for new reports, "
+                             "e.g. 'logs/asan.*'")
+    parser.add_argument("--dictionary", metavar="FILE",
+                        help="Extra tokens (AFL/libFuzzer dictionary format) for the dictionary-driven string fields")
+    parser.add_argument("--duration", type=float, default=None, metavar="SECONDS",
+                        help="Stop after this many seconds, interleaving the requests in yield-weighted time "
+                             "slices (default: run until interrupted)")
+    parser.add_argument("--slice", type=float, default=None, metavar="SECONDS",
+                        help="Interleave the requests in time slices of about this many seconds, longer for "
+                             "requests that find crashes, new or slow responses "
+                             f"(default: {DEFAULT_SLICE_TIME:g} with --duration)")
 
     args = parser.parse_args()
+    extra_tokens = tuple(load_dictionary(args.dictionary)) if args.dictionary else ()
+    if args.crash_only and (args.sync_results or args.ring_size < 1):
+        parser.error("--crash-only needs a --ring-size of at least 1 and cannot be combined with --sync-results")
 
     print("""
     ╔══════════════════════════════════════════════════════════════╗
@@ -445,24 +736,48 @@ Protocol reference:
     ╚══════════════════════════════════════════════════════════════╝
     """.format(host=args.target, port=args.port))
 
-    session = create_stateful_session(args.target, args.port)
-
     if args.list:
         print("\nAvailable requests:")
-        for name in session.fuzz_node_names():
-            print(f"  - {name}")
+        for request in define_stateful_requests(lie_budget=args.length_lie_budget, extra_tokens=extra_tokens):
+            print(f"  - {request.name}")
         return 0
 
+    pacer = AdaptivePacer() if args.sleep_time is None else None
+    dedup = None if args.no_dedup else PayloadDeduplicator()
+    scheduler = None
+    session_options = {}
+    if args.duration or args.slice:
+        scheduler = RequestScheduler(budget=args.duration, slice_time=args.slice or DEFAULT_SLICE_TIME)
+        # A time-budgeted campaign ends on its own.
+        session_options["keep_web_open"] = not args.duration
+    session = create_stateful_session(args.target, args.port, pacer=pacer, sleep_time=args.sleep_time,
+                                      pool_size=args.pool_size, dedup=dedup, batched_results=not args.sync_results,
+                                      crash_only=args.crash_only, ring_size=args.ring_size, asan_log=args.asan_log,
+                                      lie_budget=args.length_lie_budget, extra_tokens=extra_tokens, **session_options)
+
     print(f"[*] Target: {args.target}:{args.port}")
     print("[*] Press Ctrl+C to stop\n")
 
     try:
-        if args.request:
+        if scheduler is not None:
+            scheduler.fuzz(session, name=args.request)
+        elif args.request:
             session.fuzz(name=args.request)
         else:
             session.fuzz()
     except KeyboardInterrupt:
         print("\n[!] Interrupted")
+    finally:
+        session._mqtt_pool.close()
+        if scheduler is not None:
+            print(scheduler.summary())
+        print(session._liveness.summary())
+        if pacer is not None:
+            print(pacer.summary())
+        if isinstance(session._db_logger, BatchedFuzzLoggerDb):
+            print(session._db_logger.summary())
+        if dedup is not None:
+            print(dedup.summary())
 
     return 0
 
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+MQTT Havoc Mutation
+
+boofuzz walks each primitive's fixed mutation list, one field at a time.
+Havoc mode instead starts from the default rendering of every Request (a
+valid packet) and stacks random byte-level operations on it, as AFL's havoc
+stage does:
+
+- bit flips, random bytes and small arithmetic
+- interesting 8/16-bit values (0x00, 0x7f, 0x80, 0xff, 0x7fff, 0xffff, ...)
+- block deletes, inserts, clones and overwrites
+- splices with another seed packet
+- tokens from the MQTT dictionary (protocol names, wildcards, flag bytes,
+  UTF-8 edge sequences, see mqtt_dictionary) inserted or overwritten
+
+Half of the cases get their fixed header remaining length recomputed after
+mutation, so they pass the broker's framing check and reach the packet
+handlers.
+
+All randomness comes from a random.Random seeded from --seed, which draws a
+64-bit seed for every case; the same campaign seed gives the same cases.
+Each case gets a CPU budget: operations stop being stacked once it is spent.
+The case seed and the number of operations actually applied are part of the
+case name, so HavocMutator.replay() rebuilds any case exactly. Havoc never
+runs out of cases; it stops when the campaign's duration or case limit is
+reached.
+"""
+
+from mqtt_cases import TestCase
+from mqtt_codec import encode_remaining_length
+from mqtt_dictionary import MQTTDictionary
+import argparse
+import os
+import random
+import sys
+import time
+
+
+INTERESTING_8 = (0x00, 0x01, 0x02, 0x04, 0x10, 0x20, 0x40, 0x7F, 0x80, 0x81, 0xC0, 0xFE, 0xFF)
+INTERESTING_16 = (0x0000, 0x0001, 0x007F, 0x0080, 0x00FF, 0x0100, 0x3FFF, 0x4000, 0x7FFF, 0x8000, 0xFFFE, 0xFFFF)
+
+DEFAULT_MAX_STACK = 32
+DEFAULT_CPU_BUDGET = 0.0005
+DEFAULT_MAX_SIZE = 64 * 1024
+
+
+def havoc_seeds(requests):
+    """(request name, default rendering) of every request that renders whole."""
+    seeds = []
+    for request in requests:
+        data = request.render()
+        if getattr(data, "segments", None):
+            continue  # Streamed requests are not rendered whole.
+        seeds.append((request.name, bytes(data)))
+    return seeds
+
+
+def fix_remaining_length(buf):
+    """Re-encode the fixed header remaining length of buf in place to match its body."""
+    if len(buf) < 2:
+        return
+    end = 1
+    while end < 5 and end < len(buf) - 1 and buf[end] & 0x80:
+        end += 1
+    end += 1
+    buf[1:end] = encode_remaining_length(len(buf) - end)
+
+
+class HavocMutator:
+    """
+    Stacked random mutation of seed packets.
+
+    Args:
+        seeds (list): (name, bytes) seed packets, e.g. from havoc_seeds().
+        seed (int): RNG seed. Default: random.
+        max_stack (int): Most operations stacked on one case; a power of two up to this is drawn per case.
+            Default 32.
+        cpu_budget (float): CPU seconds one case may spend being mutated. Default 0.0005.
+        max_size (int): Cases do not grow past this many bytes. Default 65536.
+        tokens (sequence): Byte strings for the token operations. Default: every MQTTDictionary token.
+        fix_length (float): Fraction of cases whose remaining length is recomputed. Default 0.5.
+    """
+
+    def __init__(self, seeds, seed=None, max_stack=DEFAULT_MAX_STACK, cpu_budget=DEFAULT_CPU_BUDGET,
+                 max_size=DEFAULT_MAX_SIZE, tokens=None, fix_length=0.5):
+        if not seeds:
+            raise ValueError("havoc needs at least one seed packet")
+        self.seeds = list(seeds)
+        self.seed = seed if seed is not None else int.from_bytes(os.urandom(4), "big")
+        self.rng = random.Random(self.seed)
+        self._case_rng = random.Random()
+        self.max_stack = max_stack
+        self.cpu_budget = cpu_budget
+        self.max_size = max_size
+        self.tokens = tuple(tokens) if tokens is not None else MQTTDictionary().tokens
+        self.fix_length = fix_length
+        self.cases_generated = 0
+        self.ops_applied = 0
+        self.over_budget = 0
+        self._operations = (
+            self._flip_bit,
+            self._interesting_8,
+            self._interesting_16,
+            self._random_byte,
+            self._arithmetic,
+            self._delete_block,
+            self._delete_block,
+            self._insert_block,
+            self._overwrite_block,
+            self._splice,
+            self._insert_token,
+            self._overwrite_token,
+        )
+        self._stack_bits = max(1, max_stack.bit_length() - 1)
+
+    def _below(self, n):
+        return self._case_rng.getrandbits(32) % n
+
+    def _block_length(self, limit):
+        """Mostly short blocks, sometimes long ones, never more than limit."""
+        cap = 32 if self._below(4) else 1024
+        return 1 + self._below(max(1, min(limit, cap)))
+
+    # Operations ---------------------------------------------------------------
+
+    def _flip_bit(self, buf):
+        if buf:
+            bit = self._below(len(buf) * 8)
+            buf[bit >> 3] ^= 0x80 >> (bit & 7)
+
+    def _interesting_8(self, buf):
+        if buf:
+            buf[self._below(len(buf))] = INTERESTING_8[self._below(len(INTERESTING_8))]
+
+    def _interesting_16(self, buf):
+        if len(buf) >= 2:
+            position = self._below(len(buf) - 1)
+            value = INTERESTING_16[self._below(len(INTERESTING_16))]
+            buf[position:position + 2] = value.to_bytes(2, "big" if self._below(2) else "little")
+
+    def _random_byte(self, buf):
+        if buf:
+            buf[self._below(len(buf))] ^= 1 + self._below(255)
+
+    def _arithmetic(self, buf):
+        if buf:
+            position = self._below(len(buf))
+            delta = 1 + self._below(35)
+            buf[position] = (buf[position] + (delta if self._below(2) else -delta)) & 0xFF
+
+    def _delete_block(self, buf):
+        if len(buf) >= 2:
+            length = self._block_length(len(buf) - 1)
+            position = self._below(len(buf) - length + 1)
+            del buf[position:position + length]
+
+    def _insert_block(self, buf):
+        room = self.max_size - len(buf)
+        if room <= 0:
+            return
+        position = self._below(len(buf) + 1)
+        if buf and self._below(4):
+            length = self._block_length(min(len(buf), room))
+            source = self._below(len(buf) - length + 1)
+            block = buf[source:source + length]
+        else:
+            block = bytes([self._below(256)]) * self._block_length(room)
+        buf[position:position] = block
+
+    def _overwrite_block(self, buf):
+        if len(buf) >= 2:
+            length = self._block_length(len(buf) - 1)
+            source = self._below(len(buf) - length + 1)
+            target = self._below(len(buf) - length + 1)
+            buf[target:target + length] = buf[source:source + length]
+
+    def _splice(self, buf):
+        _, other = self.seeds[self._below(len(self.seeds))]
+        if not buf or not other:
+            return
+        cut = self._below(len(buf))
+        tail = other[self._below(len(other)):]
+        buf[cut:] = tail[:max(0, self.max_size - cut)]
+
+    def _insert_token(self, buf):
+        token = self.tokens[self._below(len(self.tokens))]
+        if len(buf) + len(token) <= self.max_size:
+            position = self._below(len(buf) + 1)
+            buf[position:position] = token
+
+    def _overwrite_token(self, buf):
+        token = self.tokens[self._below(len(self.tokens))]
+        if len(buf) >= len(token):
+            position = self._below(len(buf) - len(token) + 1)
+            buf[position:position + len(token)] = token
+
+    # Cases --------------------------------------------------------------------
+
+    def mutate(self, data, case_seed, ops=None):
+        """
+        Return (mutated bytes, number of operations applied). With ops, apply
+        exactly that many operations regardless of the CPU budget.
+        """
+        start = time.process_time()
+        self._case_rng.seed(case_seed)
+        buf = bytearray(data)
+        stack = 1 << (1 + self._below(self._stack_bits))
+        fix_length = self._below(1000) < self.fix_length * 1000
+        operations = self._operations
+        applied = 0
+        for _ in range(stack if ops is None else ops):
+            operations[self._below(len(operations))](buf)
+            applied += 1
+            if ops is None and time.process_time() - start > self.cpu_budget:
+                self.over_budget += 1
+                break
+        if fix_length:
+            fix_remaining_length(buf)
+        self.cases_generated += 1
+        self.ops_applied += applied
+        return bytes(buf), applied
+
+    def replay(self, name, case_seed, ops):
+        """Rebuild the case named "<name>:[havoc seed=<case_seed> ops=<ops>]"."""
+        for seed_name, data in self.seeds:
+            if seed_name == name:
+                return self.mutate(data, case_seed, ops)[0]
+        raise ValueError(f"Unknown seed: {name}")
+
+    def cases(self, duration=None, max_cases=None, index_start=1):
+        """
+        Yield havoc TestCases until duration seconds have passed or max_cases
+        were generated; with neither, forever.
+        """
+        deadline = time.time() + duration if duration else None
+        index = index_start
+        while max_cases is None or index < index_start + max_cases:
+            if deadline is not None and time.time() >= deadline:
+                return
+            name, seed = self.seeds[self.rng.getrandbits(32) % len(self.seeds)]
+            case_seed = self.rng.getrandbits(64)
+            data, applied = self.mutate(seed, case_seed)
+            yield TestCase(
+                index=index,
+                name=f"{name}:[havoc seed={case_seed:016x} ops={applied}]",
+                request=name,
+                data=data,
+            )
+            index += 1
+
+    def summary(self):
+        mean = self.ops_applied / self.cases_generated if self.cases_generated else 0.0
+        return (f"[*] Havoc: {self.cases_generated} test cases from seed {self.seed}, {mean:.1f} operations "
+                f"per case, {self.over_budget} cut short by the {self.cpu_budget * 1e6:.0f} us CPU budget")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Havoc mutation of MQTT seed packets")
+    parser.add_argument("--stats", type=int, metavar="N",
+                        help="Generate N cases, check that every case can be rebuilt from its name, "
+                             "and print rates")
+    parser.add_argument("--seed", type=int, default=1, help="RNG seed (default: 1)")
+    args = parser.parse_args()
+    if not args.stats:
+        parser.print_help()
+        return 0
+
+    from mqtt_fuzzer import define_requests
+    seeds = havoc_seeds(define_requests(fuzz_all=True))
+    mutator = HavocMutator(seeds, seed=args.seed)
+    start = time.perf_counter()
+    cases = list(mutator.cases(max_cases=args.stats))
+    elapsed = time.perf_counter() - start
+    sizes = sorted(len(case.data) for case in cases)
+    print(f"[*] {len(seeds)} seeds, {args.stats} cases in {elapsed:.2f}s "
+          f"({args.stats / elapsed:.0f} cases/sec, {elapsed / args.stats * 1e6:.1f} us/case)")
+    print(f"[*] Sizes: min {sizes[0]}, median {sizes[len(sizes) // 2]}, max {sizes[-1]} bytes; "
+          f"{len(set(case.data for case in cases))} distinct")
+    print(mutator.summary())
+
+    replayer = HavocMutator(seeds)
+    bad = 0
+    for case in cases:
+        fields = dict(part.split("=") for part in case.name.rsplit("[", 1)[1].rstrip("]").split()[1:])
+        if replayer.replay(case.request, int(fields["seed"], 16), int(fields["ops"])) != case.data:
+            bad += 1
+    if bad:
+        print(f"[!] {bad} cases could not be rebuilt from their names")
+        return 1
+    print("[*] Every case rebuilt exactly from its name")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""
+MQTT Test Case Index
+
+Random access to the single-mutation test cases of a list of Requests by
+their global 1-based case number (boofuzz's total_mutant_index). Session.fuzz()
+and mqtt_cases.iter_test_cases() reach case k by generating every mutation
+before it, so a shard, a resumed campaign or a replay of one case used to
+walk all earlier cases before sending anything.
+
+CaseIndex lists the fuzzable primitives of every request in mutation order
+with their mutation counts and keeps the running totals, so a case number
+maps to its request, primitive and mutation number with one bisect. The
+mutation itself comes from a per-primitive table:
+
+- Bytes: computed from the mutation number (the fixed values first, then
+  every 1, 2 and 4-byte pattern at every offset of the default value)
+- SharedString: the short values are listed; long strings are
+  StringMutationLibrary recipes, built when used
+- anything else: the primitive's few mutations, listed once
+
+Run this module with --verify to check CaseIndex against iter_test_cases()
+case for case.
+"""
+
+from boofuzz.blocks.block import Block
+from boofuzz.fuzzable_block import FuzzableBlock
+from boofuzz.mutation import Mutation
+from boofuzz.mutation_context import MutationContext
+from boofuzz.primitives.bytes import Bytes
+from mqtt_cases import TestCase, iter_test_cases, select_requests, test_case_name
+from mqtt_primitives import DictionaryBytes, SharedString
+import argparse
+import bisect
+import functools
+import itertools
+import re
+import sys
+import time
+
+
+def fuzzable_leaves(request):
+    """Fuzzable primitives of request in the order Request.get_mutations() walks them."""
+    def walk(block):
+        for item in block.stack:
+            if isinstance(item, FuzzableBlock):
+                if isinstance(item, Block) and (item.group is not None or item._fuzz_values):
+                    raise ValueError(f"{item.qualified_name}: blocks with a group or fuzz values are not indexed")
+                if item.fuzzable:
+                    yield from walk(item)
+            elif item.fuzzable:
+                yield item
+    return list(walk(request))
+
+
+# =============================================================================
+# Mutation tables
+# =============================================================================
+
+class MutationTable:
+    """
+    A primitive's mutations, listed once. Item j is the list of Mutations
+    get_mutations() yields j-th.
+    """
+
+    def __init__(self, primitive):
+        self.primitive = primitive
+        self._mutations = list(primitive.get_mutations())
+
+    def __len__(self):
+        return len(self._mutations)
+
+    def __getitem__(self, j):
+        return self._mutations[j]
+
+
+def _patch(value, offset, pattern):
+    """Bytes' positional mutation: pattern over value at offset, if it fits."""
+    if offset < len(value) - (len(pattern) - 1):
+        return value[:offset] + pattern + value[offset + len(pattern):]
+    return value
+
+
+def _adjusted(adjust, mutator):
+    """The mutation function adjust(mutator(value)), as Bytes builds them."""
+    return lambda value: adjust(mutator(value))
+
+
+class BytesMutationTable:
+    """
+    Bytes (and DictionaryBytes) mutations by number. The positional
+    mutations, len(default) times each pattern, are computed rather than
+    listed.
+    """
+
+    def __init__(self, primitive):
+        self.primitive = primitive
+        adjust = primitive._adjust_mutation_for_size
+        default = primitive.original_value()
+        values = []
+        if isinstance(primitive, DictionaryBytes) and primitive.dictionary is not None:
+            values += primitive.dictionary.values(bytes(default))
+        values += primitive._fuzz_library
+        self._head = [adjust(value) for value in values]
+        self._head += [_adjusted(adjust, mutator) for mutator in primitive._mutators_of_default_value]
+        self._head += [adjust(value) for value in primitive._magic_debug_values]
+        self._regions = []
+        for patterns in (primitive._fuzz_strings_1byte, primitive._fuzz_strings_2byte, primitive._fuzz_strings_4byte):
+            width = len(patterns[0]) if patterns else 1
+            self._regions.append((patterns, len(patterns) * max(0, len(default) - (width - 1))))
+        self._tail = list(primitive._fuzz_values)
+        self._length = len(self._head) + sum(count for _, count in self._regions) + len(self._tail)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, j):
+        if not 0 <= j < self._length:
+            raise IndexError(j)
+        value = self._value(j)
+        return [Mutation(value=value, qualified_name=self.primitive.qualified_name, index=j)]
+
+    def _value(self, j):
+        if j < len(self._head):
+            return self._head[j]
+        k = j - len(self._head)
+        for patterns, count in self._regions:
+            if k < count:
+                offset, n = divmod(k, len(patterns))
+                return _adjusted(self.primitive._adjust_mutation_for_size,
+                                 functools.partial(_patch, offset=offset, pattern=patterns[n]))
+            k -= count
+        return self._tail[k]
+
+
+class StringMutationTable:
+    """
+    SharedString mutations by number: the dictionary, library and variable
+    values are listed, long strings are kept as recipes and built on use.
+    Consecutive repeats are dropped as SharedString.mutations() drops them.
+    """
+
+    def __init__(self, primitive):
+        self.primitive = primitive
+        adjust = primitive._adjust_mutation_for_size
+        default = primitive.original_value()
+        self._values = []
+        last = None
+        for value in itertools.chain(
+            primitive._dictionary_values(default),
+            primitive._fuzz_library,
+            primitive._yield_variable_mutations(default),
+        ):
+            value = adjust(value)
+            if value != last:
+                self._values.append(value)
+                last = value
+        max_len = primitive.max_len
+        self._recipes = []
+        last_key = None
+        for recipe in primitive.library.long_string_recipes(max_len):
+            sequence, size, terminator = recipe
+            # Recipes longer than max_len are cut to max_len, so this is what the value depends on.
+            key = (sequence, size if max_len is None else min(size, max_len), terminator)
+            if last_key is None:
+                repeat = adjust(primitive.library.long_string(recipe)) == last
+            else:
+                repeat = key == last_key
+            last_key = key
+            if not repeat:
+                self._recipes.append(recipe)
+        self._tail = list(primitive._fuzz_values)
+
+    def __len__(self):
+        return len(self._values) + len(self._recipes) + len(self._tail)
+
+    def __getitem__(self, j):
+        if not 0 <= j < len(self):
+            raise IndexError(j)
+        if j < len(self._values):
+            value = self._values[j]
+        elif j < len(self._values) + len(self._recipes):
+            recipe = self._recipes[j - len(self._values)]
+            value = self.primitive._adjust_mutation_for_size(self.primitive.library.long_string(recipe))
+        else:
+            value = self._tail[j - len(self._values) - len(self._recipes)]
+        return [Mutation(value=value, qualified_name=self.primitive.qualified_name, index=j)]
+
+
+def mutation_table(primitive):
+    """The random-access mutation table for primitive."""
+    if type(primitive) in (Bytes, DictionaryBytes):
+        return BytesMutationTable(primitive)
+    if type(primitive) is SharedString:
+        return StringMutationTable(primitive)
+    return MutationTable(primitive)
+
+
+# =============================================================================
+# Index
+# =============================================================================
+
+_TEST_CASE_NAME = re.compile(r"^(?P<request>[^:]+):\[(?P<element>.+):(?P<index>\d+)\]$")
+
+
+class CaseIndex:
+    """
+    Global case number -> (request, mutations) for single-mutation test cases.
+
+    Args:
+        requests (list): Requests in session order.
+    """
+
+    def __init__(self, requests):
+        self.requests = list(requests)
+        self._slots = []
+        self._ends = []
+        self._slot_of = {}
+        self._request_ends = {}
+        total = 0
+        for request in self.requests:
+            for primitive in fuzzable_leaves(request):
+                table = mutation_table(primitive)
+                if not len(table):
+                    continue
+                self._slot_of[(request.name, primitive.qualified_name)] = len(self._slots)
+                self._slots.append((request, primitive, table, total))
+                total += len(table)
+                self._ends.append(total)
+            self._request_ends[request.name] = total
+
+    def __len__(self):
+        return self._ends[-1] if self._ends else 0
+
+    def _slot(self, index):
+        if not 1 <= index <= len(self):
+            raise IndexError(f"Test case {index} is out of range 1-{len(self)}")
+        return bisect.bisect_left(self._ends, index)
+
+    def locate(self, index):
+        """(request, primitive, mutation number within the primitive) of case index."""
+        request, primitive, _, start = self._slots[self._slot(index)]
+        return request, primitive, index - start - 1
+
+    def mutations(self, index):
+        """(request, list of Mutations) of case index."""
+        request, _, table, start = self._slots[self._slot(index)]
+        return request, table[index - start - 1]
+
+    def case(self, index):
+        """Render case index as a TestCase."""
+        request, mutations = self.mutations(index)
+        context = MutationContext(mutations={m.qualified_name: m for m in mutations})
+        return TestCase(
+            index=index,
+            name=test_case_name(request, mutations),
+            request=request.name,
+            data=request.render(mutation_context=context),
+        )
+
+    def cases(self, index_start=1, index_end=None):
+        """Yield the TestCases index_start..index_end without generating any earlier case."""
+        index_end = len(self) if index_end is None else min(index_end, len(self))
+        for index in range(max(1, index_start), index_end + 1):
+            yield self.case(index)
+
+    def index_of(self, name):
+        """Case number of a single-mutation test case name, e.g. "MQTT-CONNECT:[MQTT-CONNECT.x.y:12]"."""
+        match = _TEST_CASE_NAME.match(name)
+        if match is None:
+            raise ValueError(f"Not a single-mutation test case name: {name}")
+        slot = self._slot_of.get((match.group("request"), match.group("element")))
+        if slot is None:
+            raise ValueError(f"Unknown request or element: {name}")
+        _, _, table, start = self._slots[slot]
+        number = int(match.group("index"))
+        if number >= len(table):
+            raise ValueError(f"{match.group('element')} has only {len(table)} mutations: {name}")
+        return start + number + 1
+
+    def request_start(self, index):
+        """Case number of the first case of the request case index belongs to."""
+        request = self._slots[self._slot(index)][0]
+        first = self.requests.index(request)
+        return self._request_ends[self.requests[first - 1].name] + 1 if first else 1
+
+    def next_request(self, index):
+        """Case number of the first case after the request case index belongs to."""
+        return self._request_ends[self._slots[self._slot(index)][0].name] + 1
+
+    def next_primitive(self, index):
+        """Case number of the first case after the primitive case index belongs to."""
+        return self._ends[self._slot(index)] + 1
+
+
+def session_requests(session):
+    """The Requests of a boofuzz Session in fuzzing order."""
+    return [session.nodes[path[-1].dst] for path in session._iterate_protocol_message_paths()]
+
+
+def fuzz_range(session, index, index_start=1, index_end=None, checkpoint=None):
+    """
+    Fuzz cases index_start..index_end of index (built over the session's own
+    Requests) with a boofuzz Session, starting straight at index_start.
+    Cases keep the numbers and names Session.fuzz() gives them. When a crash
+    threshold is reached, the rest of the element or request is skipped as
+    Session.fuzz() skips it. With a Checkpoint (see mqtt_checkpoint), progress
+    is recorded after every case.
+    """
+    session.total_mutant_index = 0
+    session.total_num_mutations = len(index)
+    session._main_fuzz_loop(_session_cases(session, index, index_start, index_end, checkpoint))
+
+
+def _session_cases(session, index, index_start, index_end, checkpoint):
+    paths = {session.nodes[path[-1].dst].name: list(path) for path in session._iterate_protocol_message_paths()}
+    index_end = len(index) if index_end is None else min(index_end, len(index))
+    case = max(1, index_start)
+    while case <= index_end:
+        request, primitive, _ = index.locate(case)
+        _, mutations = index.mutations(case)
+        session.fuzz_node = request
+        request.mutant = primitive
+        session.mutant_index = case - index.request_start(case) + 1
+        session.total_mutant_index = case
+        yield MutationContext(message_path=paths[request.name],
+                              mutations={m.qualified_name: m for m in mutations})
+        if session._skip_current_node_after_current_test_case:
+            session._skip_current_node_after_current_test_case = False
+            case = index.next_request(case)
+        elif session._skip_current_element_after_current_test_case:
+            session._skip_current_element_after_current_test_case = False
+            case = index.next_primitive(case)
+        else:
+            case += 1
+        if checkpoint is not None:
+            checkpoint.update(case=session.total_mutant_index, next_case=case, current_request=request.name)
+
+
+# =============================================================================
+# Verification
+# =============================================================================
+
+def verify(requests, samples=2000):
+    """
+    Compare every case of CaseIndex with iter_test_cases(), then time random
+    access. Returns the number of mismatches.
+    """
+    start = time.perf_counter()
+    index = CaseIndex(requests)
+    build_time = time.perf_counter() - start
+    print(f"[*] Indexed {len(index)} test cases of {len(index.requests)} requests in {build_time:.2f}s")
+
+    mismatches = 0
+    count = 0
+    for expected in iter_test_cases(requests):
+        count += 1
+        actual = index.case(expected.index)
+        if (actual.name, actual.request, actual.data) != (expected.name, expected.request, expected.data):
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"  [!] case {expected.index}: {expected.name} != {actual.name}")
+        elif index.index_of(expected.name) != expected.index:
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"  [!] index_of({expected.name}) = {index.index_of(expected.name)}, not {expected.index}")
+    if count != len(index):
+        print(f"  [!] iter_test_cases yields {count} cases, the index counts {len(index)}")
+        mismatches += abs(count - len(index))
+
+    step = max(1, len(index) // samples)
+    numbers = list(range(len(index), 0, -step))
+    start = time.perf_counter()
+    for number in numbers:
+        index.locate(number)
+    locate_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for number in numbers:
+        index.mutations(number)
+    mutation_time = time.perf_counter() - start
+    print(f"[*] Random access over {len(numbers)} cases: locate {locate_time / len(numbers) * 1e6:.1f} us, "
+          f"mutation {mutation_time / len(numbers) * 1e6:.1f} us per case")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Random access to MQTT test cases by number")
+    parser.add_argument("--verify", action="store_true",
+                        help="Check every indexed case against iter_test_cases() and time random access")
+    parser.add_argument("-r", "--request", help="Only this request")
+    parser.add_argument("--case", type=int, metavar="N", help="Print test case N")
+    args = parser.parse_args()
+    if not args.verify and args.case is None:
+        parser.print_help()
+        return 0
+
+    from mqtt_fuzzer import define_requests
+    requests = select_requests(define_requests(fuzz_all=True), args.request)
+    if args.case is not None:
+        start = time.perf_counter()
+        index = CaseIndex(requests)
+        build_time = time.perf_counter() - start
+        start = time.perf_counter()
+        case = index.case(args.case)
+        case_time = time.perf_counter() - start
+        print(f"[*] Case {case.index} of {len(index)}: {case.name}")
+        print(f"[*] {len(case.data)} bytes, rendered in {case_time * 1e6:.0f} us (index built in {build_time:.2f}s)")
+        print(f"    {bytes(case.data[:64])!r}{'...' if len(case.data) > 64 else ''}")
+        return 0
+
+    mismatches = verify(requests)
+    if mismatches:
+        print(f"[!] {mismatches} test cases differ")
+        return 1
+    print("[*] Every indexed test case matches iter_test_cases()")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
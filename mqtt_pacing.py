@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+MQTT Response-driven Adaptive Pacing
+
+Replaces a fixed boofuzz sleep_time. After each test case the pacer waits
+only until the broker has answered or closed the socket, then moves on.
+It adds a delay between cases only when the broker shows signs of overload:
+response latency rising well above its running baseline, or refused connects.
+The delay decays back towards zero once the broker is keeping up again.
+"""
+
+import select
+import time
+
+
+class AdaptivePacer:
+    """
+    Response-driven pacing controller.
+
+    Args:
+        max_wait (float): Longest time to wait for the broker to answer or close after a case.
+        max_delay (float): Upper bound for the back-off delay between cases.
+        backoff_step (float): First delay applied when overload is detected.
+        backoff_factor (float): Multiplier applied to the delay on each further overload signal.
+        decay (float): Multiplier applied to the delay after each healthy case.
+        spike_factor (float): Latency above this multiple of the baseline counts as overload.
+        latency_floor (float): Latencies below this are never treated as overload.
+    """
+
+    def __init__(self, max_wait=0.1, max_delay=2.0, backoff_step=0.005, backoff_factor=2.0,
+                 decay=0.9, spike_factor=4.0, latency_floor=0.005):
+        self.max_wait = max_wait
+        self.max_delay = max_delay
+        self.backoff_step = backoff_step
+        self.backoff_factor = backoff_factor
+        self.decay = decay
+        self.spike_factor = spike_factor
+        self.latency_floor = latency_floor
+
+        self.delay = 0.0
+        self.cases = 0
+        self.responses = 0
+        self.silent = 0
+        self.refused = 0
+        self.backoffs = 0
+        self.total_delay = 0.0
+        self.total_wait = 0.0
+
+        # Fast-moving and slow-moving averages of response latency.
+        self._latency = None
+        self._baseline = None
+        self._recent_delay = 0.0
+
+    # -------------------------------------------------------------------------
+    # Signals
+    # -------------------------------------------------------------------------
+
+    def record_response(self, latency):
+        """Broker answered (or closed the socket) after latency seconds."""
+        self.cases += 1
+        self.responses += 1
+        self.total_wait += latency
+        if self._baseline is None:
+            self._latency = self._baseline = latency
+        else:
+            self._latency += 0.2 * (latency - self._latency)
+            self._baseline += 0.01 * (latency - self._baseline)
+
+        if self._latency > self.latency_floor and self._latency > self.spike_factor * self._baseline:
+            self._back_off()
+        else:
+            self._relax()
+
+    def record_silence(self, waited=None):
+        """Broker neither answered nor closed in time. Not an overload signal by itself."""
+        self.cases += 1
+        self.silent += 1
+        self.total_wait += self.max_wait if waited is None else waited
+        self._relax()
+
+    def record_refused(self):
+        """A connect to the broker was refused or timed out."""
+        self.refused += 1
+        self._back_off()
+
+    def _back_off(self):
+        self.backoffs += 1
+        self.delay = min(self.max_delay, max(self.backoff_step, self.delay * self.backoff_factor))
+
+    def _relax(self):
+        self.delay *= self.decay
+        if self.delay < self.backoff_step / 10:
+            self.delay = 0.0
+
+    # -------------------------------------------------------------------------
+    # Helpers for boofuzz sessions
+    # -------------------------------------------------------------------------
+
+    def wait_for_response(self, sock):
+        """
+        Block until sock is readable (data, EOF or reset) or max_wait passes,
+        and feed the outcome into the controller. Does not consume any data.
+        """
+        start = time.monotonic()
+        try:
+            readable, _, _ = select.select([sock], [], [], self.max_wait)
+        except (OSError, ValueError):
+            readable = [sock]  # socket already closed: the broker has made up its mind
+        elapsed = time.monotonic() - start
+        if readable:
+            self.record_response(elapsed)
+        else:
+            self.record_silence(elapsed)
+
+    def next_delay(self):
+        """Return the delay to apply before the next case and account for it."""
+        self._recent_delay += 0.05 * (self.delay - self._recent_delay)
+        self.total_delay += self.delay
+        return self.delay
+
+    def pause(self):
+        """Sleep for the current back-off delay, if any."""
+        delay = self.next_delay()
+        if delay > 0:
+            time.sleep(delay)
+
+    def post_test_case_callback(self, target, fuzz_data_logger, session, sock, *args, **kwargs):
+        """boofuzz post_test_case callback: wait for the broker, then pace."""
+        connection = getattr(target, "_target_connection", None)
+        raw_sock = getattr(connection, "_sock", None)
+        if raw_sock is not None:
+            self.wait_for_response(raw_sock)
+        self.pause()
+        if self.delay > 0:
+            fuzz_data_logger.log_info(f"Pacing: broker overloaded, delaying {self.delay * 1000:.1f} ms")
+
+    # -------------------------------------------------------------------------
+    # Reporting
+    # -------------------------------------------------------------------------
+
+    @property
+    def effective_delay(self):
+        """Smoothed delay the controller has converged to, in seconds."""
+        return self._recent_delay
+
+    def summary(self):
+        latency = self._latency * 1000 if self._latency is not None else 0.0
+        mean_wait = self.total_wait / self.cases * 1000 if self.cases else 0.0
+        return (
+            f"[*] Pacing: effective delay {self.effective_delay * 1000:.2f} ms "
+            f"(current {self.delay * 1000:.2f} ms), mean wait for broker {mean_wait:.2f} ms, "
+            f"latency {latency:.2f} ms, {self.backoffs} back-offs, {self.refused} refused connects, "
+            f"{self.silent} silent cases"
+        )
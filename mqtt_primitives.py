@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""
+MQTT-aware boofuzz Primitives
+
+Custom boofuzz Fuzzables for the parts of MQTT framing that a generic Byte or
+Word cannot express. Their default rendering is always protocol-correct, so
+a test case that mutates some other field still reaches the broker's real
+packet handlers instead of being dropped by the first framing check.
+"""
+
+from boofuzz import Bytes, String
+from boofuzz.fuzzable import Fuzzable
+from boofuzz.fuzzable_block import FuzzableBlock
+from mqtt_codec import encode_remaining_length
+import collections
+import itertools
+import math
+
+
+# =============================================================================
+# Remaining Length (Section 2.2.3)
+# =============================================================================
+
+# Lengths at which the variable-length encoding grows by a byte, and the
+# largest encodable value, plus one past it (which needs a fifth byte).
+REMAINING_LENGTH_BOUNDARIES = (
+    0, 1,
+    127, 128,
+    16383, 16384,
+    2097151, 2097152,
+    268435455, 268435456,
+)
+
+# Encodings no valid length has: missing, truncated continuation, five
+# continuation bytes without a terminator, and a five-byte maximum.
+MALFORMED_REMAINING_LENGTHS = (
+    b"",
+    b"\x80",
+    b"\xff\xff\xff",
+    b"\xff\xff\xff\xff\xff",
+    b"\xff\xff\xff\xff\x7f",
+)
+
+RelativeLength = collections.namedtuple("RelativeLength", ["delta"])
+OverlongLength = collections.namedtuple("OverlongLength", ["width"])
+
+
+def streamed_length(item, mutation_context=None):
+    """
+    Bytes item sends on the wire beyond what it renders: the length of any
+    streamed payloads (see mqtt_streaming) it is or contains.
+    """
+    if isinstance(item, FuzzableBlock):
+        return sum(streamed_length(child, mutation_context) for child in item.stack)
+    length = getattr(item, "streamed_length", None)
+    return length(mutation_context) if length is not None else 0
+
+
+def encode_overlong(length, width):
+    """Encode length in exactly width bytes by padding with zero-valued continuation bytes."""
+    encoded = bytearray(encode_remaining_length(length))
+    while len(encoded) < width:
+        encoded[-1] |= 0x80
+        encoded.append(0x00)
+    return bytes(encoded)
+
+
+class RemainingLength(Fuzzable):
+    """
+    MQTT fixed header remaining length, computed from the blocks that follow.
+
+    Renders the real variable-length encoding of everything after the block
+    that contains it (or of block_names, if given), so unmutated packets are
+    well formed. Mutations target the encoding boundaries (127/128,
+    16383/16384, 2097151/2097152, the 268435455 maximum), the true length
+    +/- a little, non-minimal (over-long) encodings of the true length up to
+    five bytes, and malformed encodings.
+
+    Args:
+        name (str): Name, for referencing later.
+        block_names (list): Names of the blocks to measure. Default: every element of the
+            request after the block this primitive is in.
+        fuzzable (bool): Enable/disable fuzzing of this primitive. Default True.
+    """
+
+    def __init__(self, name=None, block_names=None, *args, **kwargs):
+        super(RemainingLength, self).__init__(name=name, default_value=None, *args, **kwargs)
+        self.block_names = block_names
+
+    def mutations(self, default_value):
+        for length in REMAINING_LENGTH_BOUNDARIES:
+            yield length
+        for delta in (-1, 1, 2, 128):
+            yield RelativeLength(delta)
+        for width in (2, 3, 4, 5):
+            yield OverlongLength(width)
+        for encoded in MALFORMED_REMAINING_LENGTHS:
+            yield encoded
+
+    def num_mutations(self, default_value):
+        return len(REMAINING_LENGTH_BOUNDARIES) + 4 + 4 + len(MALFORMED_REMAINING_LENGTHS)
+
+    def encode(self, value, mutation_context):
+        if isinstance(value, bytes):
+            return value
+        if isinstance(value, int):
+            return encode_remaining_length(value)
+        length = self._calculated_length(mutation_context)
+        if isinstance(value, RelativeLength):
+            return encode_remaining_length(max(0, length + value.delta))
+        if isinstance(value, OverlongLength):
+            return encode_overlong(length, value.width)
+        return encode_remaining_length(length)
+
+    def _calculated_length(self, mutation_context):
+        items = self._measured_items()
+        length = sum(len(item.render(mutation_context=mutation_context)) for item in items)
+        return length + sum(streamed_length(item, mutation_context) for item in items)
+
+    def _measured_items(self):
+        if self.request is None:
+            return []
+        if self.block_names is not None:
+            return [self.request.resolve_name(self.context_path, name) for name in self.block_names]
+        # Top-level element holding this primitive, e.g. "Fixed-Header" in "MQTT-CONNECT.Fixed-Header".
+        path = self.context_path.split(".")
+        own = path[1] if len(path) > 1 else self.name
+        items = list(self.request.stack)
+        names = [item.name for item in items]
+        return items[names.index(own) + 1:] if own in names else []
+
+    def __len__(self):
+        return len(self.render())
+
+
+# =============================================================================
+# String Length Prefix (Section 1.5.3)
+# =============================================================================
+
+# Ways a length prefix can lie, in the order they are spent from the budget.
+LENGTH_LIES = (
+    "plus_one",     # one byte longer than the string
+    "minus_one",    # one byte shorter than the string
+    "zero",         # empty, string bytes spill into the next field
+    "max",          # 0xFFFF
+    "past_end",     # longer than everything left in the packet
+)
+
+LengthLie = collections.namedtuple("LengthLie", ["kind"])
+
+DEFAULT_LIE_BUDGET = len(LENGTH_LIES)
+
+
+class LengthPrefix(Fuzzable):
+    """
+    Two-byte big-endian length prefix bound to the string it describes.
+
+    By default it renders the real length of the (possibly mutated) string,
+    so a mutated client_id or topic still passes the broker's length checks.
+    Its own mutations are a separate, budgeted pass of controlled lies: +1,
+    -1, 0, 0xFFFF and a length past the end of the packet, spent in that
+    order up to lie_budget.
+
+    Args:
+        name (str): Name, for referencing later.
+        string_name (str): Name of the String/Bytes/Static element this prefix describes.
+        lie_budget (int): How many lies to generate; default all of them (DEFAULT_LIE_BUDGET).
+        fuzzable (bool): Enable/disable fuzzing of this primitive. Default True.
+    """
+
+    def __init__(self, name=None, string_name=None, lie_budget=None, *args, **kwargs):
+        super(LengthPrefix, self).__init__(name=name, default_value=None, *args, **kwargs)
+        self.string_name = string_name
+        self.lie_budget = lie_budget
+
+    @property
+    def _lies(self):
+        budget = DEFAULT_LIE_BUDGET if self.lie_budget is None else self.lie_budget
+        return LENGTH_LIES[:max(0, budget)]
+
+    def mutations(self, default_value):
+        for kind in self._lies:
+            yield LengthLie(kind)
+
+    def num_mutations(self, default_value):
+        return len(self._lies)
+
+    def encode(self, value, mutation_context):
+        target = self._target()
+        length = len(target.render(mutation_context=mutation_context)) if target is not None else 0
+        if isinstance(value, LengthLie):
+            if value.kind == "plus_one":
+                length += 1
+            elif value.kind == "minus_one":
+                length -= 1
+            elif value.kind == "zero":
+                length = 0
+            elif value.kind == "max":
+                length = 0xFFFF
+            elif value.kind == "past_end":
+                length += self._length_after(target, mutation_context) + 1
+        return (length % 0x10000).to_bytes(2, "big")
+
+    def _target(self):
+        if self.request is None or self.string_name is None:
+            return None
+        return self.request.resolve_name(self.context_path, self.string_name)
+
+    def _length_after(self, target, mutation_context):
+        """Rendered length of every primitive after target in the request."""
+        after = False
+        length = 0
+        for item in self.request.walk():
+            if after and not isinstance(item, FuzzableBlock):
+                length += len(item.render(mutation_context=mutation_context))
+                length += streamed_length(item, mutation_context)
+            elif item is target:
+                after = True
+        return length
+
+    def __len__(self):
+        return 2
+
+
+def set_lie_budget(requests, lie_budget):
+    """Give every LengthPrefix in requests without a budget of its own the budget lie_budget."""
+    for request in requests:
+        for item in request.walk():
+            if isinstance(item, LengthPrefix) and item.lie_budget is None:
+                item.lie_budget = lie_budget
+    return requests
+
+
+def add_dictionary_tokens(requests, tokens):
+    """Add tokens (bytes) to the dictionary of every dictionary-driven field in requests."""
+    for request in requests:
+        for item in request.walk():
+            if isinstance(item, (SharedString, DictionaryBytes)) and item.dictionary is not None:
+                item.dictionary = item.dictionary.extended(tokens)
+    return requests
+
+
+# =============================================================================
+# Shared String Mutation Library
+# =============================================================================
+
+class StringMutationLibrary:
+    """
+    boofuzz's String long-string mutations, shared by every SharedString.
+
+    A plain String rebuilds each long string (up to a megabyte) on every pass
+    over each field, and counts its mutations by generating all of them once
+    per field. Here every long string is described once per max_len by a
+    small recipe, (sequence, size, terminator position), and built only when
+    it is consumed. Built values up to cache_max_value characters are kept
+    in an LRU cache with a byte budget; larger ones are dropped after use.
+    Mutation counts are kept per max_len. Memory stays the same however many
+    string fields the requests have.
+
+    Args:
+        cache_bytes (int): Byte budget of the built value cache. Default 1 MiB.
+        cache_max_value (int): Longer values are built on every use, never cached. Default 4096.
+    """
+
+    def __init__(self, cache_bytes=1024 * 1024, cache_max_value=4096):
+        self.cache_bytes = cache_bytes
+        self.cache_max_value = cache_max_value
+        self._prototypes = {}
+        self._recipes = {}
+        self._counts = {}
+        self._cache = collections.OrderedDict()
+        self._cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _prototype(self, max_len):
+        prototype = self._prototypes.get(max_len)
+        if prototype is None:
+            prototype = self._prototypes[max_len] = String(name=f"string-library-{max_len}", max_len=max_len)
+        return prototype
+
+    def long_string_recipes(self, max_len):
+        """Recipes in the order String._yield_long_strings produces its values."""
+        recipes = self._recipes.get(max_len)
+        if recipes is not None:
+            return recipes
+        prototype = self._prototype(max_len)
+        recipes = []
+        for sequence in prototype.long_string_seeds:
+            sizes = [length + delta
+                     for length, delta in itertools.product(String._long_string_lengths, String._long_string_deltas)]
+            for size in sizes:
+                if max_len is not None and size > max_len:
+                    break
+                recipes.append((sequence, size, None))
+            for size in String._extra_long_string_lengths:
+                if max_len is not None and size > max_len:
+                    break
+                recipes.append((sequence, size, None))
+            if max_len is not None:
+                recipes.append((sequence, len(sequence) * math.ceil(max_len / len(sequence)), None))
+        for size in String._long_string_lengths:
+            if max_len is not None and size > max_len:
+                break
+            for loc in prototype.random_indices[size]:
+                recipes.append(("D", size, loc))
+        self._recipes[max_len] = recipes
+        return recipes
+
+    @staticmethod
+    def _build(recipe):
+        sequence, size, terminator = recipe
+        data = (sequence * math.ceil(size / len(sequence)))[:size]
+        if terminator is not None:
+            data = data[:terminator] + "\x00" + data[terminator + 1:]
+        return data
+
+    def long_string(self, recipe):
+        """The value of one recipe, from the cache if it is small enough to be kept."""
+        if recipe[1] > self.cache_max_value:
+            return self._build(recipe)
+        value = self._cache.get(recipe)
+        if value is not None:
+            self._cache.move_to_end(recipe)
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = self._cache[recipe] = self._build(recipe)
+        self._cached_bytes += len(value)
+        while self._cached_bytes > self.cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= len(evicted)
+        return value
+
+    def long_strings(self, max_len):
+        """Yield the long-string mutations for max_len, building each one only when it is consumed."""
+        for recipe in self.long_string_recipes(max_len):
+            yield self.long_string(recipe)
+
+    def num_static_mutations(self, max_len):
+        """Mutation count of a String with max_len and an empty default value, as String computes it."""
+        count = self._counts.get(max_len)
+        if count is None:
+            count = self._counts[max_len] = sum(1 for _ in self._prototype(max_len).mutations(default_value=""))
+        return count
+
+    @property
+    def cached_bytes(self):
+        return self._cached_bytes
+
+
+STRING_LIBRARY = StringMutationLibrary()
+
+
+class SharedString(String):
+    """
+    String whose mutations come from a shared StringMutationLibrary.
+
+    Yields exactly the mutations of boofuzz's String, in the same order, so
+    test case indices and names do not change. With a dictionary (see
+    mqtt_dictionary), its tokens come first: on their own, then appended and
+    prepended to the default value. They are sent as raw bytes, so invalid
+    UTF-8 survives encoding.
+
+    Args:
+        library (StringMutationLibrary): Library to use. Default: the module-wide STRING_LIBRARY.
+        dictionary (MQTTDictionary): Tokens to try before the generic mutations. Default: none.
+        All other arguments are those of String.
+    """
+
+    def __init__(self, name=None, default_value="", library=None, dictionary=None, *args, **kwargs):
+        super(SharedString, self).__init__(name=name, default_value=default_value, *args, **kwargs)
+        self.library = library if library is not None else STRING_LIBRARY
+        self.dictionary = dictionary
+
+    def _dictionary_values(self, default_value):
+        if self.dictionary is None:
+            return ()
+        return self.dictionary.values(default_value.encode(self.encoding, "replace"))
+
+    def mutations(self, default_value):
+        last_val = None
+        for val in itertools.chain(
+            self._dictionary_values(default_value),
+            self._fuzz_library,
+            self._yield_variable_mutations(default_value),
+            self.library.long_strings(self.max_len),
+        ):
+            current_val = self._adjust_mutation_for_size(val)
+            if last_val == current_val:
+                continue
+            last_val = current_val
+            yield current_val
+
+    def num_mutations(self, default_value):
+        if self.dictionary is not None:
+            return sum(1 for _ in self.mutations(default_value))
+        variable_num_mutations = sum(1 for _ in self._yield_variable_mutations(default_value=default_value))
+        return self.library.num_static_mutations(self.max_len) + variable_num_mutations
+
+    def encode(self, value, mutation_context=None):
+        if isinstance(value, bytes):
+            return value
+        return super(SharedString, self).encode(value, mutation_context)
+
+
+class DictionaryBytes(Bytes):
+    """
+    Bytes that tries the tokens of a dictionary (see mqtt_dictionary) before
+    boofuzz's Bytes mutations: on their own, then appended and prepended to
+    the default value.
+
+    Args:
+        dictionary (MQTTDictionary): Tokens to try first.
+        All other arguments are those of Bytes.
+    """
+
+    def __init__(self, name=None, default_value=b"", dictionary=None, *args, **kwargs):
+        super(DictionaryBytes, self).__init__(name=name, default_value=default_value, *args, **kwargs)
+        self.dictionary = dictionary
+
+    def mutations(self, default_value):
+        if self.dictionary is not None:
+            for value in self.dictionary.values(bytes(default_value)):
+                yield self._adjust_mutation_for_size(value)
+        yield from super(DictionaryBytes, self).mutations(default_value)
+
+    def num_mutations(self, default_value):
+        count = super(DictionaryBytes, self).num_mutations(default_value)
+        if self.dictionary is not None:
+            count += self.dictionary.num_values(bytes(default_value))
+        return count
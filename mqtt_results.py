@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+"""
+MQTT Results Writer
+
+boofuzz's FuzzLoggerDb writes every test case to the run's SQLite database
+in boofuzz-results/ as its own transaction, on the fuzzing thread, in
+rollback-journal mode with synchronous=FULL: several fsyncs per case. On a
+long run the fsync stalls come straight out of the case rate.
+
+BatchedFuzzLoggerDb writes the same rows to the same tables from a
+background thread instead:
+
+- many cases per transaction: a batch is handed over after batch_cases
+  cases or batch_interval seconds, whichever comes first
+- WAL journal with synchronous=NORMAL: a commit appends to the write-ahead
+  log without waiting for an fsync, and the web UI keeps reading while the
+  writer writes
+- backpressure: a batch is handed over only once the previous one is
+  committed; when the disk cannot keep up, the fuzzer waits instead of
+  queueing without bound
+
+A batch holding a failure or error (a broker crash) is handed over at once
+and the fuzzer waits until it is committed, as is the last batch when the
+run ends. A fuzzer crash loses at most the batch being filled and the one
+batch handed over but not yet committed.
+
+If a commit fails, that batch is rolled back and dropped, not retried; the
+next hand-over or flush() raises the error once.
+
+Most of what gets written is passing test cases ("No crash detected.").
+RingBufferFuzzLoggerDb (--crash-only) keeps only the last ring_size cases,
+with what was sent and received, in memory, using boofuzz's own
+keep-last-N queue. It writes them to the database only when an anomaly
+happens:
+
+- a failure or error logged by boofuzz (monitors, crash thresholds, the
+  connection being reset or failing mid-case)
+- the broker refusing the connection for the next test case
+- a latency spike: a test case taking latency_factor times as long as the
+  typical case
+- an ASAN hit: a new AddressSanitizer report in the files matching asan_log
+
+Every snapshot_interval seconds a row of counters (cases run, cases
+written, anomalies by kind) goes to the counters table, so the campaign's
+progress stays visible.
+
+Run this module to compare the writers on synthetic test cases.
+"""
+
+from boofuzz import constants, helpers
+from boofuzz.fuzz_logger_db import FuzzLoggerDb
+import argparse
+import glob
+import os
+import queue
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+
+DEFAULT_BATCH_CASES = 500
+DEFAULT_BATCH_INTERVAL = 1.0
+
+# Queued after the last batch of a run (see BatchedFuzzLoggerDb.close_test).
+_CHECKPOINT = "checkpoint"
+
+DEFAULT_RING_SIZE = 100
+DEFAULT_SNAPSHOT_INTERVAL = 60.0
+
+ANOMALY_KINDS = ("failure", "connection", "latency", "asan")
+ASAN_MARKERS = (b"ERROR: AddressSanitizer", b"ERROR: LeakSanitizer", b"ERROR: UndefinedBehaviorSanitizer",
+                b"runtime error:")
+
+
+class BatchedFuzzLoggerDb(FuzzLoggerDb):
+    """
+    FuzzLoggerDb that commits in batches from a background thread.
+
+    Args:
+        db_filename (str): SQLite database to write; created with boofuzz's tables if needed.
+        num_log_cases (int): As for FuzzLoggerDb: keep only the last N passing cases. Default 0: keep all.
+        batch_cases (int): Most test cases per transaction. Default 500.
+        batch_interval (float): Most seconds a test case waits to be handed to the writer. Default 1.
+    """
+
+    def __init__(self, db_filename, num_log_cases=0, batch_cases=DEFAULT_BATCH_CASES,
+                 batch_interval=DEFAULT_BATCH_INTERVAL):
+        super(BatchedFuzzLoggerDb, self).__init__(db_filename, num_log_cases=num_log_cases)
+        self._database_connection.execute("PRAGMA journal_mode=WAL")
+        self.db_filename = db_filename
+        self.batch_cases = batch_cases
+        self.batch_interval = batch_interval
+        self._batch = []
+        self._batch_cases = 0
+        self._batch_start = None
+        self._pending = queue.Queue()
+        self._error = None
+        self.cases_logged = 0
+        self.cases = 0
+        self.rows = 0
+        self.batches = 0
+        self.commit_time = 0.0
+        self.wait_time = 0.0
+        self._writer = threading.Thread(target=self._write_batches, name="results-writer", daemon=True)
+        self._writer.start()
+
+    def _write_log(self, force=False):
+        """Move the rows of finished test cases into the current batch; hand it over when it is full."""
+        if self._queue:
+            if self._queue_max_len > 0:
+                while (
+                    self._current_test_case_index - next(x for x in self._queue[0] if isinstance(x, int))
+                ) >= self._queue_max_len:
+                    self._queue.popleft()
+            else:
+                force = True
+
+            if force or self._fail_detected or self._log_first_case:
+                for query in self._queue:
+                    if not self._fail_detected:
+                        self._truncate_send_recv(query)
+                    if query[0].startswith("INSERT INTO cases"):
+                        self._batch_cases += 1
+                        self.cases_logged += 1
+                    self._batch.append((query[0], tuple(query[1:])))
+                self._queue.clear()
+                if self._batch_start is None:
+                    self._batch_start = time.monotonic()
+                self._log_first_case = False
+                if self._fail_detected:
+                    self._fail_detected = False
+                    self.flush()
+                    return
+
+        if (self._batch_cases >= self.batch_cases
+                or (self._batch and time.monotonic() - self._batch_start >= self.batch_interval)):
+            self._hand_over()
+
+    def close_test(self):
+        super(BatchedFuzzLoggerDb, self).close_test()
+        self.flush()
+        # Fold the write-ahead log into the database, so the .db file alone holds the whole run.
+        self._pending.put(_CHECKPOINT)
+        self._pending.join()
+
+    def _hand_over(self):
+        """Queue the current batch for the writer once the previous one is committed."""
+        if not self._batch:
+            return
+        start = time.monotonic()
+        self._pending.join()
+        self.wait_time += time.monotonic() - start
+        self._raise_writer_error()
+        self._pending.put((self._batch, self._batch_cases))
+        self._batch = []
+        self._batch_cases = 0
+        self._batch_start = None
+
+    def flush(self):
+        """Hand over the current batch and wait until everything handed over is committed."""
+        self._hand_over()
+        start = time.monotonic()
+        self._pending.join()
+        self.wait_time += time.monotonic() - start
+        self._raise_writer_error()
+
+    def _raise_writer_error(self):
+        """Raise the error of a failed commit, once; its batch is lost."""
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def close(self):
+        """Commit everything and stop the writer thread."""
+        self.flush()
+        self._pending.put(None)
+        self._writer.join()
+
+    def _write_batches(self):
+        connection = sqlite3.connect(self.db_filename, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        while True:
+            item = self._pending.get()
+            if item is None:
+                self._pending.task_done()
+                break
+            if item is _CHECKPOINT:
+                connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                self._pending.task_done()
+                continue
+            batch, cases = item
+            start = time.monotonic()
+            try:
+                connection.execute("BEGIN")
+                statement = None
+                rows = []
+                # Consecutive rows for the same table go in one executemany().
+                for sql, values in batch:
+                    if sql != statement and rows:
+                        connection.executemany(statement, rows)
+                        rows = []
+                    statement = sql
+                    rows.append(values)
+                if rows:
+                    connection.executemany(statement, rows)
+                connection.execute("COMMIT")
+            except sqlite3.Error as e:
+                # The batch is dropped, not retried; the fuzzer sees the error at its next hand-over.
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+                self._error = e
+            else:
+                self.cases += cases
+                self.rows += len(batch)
+                self.batches += 1
+            self.commit_time += time.monotonic() - start
+            self._pending.task_done()
+        connection.close()
+
+    def summary(self):
+        mean = self.commit_time / self.batches * 1000 if self.batches else 0.0
+        return (f"[*] Results: {self.cases} test cases in {self.batches} transactions ({mean:.1f} ms each), "
+                f"fuzzer waited {self.wait_time:.2f}s for the writer")
+
+
+class RingBufferFuzzLoggerDb(BatchedFuzzLoggerDb):
+    """
+    BatchedFuzzLoggerDb that writes test cases only around anomalies, plus
+    periodic counter snapshots. Its post_test_case_callback must be
+    registered with the session (see batch_results()).
+
+    Args:
+        db_filename (str): SQLite database to write.
+        ring_size (int): Test cases kept in memory and written when an anomaly happens. Default 100.
+        asan_log (str): Glob of sanitizer log files to watch. Default none.
+        latency_factor (float): A case this many times slower than typical is a latency spike. Default 10.
+        latency_floor (float): A spike also takes at least this many seconds longer than typical. Default 0.05.
+        snapshot_interval (float): Seconds between counter snapshots. Default 60.
+        **options: Batching options for BatchedFuzzLoggerDb.
+    """
+
+    def __init__(self, db_filename, ring_size=DEFAULT_RING_SIZE, asan_log=None, latency_factor=10.0,
+                 latency_floor=0.05, snapshot_interval=DEFAULT_SNAPSHOT_INTERVAL, **options):
+        super(RingBufferFuzzLoggerDb, self).__init__(db_filename, num_log_cases=ring_size, **options)
+        self._database_connection.execute(
+            """CREATE TABLE IF NOT EXISTS counters (timestamp TEXT, test_cases integer, cases_written integer,
+                                                    anomalies integer, failures integer, connection integer,
+                                                    latency integer, asan integer)"""
+        )
+        self.ring_size = ring_size
+        self.asan_log = asan_log
+        self.latency_factor = latency_factor
+        self.latency_floor = latency_floor
+        self.snapshot_interval = snapshot_interval
+        self.test_cases = 0
+        self.snapshots = 0
+        self.anomalies = dict.fromkeys(ANOMALY_KINDS, 0)
+        self.typical_time = None
+        self._last_case_end = None
+        self._last_snapshot = time.monotonic()
+        self._asan_offsets = {}
+        if self.asan_log:
+            # Only reports written from now on count.
+            for path in glob.glob(self.asan_log):
+                self._asan_offsets[path] = os.path.getsize(path)
+
+    def anomaly(self, kind, description):
+        """Record an anomaly in the current test case; the ring is written when the case closes."""
+        self.anomalies[kind] += 1
+        super(RingBufferFuzzLoggerDb, self).log_info(f"Anomaly ({kind}): {description}")
+        self._fail_detected = True
+
+    def open_test_case(self, test_case_id, name, index, *args, **kwargs):
+        self.test_cases += 1
+        super(RingBufferFuzzLoggerDb, self).open_test_case(test_case_id, name, index, *args, **kwargs)
+
+    def log_info(self, description):
+        super(RingBufferFuzzLoggerDb, self).log_info(description)
+        if description == constants.WARN_CONN_FAILED_TERMINAL:
+            self.anomaly("connection", "the broker refused the connection after the previous test case")
+
+    def log_fail(self, description=""):
+        self.anomalies["failure"] += 1
+        super(RingBufferFuzzLoggerDb, self).log_fail(description)
+
+    def log_error(self, description):
+        self.anomalies["failure"] += 1
+        super(RingBufferFuzzLoggerDb, self).log_error(description)
+
+    def post_test_case_callback(self, target, fuzz_data_logger, session, sock, *args, **kwargs):
+        """Check the finished test case for a latency spike or a new ASAN report; snapshot the counters."""
+        now = time.monotonic()
+        if self._last_case_end is not None:
+            self._check_latency(now - self._last_case_end)
+        self._last_case_end = now
+        if self.asan_log:
+            self._check_asan()
+        if now - self._last_snapshot >= self.snapshot_interval:
+            self.snapshot()
+
+    def _check_latency(self, elapsed):
+        if self.typical_time is None:
+            self.typical_time = elapsed
+            return
+        if (self.test_cases > 20 and elapsed > self.latency_factor * self.typical_time
+                and elapsed - self.typical_time > self.latency_floor):
+            self.anomaly("latency", f"test case took {elapsed * 1000:.1f} ms, "
+                                    f"typical {self.typical_time * 1000:.1f} ms")
+        self.typical_time = 0.9 * self.typical_time + 0.1 * elapsed
+
+    def _check_asan(self):
+        for path in glob.glob(self.asan_log):
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            offset = self._asan_offsets.get(path, 0)
+            if size <= offset:
+                continue
+            with open(path, "rb") as f:
+                f.seek(offset)
+                report = f.read(size - offset)
+            self._asan_offsets[path] = size
+            for line in report.splitlines():
+                if any(marker in line for marker in ASAN_MARKERS):
+                    self.anomaly("asan", f"{os.path.basename(path)}: {line.decode(errors='replace').strip()}")
+                    break
+
+    def snapshot(self):
+        """Queue a row of counters for the writer."""
+        self._last_snapshot = time.monotonic()
+        self.snapshots += 1
+        self._batch.append((
+            "INSERT INTO counters VALUES(?, ?, ?, ?, ?, ?, ?, ?);\n",
+            (helpers.get_time_stamp(), self.test_cases, self.cases_logged, sum(self.anomalies.values()))
+            + tuple(self.anomalies[kind] for kind in ANOMALY_KINDS),
+        ))
+        self._hand_over()
+
+    def close_test(self):
+        self.snapshot()
+        super(RingBufferFuzzLoggerDb, self).close_test()
+
+    def summary(self):
+        kinds = ", ".join(f"{self.anomalies[kind]} {kind}" for kind in ANOMALY_KINDS)
+        return (f"[*] Crash-only results: {self.cases} of {self.test_cases} test cases written around "
+                f"{sum(self.anomalies.values())} anomalies ({kinds}), ring of {self.ring_size}, "
+                f"{self.snapshots} counter snapshots")
+
+
+def batch_results(session, crash_only=False, ring_size=DEFAULT_RING_SIZE, asan_log=None, **options):
+    """
+    Replace the boofuzz Session's results database logger with a
+    BatchedFuzzLoggerDb on the same file, or with crash_only a
+    RingBufferFuzzLoggerDb of ring_size cases watching asan_log whose anomaly
+    checks run after every test case; options are passed to it.
+    """
+    old = session._db_logger
+    if crash_only:
+        logger = RingBufferFuzzLoggerDb(session._db_filename, ring_size=ring_size, asan_log=asan_log, **options)
+        session.register_post_test_case_callback(logger.post_test_case_callback)
+    else:
+        logger = BatchedFuzzLoggerDb(session._db_filename, num_log_cases=old._queue_max_len, **options)
+    old._database_connection.close()
+    loggers = session._fuzz_data_logger._fuzz_loggers
+    loggers[loggers.index(old)] = logger
+    session._db_logger = logger
+    return logger
+
+
+# =============================================================================
+# Benchmark
+# =============================================================================
+
+def _log_cases(logger, count, payload, fail_every):
+    """Log count synthetic test cases; every fail_every-th one fails."""
+    for index in range(1, count + 1):
+        logger.open_test_case(f"case {index}", name=f"MQTT-CONNECT:[MQTT-CONNECT.Payload.client_id:{index}]",
+                              index=index)
+        logger.open_test_step("Fuzzing Node 'MQTT-CONNECT'")
+        logger.log_send(payload)
+        logger.log_recv(b"\x20\x02\x00\x00")
+        logger.log_info("Broker responses: CONNACK(0)")
+        if index % fail_every == 0:
+            logger.log_fail("Target connection reset.")
+        else:
+            logger.log_pass("No crash detected.")
+        logger.close_test_case()
+    logger.close_test()
+
+
+def _dump(db_filename):
+    connection = sqlite3.connect(db_filename)
+    cases = connection.execute("SELECT name, number FROM cases ORDER BY rowid").fetchall()
+    steps = connection.execute(
+        "SELECT test_case_index, type, description, data, is_truncated FROM steps ORDER BY rowid").fetchall()
+    connection.close()
+    return cases, steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare boofuzz's results writer with the batched and "
+                                                 "crash-only ones")
+    parser.add_argument("-n", "--cases", type=int, default=2000, help="Synthetic test cases to log (default: 2000)")
+    parser.add_argument("--fail-every", type=int, default=1000, metavar="N",
+                        help="Every Nth synthetic test case fails (default: 1000)")
+    parser.add_argument("-d", "--directory", help="Directory for the databases (default: a temporary one)")
+    args = parser.parse_args()
+
+    directory = args.directory or tempfile.mkdtemp(prefix="mqtt-results-")
+    helpers.mkdir_safe(directory)
+    payload = bytes(range(256)) * 3
+    timings = {}
+    for name, make in (("boofuzz", FuzzLoggerDb), ("batched", BatchedFuzzLoggerDb),
+                       ("crash-only", RingBufferFuzzLoggerDb)):
+        db_filename = os.path.join(directory, f"{name}.db")
+        for path in (db_filename, f"{db_filename}-wal", f"{db_filename}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+        logger = make(db_filename)
+        start = time.perf_counter()
+        _log_cases(logger, args.cases, payload, args.fail_every)
+        timings[name] = time.perf_counter() - start
+        if isinstance(logger, BatchedFuzzLoggerDb):
+            logger.close()
+        logger._database_connection.close()
+        print(f"[*] {name:<10} {args.cases} cases in {timings[name]:.2f}s "
+              f"({args.cases / timings[name]:.0f} cases/sec), {os.path.getsize(db_filename) / 1024:.0f} KiB "
+              f"-> {db_filename}")
+        if isinstance(logger, BatchedFuzzLoggerDb):
+            print(logger.summary())
+
+    if _dump(os.path.join(directory, "boofuzz.db")) != _dump(os.path.join(directory, "batched.db")):
+        print("[!] The databases differ")
+        return 1
+    print(f"[*] Both databases hold the same rows; batched is {timings['boofuzz'] / timings['batched']:.1f}x faster")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+MQTT Request Scheduler
+
+session.fuzz() works through the Requests one at a time and exhausts each
+before starting the next, so a campaign stopped early never reaches the
+later ones (MQTT-SUBSCRIBE-Multi, the --all malformed set). RequestScheduler
+hands the same boofuzz test cases to the session in time slices instead:
+every Request gets a slice in turn, round after round, until all of them
+are exhausted or the total wall-clock budget is spent.
+
+A Request's slice grows with its yield over the previous slices:
+
+- crashes: new entries in the session's monitor results
+- new responses: broker answers (packet types, or a closed connection) not
+  seen before for this Request, as stored in session._mqtt_responses by the
+  post-test-case callbacks
+- slow responses: answered test cases that took more than slow_factor times
+  the Request's typical case time. A silent case only ends when the pacer
+  stops waiting for an answer, so its time is not the broker's and is ignored.
+
+Yield is counted per second of fuzzing and decays from slice to slice, so a
+Request that stops producing falls back to an even share. Shares are kept
+between min_share and max_share of the average, so no Request starves.
+
+Test case names are boofuzz's own, so any case can still be replayed by
+name. Case numbers count in the order the cases are sent.
+"""
+
+from boofuzz import helpers
+from boofuzz.mutation_context import MutationContext
+import time
+
+
+DEFAULT_SLICE_TIME = 2.0
+
+# Yield points per event.
+CRASH_WEIGHT = 10.0
+NEW_RESPONSE_WEIGHT = 1.0
+SLOW_RESPONSE_WEIGHT = 1.0
+
+# Answered cases a Request must have sent before its case times count as typical.
+SLOW_WARMUP = 20
+
+# A slow case also takes at least this many seconds longer than typical, so
+# scheduling jitter on sub-millisecond cases does not count.
+SLOW_MIN_DELAY = 0.02
+
+
+class ScheduledRequest:
+    """
+    One Request (message path) of the session and its yield so far.
+
+    Args:
+        session (Session): The session fuzzing it.
+        path (list): Edges leading to the Request.
+        max_depth (int): Most mutations combined in one case. Default: no limit.
+    """
+
+    def __init__(self, session, path, max_depth=None):
+        self.session = session
+        self.path = path
+        self.node = session.nodes[path[-1].dst]
+        self.name = self.node.name
+        self.max_depth = max_depth
+        self.share = 1.0
+        self.score = 0.0
+        self.elapsed = 0.0
+        self.cases = 0
+        self.sent = 0
+        self.answered = 0
+        self.crashes = 0
+        self.new_responses = 0
+        self.slow_responses = 0
+        self.typical_time = None
+        self.signatures = set()
+        self.mutant_index = 0
+        self._mutations = self._generate()
+        self.pending = None
+        self.fetch()
+
+    def _generate(self):
+        """boofuzz's mutations for this path, depth 1, 2, ..., without touching the case counter."""
+        session = self.session
+        depth = 1
+        while self.max_depth is None or depth <= self.max_depth:
+            found = False
+            for mutations in session._generate_n_mutations_for_path_recursive(self.path, depth=depth):
+                if not session._mutations_contain_duplicate(mutations):
+                    found = True
+                    yield mutations
+            if not found:
+                return
+            depth += 1
+
+    def fetch(self):
+        """
+        Take the next case from the generator. Called right after this
+        Request's previous case, so boofuzz's crash threshold skips apply to
+        this Request and not to the one scheduled next.
+        """
+        self.pending = next(self._mutations, None)
+        self.mutant_index = self.session.mutant_index
+
+    def observe(self, elapsed, crashed, signature, slow_factor):
+        """Account for one finished test case; return its yield points."""
+        self.cases += 1
+        points = 0.0
+        if crashed:
+            self.crashes += 1
+            points += CRASH_WEIGHT
+        if signature is None:
+            return points  # Not sent (e.g. a duplicate), so its time says nothing about the broker.
+        self.sent += 1
+        if signature not in self.signatures:
+            self.signatures.add(signature)
+            self.new_responses += 1
+            points += NEW_RESPONSE_WEIGHT
+        if not signature:
+            return points  # Silent: elapsed is how long the pacer waited for an answer.
+        self.answered += 1
+        if self.typical_time is None:
+            self.typical_time = elapsed
+        elif (self.answered > SLOW_WARMUP and elapsed > slow_factor * self.typical_time
+              and elapsed - self.typical_time > SLOW_MIN_DELAY):
+            self.slow_responses += 1
+            points += SLOW_RESPONSE_WEIGHT
+        self.typical_time = 0.9 * self.typical_time + 0.1 * elapsed
+        return points
+
+
+class RequestScheduler:
+    """
+    Interleaves a boofuzz Session's Requests in yield-weighted time slices.
+
+    Args:
+        budget (float): Total seconds to fuzz for. Default: until every Request is exhausted.
+        slice_time (float): Seconds per slice at an average share. Default 2.
+        max_depth (int): Most mutations combined in one case, as for Session.fuzz(). Default: no limit.
+        slow_factor (float): A case this many times slower than the Request's typical case is slow. Default 5.
+        decay (float): Weight of the earlier yield when a slice ends. Default 0.5.
+        min_share (float): Smallest slice, relative to the average. Default 0.25.
+        max_share (float): Largest slice, relative to the average. Default 4.
+    """
+
+    def __init__(self, budget=None, slice_time=DEFAULT_SLICE_TIME, max_depth=None, slow_factor=5.0, decay=0.5,
+                 min_share=0.25, max_share=4.0):
+        self.budget = budget
+        self.slice_time = slice_time
+        self.max_depth = max_depth
+        self.slow_factor = slow_factor
+        self.decay = decay
+        self.min_share = min_share
+        self.max_share = max_share
+        self.requests = []
+        self.rounds = 0
+        self.budget_spent = False
+
+    def fuzz(self, session, name=None):
+        """
+        Fuzz every Request of the session, or only the Request named name.
+        A full test case name is replayed by session.fuzz() unchanged.
+        """
+        if name:
+            path_names, mutations = helpers.parse_test_case_name(name)
+            if mutations:
+                session.fuzz(name=name)
+                return
+            paths = [session._path_names_to_edges(node_names=path_names)]
+        else:
+            paths = [list(path) for path in session._iterate_protocol_message_paths()]
+        self.requests = [ScheduledRequest(session, path, self.max_depth) for path in paths]
+
+        session.total_mutant_index = 0
+        if self.max_depth == 1:
+            session.total_num_mutations = sum(request.node.get_num_mutations() for request in self.requests)
+        else:
+            session.total_num_mutations = None
+        session._main_fuzz_loop(self._cases(session))
+
+    def _cases(self, session):
+        deadline = time.time() + self.budget if self.budget else None
+        active = [request for request in self.requests if request.pending is not None]
+        while active:
+            self.rounds += 1
+            self._update_shares(active)
+            for request in list(active):
+                slice_start = time.time()
+                slice_end = slice_start + self.slice_time * request.share
+                if deadline is not None:
+                    slice_end = min(slice_end, deadline)
+                points = 0.0
+                while request.pending is not None:
+                    session.fuzz_node = request.node
+                    session.mutant_index = request.mutant_index
+                    session.total_mutant_index += 1
+                    session._mqtt_responses = None
+                    crashes = len(session.monitor_results)
+                    case_start = time.time()
+                    yield MutationContext(
+                        message_path=request.path,
+                        mutations={m.qualified_name: m for m in request.pending},
+                    )
+                    now = time.time()
+                    points += request.observe(now - case_start, len(session.monitor_results) > crashes,
+                                              session._mqtt_responses, self.slow_factor)
+                    request.fetch()
+                    if now >= slice_end:
+                        break
+                spent = time.time() - slice_start
+                request.elapsed += spent
+                request.score = self.decay * request.score + (1 - self.decay) * points / max(spent, 1e-3)
+                if request.pending is None:
+                    active.remove(request)
+                if deadline is not None and time.time() >= deadline:
+                    self.budget_spent = True
+                    return
+
+    def _update_shares(self, active):
+        """Scale each slice by the Request's yield rate relative to the average."""
+        mean = sum(request.score for request in active) / len(active)
+        for request in active:
+            if mean > 0:
+                request.share = min(self.max_share, max(self.min_share, request.score / mean))
+            else:
+                request.share = 1.0
+
+    def summary(self):
+        if self.budget_spent:
+            stop = f"budget of {self.budget:.0f}s spent"
+        else:
+            stop = "all requests exhausted"
+        lines = [f"[*] Scheduler: {self.rounds} rounds of {self.slice_time:g}s slices, {stop}"]
+        for request in self.requests:
+            state = "exhausted" if request.pending is None else f"share {request.share:.2f}"
+            lines.append(
+                f"  {request.name:<36} {request.cases:>7} cases {request.elapsed:>8.1f}s  "
+                f"{request.crashes} crashes, {request.new_responses} new responses, "
+                f"{request.slow_responses} slow  ({state})"
+            )
+        return "\n".join(lines)
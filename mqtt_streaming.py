@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+MQTT Streamed Payloads
+
+A PUBLISH body can be up to 268,435,455 bytes long (Section 2.2.3), which
+is too large to render into one bytes object for every test case. A
+StreamedPayload renders as nothing in the boofuzz tree and describes its
+bytes as segments instead:
+
+- RepeatSegment: a pattern repeated to a length, sent with sendmsg from one
+  reusable 64 KiB buffer
+- FileSegment: a byte range of a file, sent with os.sendfile (or from an
+  mmap where sendfile is not available)
+
+StreamedRequest renders to a StreamedPacket: the in-memory head of the
+packet, as bytes, carrying the segments that follow it on the wire. Loggers
+and the results DB only ever see the head. StreamingTCPConnection and the
+asyncio engine send the head and then stream the segments, so a 256 MB
+body never sits whole in Python memory.
+"""
+
+from boofuzz import Request, TCPSocketConnection
+from boofuzz import exception
+from boofuzz.fuzzable import Fuzzable
+import asyncio
+import collections
+import errno
+import functools
+import mmap
+import os
+import socket
+import sys
+
+
+# Buffer size of a repeated pattern, and how many buffers go into one sendmsg.
+CHUNK_SIZE = 64 * 1024
+IOV_BATCH = 16
+
+RepeatSegment = collections.namedtuple("RepeatSegment", ["pattern", "length"])
+FileSegment = collections.namedtuple("FileSegment", ["path", "offset", "length"])
+
+
+def segment_length(segments):
+    return sum(segment.length for segment in segments)
+
+
+class StreamedPacket(bytes):
+    """
+    The head of a packet that continues with streamed segments.
+    len() and slicing only cover the head; total_length includes the segments.
+    """
+
+    def __new__(cls, head, segments):
+        packet = super(StreamedPacket, cls).__new__(cls, head)
+        packet.segments = tuple(segments)
+        return packet
+
+    @property
+    def total_length(self):
+        return len(self) + segment_length(self.segments)
+
+
+# =============================================================================
+# Primitive and Request
+# =============================================================================
+
+# Payload size that makes the packet's remaining length exactly n.
+FillTo = collections.namedtuple("FillTo", ["remaining_length"])
+PayloadSpec = collections.namedtuple("PayloadSpec", ["size", "pattern"])
+
+# Remaining lengths either side of the 3- and 4-byte encodings, the largest
+# legal packet and one byte more than the protocol allows.
+STREAMED_PAYLOAD_SIZES = (
+    0,
+    FillTo(16383), FillTo(16384),
+    FillTo(2097151), FillTo(2097152),
+    FillTo(268435455),
+    FillTo(268435456),
+)
+
+STREAMED_PAYLOAD_PATTERNS = (b"\x00", b"\xff", b"\xc0\x80")
+
+
+class StreamedPayload(Fuzzable):
+    """
+    Payload that is streamed to the broker instead of rendered.
+
+    Must be the last element of a StreamedRequest, and the request's first
+    top-level block must be its fixed header. Mutations are payload sizes
+    that put the packet's remaining length on the encoding boundaries and on
+    and just past the 268,435,455 byte limit, plus other fill patterns at
+    the default size.
+
+    Args:
+        name (str): Name, for referencing later.
+        default_size (int): Payload size when not mutated. Default 1 MiB.
+        pattern (bytes): Repeated fill pattern. Default b"B".
+        path (str): Optional file whose contents are sent first (zero copy), padded with pattern if it is
+            shorter than the payload. Default: none.
+        fuzzable (bool): Enable/disable fuzzing of this primitive. Default True.
+    """
+
+    def __init__(self, name=None, default_size=1024 * 1024, pattern=b"B", path=None, *args, **kwargs):
+        super(StreamedPayload, self).__init__(
+            name=name, default_value=PayloadSpec(default_size, pattern), *args, **kwargs)
+        self.path = path
+
+    def mutations(self, default_value):
+        for size in STREAMED_PAYLOAD_SIZES:
+            yield PayloadSpec(size, default_value.pattern)
+        for pattern in STREAMED_PAYLOAD_PATTERNS:
+            if pattern != default_value.pattern:
+                yield PayloadSpec(default_value.size, pattern)
+
+    def num_mutations(self, default_value):
+        return sum(1 for _ in self.mutations(default_value))
+
+    def encode(self, value, mutation_context):
+        return b""
+
+    def streamed_length(self, mutation_context=None):
+        return self._size(self.get_value(mutation_context), mutation_context)
+
+    def segments(self, mutation_context=None):
+        spec = self.get_value(mutation_context)
+        size = self._size(spec, mutation_context)
+        segments = []
+        if self.path is not None and size > 0:
+            head = min(size, os.path.getsize(self.path))
+            segments.append(FileSegment(self.path, 0, head))
+            size -= head
+        if size > 0:
+            segments.append(RepeatSegment(spec.pattern, size))
+        return segments
+
+    def _size(self, spec, mutation_context):
+        if not isinstance(spec.size, FillTo):
+            return spec.size
+        # Everything after the fixed header counts towards the remaining length.
+        rest = sum(len(item.render(mutation_context=mutation_context)) for item in self.request.stack[1:])
+        return max(0, spec.size.remaining_length - rest)
+
+    def __len__(self):
+        return 0
+
+
+class StreamedRequest(Request):
+    """Request that renders to a StreamedPacket when it contains a StreamedPayload."""
+
+    def render(self, mutation_context=None):
+        head = super(StreamedRequest, self).render(mutation_context=mutation_context)
+        segments = []
+        for item in self.walk():
+            if isinstance(item, StreamedPayload):
+                segments += item.segments(mutation_context)
+        if not segments:
+            return head
+        return StreamedPacket(head, segments)
+
+
+# =============================================================================
+# Sending
+# =============================================================================
+
+@functools.lru_cache(maxsize=16)
+def _pattern_chunk(pattern):
+    """A read-only buffer of about CHUNK_SIZE bytes holding whole repetitions of pattern."""
+    return memoryview(pattern * max(1, CHUNK_SIZE // len(pattern)))
+
+
+def iter_chunks(segment):
+    """Yield memoryviews that together make up a RepeatSegment."""
+    chunk = _pattern_chunk(segment.pattern)
+    remaining = segment.length
+    while remaining > 0:
+        view = chunk[:min(remaining, len(chunk))]
+        remaining -= len(view)
+        yield view
+
+
+def _sendmsg_all(sock, buffers):
+    """sendmsg every buffer, resuming after partial sends. Returns bytes sent."""
+    sent = 0
+    buffers = list(buffers)
+    while buffers:
+        n = sock.sendmsg(buffers)
+        sent += n
+        while buffers and n >= len(buffers[0]):
+            n -= len(buffers[0])
+            buffers.pop(0)
+        if n:
+            buffers[0] = buffers[0][n:]
+    return sent
+
+
+def _send_file(sock, segment):
+    with open(segment.path, "rb") as f:
+        if hasattr(os, "sendfile"):
+            offset = segment.offset
+            end = segment.offset + segment.length
+            while offset < end:
+                n = os.sendfile(sock.fileno(), f.fileno(), offset, end - offset)
+                if n == 0:
+                    break
+                offset += n
+            return offset - segment.offset
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                sent = 0
+                for start in range(segment.offset, segment.offset + segment.length, CHUNK_SIZE * IOV_BATCH):
+                    end = min(start + CHUNK_SIZE * IOV_BATCH, segment.offset + segment.length)
+                    sent += _sendmsg_all(sock, [view[start:end]])
+                return sent
+            finally:
+                view.release()
+
+
+def send_streamed(sock, packet):
+    """
+    Send a StreamedPacket on a blocking socket: the head together with the first
+    pattern buffers in one sendmsg, then the rest of the segments.
+    Returns the number of bytes sent.
+    """
+    sent = 0
+    pending = [memoryview(packet)]
+    for segment in packet.segments:
+        if isinstance(segment, FileSegment):
+            sent += _sendmsg_all(sock, pending)
+            pending = []
+            sent += _send_file(sock, segment)
+            continue
+        for view in iter_chunks(segment):
+            pending.append(view)
+            if len(pending) >= IOV_BATCH:
+                sent += _sendmsg_all(sock, pending)
+                pending = []
+    if pending:
+        sent += _sendmsg_all(sock, pending)
+    return sent
+
+
+async def write_streamed(writer, packet):
+    """Write a StreamedPacket to an asyncio StreamWriter, draining after each buffer."""
+    loop = asyncio.get_running_loop()
+    writer.write(packet)
+    for segment in packet.segments:
+        if isinstance(segment, FileSegment):
+            await writer.drain()
+            with open(segment.path, "rb") as f:
+                await loop.sendfile(writer.transport, f, segment.offset, segment.length)
+            continue
+        for view in iter_chunks(segment):
+            writer.write(view)
+            await writer.drain()
+    await writer.drain()
+
+
+class StreamingTCPConnection(TCPSocketConnection):
+    """
+    TCPSocketConnection that streams StreamedPackets and sends plain data in
+    full (TCPSocketConnection.send makes a single send() call).
+
+    A broker that stops reading before the end of a streamed packet is not an
+    error: sending just stops when the send timeout expires.
+    """
+
+    def send(self, data):
+        try:
+            if isinstance(data, StreamedPacket):
+                return send_streamed(self._sock, data)
+            return _sendmsg_all(self._sock, [memoryview(data)])
+        except (BlockingIOError, socket.timeout):
+            return 0
+        except socket.error as e:
+            if e.errno == errno.ECONNABORTED:
+                raise exception.BoofuzzTargetConnectionAborted(
+                    socket_errno=e.errno, socket_errmsg=e.strerror
+                ).with_traceback(sys.exc_info()[2])
+            elif e.errno in [errno.ECONNRESET, errno.ENETRESET, errno.ETIMEDOUT, errno.EPIPE]:
+                raise exception.BoofuzzTargetConnectionReset().with_traceback(sys.exc_info()[2])
+            raise
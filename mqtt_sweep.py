@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+MQTT Exhaustive Field Sweeps
+
+boofuzz mutates a Byte or Word with a few dozen interesting values. Small
+integer fields such as connect_flags, protocol_level, requested_qos and
+keep_alive are cheap to sweep exhaustively (256 or 65536 values), but not one
+boofuzz render at a time.
+
+A sweep renders the request once, finds the field's offset in the default
+packet, and builds whole blocks of packets at once: the default packet
+repeated block_size times in one contiguous buffer, with every value of the
+field written into its column. Only the swept field changes, so nothing that
+depends on lengths (remaining length, string length prefixes) changes with
+it. NumPy is used when it is installed; otherwise the same columns are
+written with bytearray extended-slice assignment, which is also done in C.
+
+Each SweepBatch is one buffer plus an offset array. Its TestCases carry
+memoryview slices of that buffer, so senders and the corpus writer consume
+the block without a copy per packet.
+
+Run this module with --verify to check every swept packet against boofuzz's
+own rendering of the same value.
+"""
+
+from boofuzz.mutation import Mutation
+from boofuzz.mutation_context import MutationContext
+from boofuzz.primitives.bit_field import BitField
+from mqtt_cases import TestCase
+import argparse
+import array
+import collections
+import sys
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Fields swept when no field names are given.
+SWEEP_FIELDS = ("protocol_level", "connect_flags", "requested_qos", "keep_alive")
+
+# Widest field that is swept; a DWord would be 2**32 packets.
+SWEEP_MAX_BITS = 16
+
+DEFAULT_BLOCK_SIZE = 4096
+
+SweepField = collections.namedtuple("SweepField", ["request", "primitive", "offset", "width", "default"])
+
+_ARRAY_TYPECODES = {1: "B", 2: "H"}
+
+
+def find_sweep_fields(requests, names=SWEEP_FIELDS):
+    """
+    SweepFields for every fuzzable Byte/Word named in names, in request order.
+    Names match either the primitive name or its qualified name.
+    """
+    names = set(names)
+    fields = []
+    for request in requests:
+        default = request.render()
+        if getattr(default, "segments", None):
+            continue  # Streamed requests are not rendered whole.
+        offset = 0
+        for item in request.walk():
+            width = len(item.render())
+            if (isinstance(item, BitField) and item.fuzzable and item.format == "binary"
+                    and item.width <= SWEEP_MAX_BITS and width in _ARRAY_TYPECODES
+                    and (item.name in names or item.qualified_name in names)):
+                fields.append(SweepField(request, item, offset, width, bytes(default)))
+            offset += width
+    return fields
+
+
+def num_sweep_cases(fields):
+    return sum(1 << (8 * field.width) for field in fields)
+
+
+# =============================================================================
+# Batches
+# =============================================================================
+
+class SweepBatch:
+    """
+    Packets for the field values start..start+len-1, in one contiguous buffer.
+
+    Args:
+        field (SweepField): The swept field.
+        start (int): Field value of the first packet.
+        buffer (bytes): All packets, back to back.
+        offsets (sequence): len + 1 offsets into buffer; packet i is buffer[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(self, field, start, buffer, offsets):
+        self.field = field
+        self.start = start
+        self.buffer = buffer
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def packet(self, i):
+        return memoryview(self.buffer)[int(self.offsets[i]):int(self.offsets[i + 1])]
+
+    def test_cases(self, first_index):
+        """Yield a TestCase per packet, numbered from first_index, with data sliced from the buffer."""
+        view = memoryview(self.buffer)
+        field = self.field
+        digits = 2 * field.width
+        for i in range(len(self)):
+            value = self.start + i
+            yield TestCase(
+                index=first_index + i,
+                name=f"{field.request.name}:[{field.primitive.qualified_name}=0x{value:0{digits}x}]",
+                request=field.request.name,
+                data=view[int(self.offsets[i]):int(self.offsets[i + 1])],
+            )
+
+
+def _field_bytes(field, start, stop):
+    """The field's encoding of every value in start..stop-1, back to back."""
+    values = array.array(_ARRAY_TYPECODES[field.width], range(start, stop))
+    endian = "big" if field.primitive.endian == ">" else "little"
+    if field.width > 1 and endian != sys.byteorder:
+        values.byteswap()
+    return values.tobytes()
+
+
+def render_batch(field, start, stop):
+    """Render the packets for field values start..stop-1 as one SweepBatch."""
+    count = stop - start
+    size = len(field.default)
+    end = field.offset + field.width
+    if numpy is not None:
+        packets = numpy.tile(numpy.frombuffer(field.default, dtype=numpy.uint8), (count, 1))
+        dtype = numpy.dtype(f"{field.primitive.endian}u{field.width}")
+        values = numpy.arange(start, stop, dtype=numpy.uint64).astype(dtype)
+        packets[:, field.offset:end] = values.view(numpy.uint8).reshape(count, field.width)
+        offsets = numpy.arange(count + 1, dtype=numpy.uint64) * size
+        return SweepBatch(field, start, packets.tobytes(), offsets)
+
+    buffer = bytearray(field.default * count)
+    encoded = _field_bytes(field, start, stop)
+    for byte in range(field.width):
+        buffer[field.offset + byte::size] = encoded[byte::field.width]
+    offsets = array.array("Q", range(0, (count + 1) * size, size))
+    return SweepBatch(field, start, bytes(buffer), offsets)
+
+
+def iter_sweep_batches(fields, block_size=DEFAULT_BLOCK_SIZE):
+    """Yield SweepBatches of up to block_size packets covering every value of every field."""
+    for field in fields:
+        total = 1 << (8 * field.width)
+        for start in range(0, total, block_size):
+            yield render_batch(field, start, min(start + block_size, total))
+
+
+def iter_sweep_cases(fields, block_size=DEFAULT_BLOCK_SIZE, index_start=1):
+    """Yield a TestCase for every swept value, numbered from index_start across all fields."""
+    index = index_start
+    for batch in iter_sweep_batches(fields, block_size):
+        yield from batch.test_cases(index)
+        index += len(batch)
+
+
+# =============================================================================
+# Verification
+# =============================================================================
+
+def verify(fields):
+    """
+    Render every value of each field through boofuzz and compare it with the
+    sweep. Returns the number of mismatches.
+    """
+    mismatches = 0
+    for field in fields:
+        name = field.primitive.qualified_name
+        start = time.perf_counter()
+        batches = list(iter_sweep_batches([field]))
+        sweep_time = time.perf_counter() - start
+        total = sum(len(batch) for batch in batches)
+
+        bad = 0
+        start = time.perf_counter()
+        for batch in batches:
+            for i in range(len(batch)):
+                context = MutationContext(mutations={name: Mutation(value=batch.start + i, qualified_name=name,
+                                                                    index=0)})
+                if field.request.render(mutation_context=context) != batch.packet(i):
+                    bad += 1
+        tree_time = time.perf_counter() - start
+        mismatches += bad
+        status = "OK" if not bad else f"[!] {bad} MISMATCHES"
+        print(f"  {name:<48} {total:>6} cases  tree {tree_time / total * 1e6:6.1f} us  "
+              f"sweep {sweep_time / total * 1e6:5.2f} us  {status}")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exhaustive Byte/Word sweeps for MQTT requests")
+    parser.add_argument("--verify", action="store_true",
+                        help="Check every swept packet against boofuzz rendering")
+    parser.add_argument("--fields", default=",".join(SWEEP_FIELDS),
+                        help=f"Comma-separated field names (default: {','.join(SWEEP_FIELDS)})")
+    args = parser.parse_args()
+    if not args.verify:
+        parser.print_help()
+        return 0
+
+    from mqtt_fuzzer import define_requests
+    from mqtt_fuzzer_stateful import define_stateful_requests
+    fields = find_sweep_fields(define_requests(fuzz_all=True) + define_stateful_requests(),
+                               args.fields.split(","))
+    print(f"[*] Verifying {len(fields)} sweeps ({num_sweep_cases(fields)} cases) against boofuzz rendering, "
+          f"{'NumPy' if numpy is not None else 'bytearray'} batches")
+    mismatches = verify(fields)
+    if mismatches:
+        print(f"[!] {mismatches} test cases render differently")
+        return 1
+    print("[*] All sweeps byte-identical")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+MQTT Compiled Request Templates
+
+For fixed-layout packets such as PINGREQ, DISCONNECT and the PUBACK family,
+walking the boofuzz Block/Byte/Word tree costs more CPU than sending the
+packet. A RequestTemplate is compiled once from such a Request: the default
+rendering as a bytearray plus an (offset, width) slot per primitive. A test
+case is then rendered by patching the mutated slots in place; the bytes of
+each mutated slot are rendered by boofuzz once and cached.
+
+A Request has a fixed layout when every primitive is a Byte/Word/DWord/QWord,
+a Static, or a RemainingLength (whose value cannot change because nothing
+after it changes width). Mutations that change a slot's width, such as an
+over-long remaining length encoding, are spliced in instead.
+
+Run this module with --verify to check every template against boofuzz's own
+rendering for all test cases of both fuzzers.
+"""
+
+from boofuzz import Request, Static
+from boofuzz.mutation_context import MutationContext
+from boofuzz.primitives.bit_field import BitField
+from mqtt_primitives import RemainingLength
+import argparse
+import collections
+import itertools
+import sys
+import time
+
+
+FIXED_LAYOUT_PRIMITIVES = (BitField, Static, RemainingLength)
+
+Slot = collections.namedtuple("Slot", ["offset", "width", "primitive"])
+
+
+def compile_template(request):
+    """Return a RequestTemplate for request, or None if its layout is not fixed."""
+    slots = {}
+    offset = 0
+    for item in request.walk():
+        if not isinstance(item, FIXED_LAYOUT_PRIMITIVES):
+            return None
+        width = len(item.render())
+        slots[item.qualified_name] = Slot(offset, width, item)
+        offset += width
+    return RequestTemplate(request, Request.render(request), slots)
+
+
+class RequestTemplate:
+    """
+    Default rendering of a fixed-layout Request and the slot of each primitive.
+
+    Args:
+        request (Request): The compiled Request.
+        default (bytes): Its rendering without mutations.
+        slots (dict): Slot per primitive, by qualified name.
+    """
+
+    def __init__(self, request, default, slots):
+        self.request = request
+        self.default = bytes(default)
+        self.slots = slots
+        self._buffer = bytearray(default)
+        self._prefix = request.name + "."
+        self._values = {}
+
+    def render(self, mutation_context=None):
+        """Render like request.render(mutation_context), or return None if a mutation is not on a slot."""
+        mutations = mutation_context.mutations if mutation_context is not None else {}
+        patches = []
+        for qualified_name, mutation in mutations.items():
+            if not qualified_name.startswith(self._prefix):
+                continue  # Mutation of another message on the path.
+            slot = self.slots.get(qualified_name)
+            if slot is None:
+                return None
+            patches.append((slot, self._value(slot, mutation)))
+        if not patches:
+            return self.default
+
+        if all(len(value) == slot.width for slot, value in patches):
+            buffer = self._buffer
+            for slot, value in patches:
+                buffer[slot.offset:slot.offset + slot.width] = value
+            data = bytes(buffer)
+            for slot, _ in patches:
+                buffer[slot.offset:slot.offset + slot.width] = self.default[slot.offset:slot.offset + slot.width]
+            return data
+
+        parts = []
+        position = 0
+        for slot, value in sorted(patches, key=lambda patch: patch[0].offset):
+            parts.append(self.default[position:slot.offset])
+            parts.append(value)
+            position = slot.offset + slot.width
+        parts.append(self.default[position:])
+        return b"".join(parts)
+
+    def _value(self, slot, mutation):
+        key = (mutation.qualified_name, mutation.index)
+        value = self._values.get(key)
+        if value is None:
+            context = MutationContext(mutations={mutation.qualified_name: mutation})
+            value = self._values[key] = slot.primitive.render(mutation_context=context)
+        return value
+
+
+class TemplateRequest(Request):
+    """Request that renders through a compiled RequestTemplate when its layout is fixed."""
+
+    def render(self, mutation_context=None):
+        template = getattr(self, "_template", None)
+        if template is None:
+            template = self._template = compile_template(self) or False
+        if template:
+            data = template.render(mutation_context)
+            if data is not None:
+                return data
+        return super(TemplateRequest, self).render(mutation_context=mutation_context)
+
+
+# =============================================================================
+# Verification
+# =============================================================================
+
+def _mutation_contexts(request, pairs=200):
+    """Every single mutation of request, then up to `pairs` two-mutation combinations."""
+    singles = list(request.get_mutations())
+    for mutations in singles:
+        yield MutationContext(mutations={m.qualified_name: m for m in mutations})
+    combined = (
+        a + b for a, b in itertools.combinations(singles, 2)
+        if a[0].qualified_name != b[0].qualified_name
+    )
+    for mutations in itertools.islice(combined, pairs):
+        yield MutationContext(mutations={m.qualified_name: m for m in mutations})
+
+
+def verify(requests):
+    """
+    Render every test case of each fixed-layout request both through its
+    template and through the boofuzz tree, and compare.
+    Returns the number of mismatches.
+    """
+    mismatches = 0
+    for request in requests:
+        template = compile_template(request)
+        if template is None:
+            continue
+        contexts = list(_mutation_contexts(request))
+        start = time.perf_counter()
+        expected = [Request.render(request, context) for context in contexts]
+        tree_time = time.perf_counter() - start
+        actual = [template.render(context) for context in contexts]
+        # Time a second pass: slot values are only rendered by boofuzz once.
+        start = time.perf_counter()
+        for context in contexts:
+            template.render(context)
+        template_time = time.perf_counter() - start
+        bad = sum(1 for a, b in zip(expected, actual) if a != b)
+        mismatches += bad
+        status = "OK" if not bad else f"[!] {bad} MISMATCHES"
+        print(f"  {request.name:<32} {len(contexts):>5} cases  tree {tree_time / len(contexts) * 1e6:6.1f} us  "
+              f"template {template_time / len(contexts) * 1e6:5.1f} us  {status}")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compiled request templates for fixed-layout MQTT packets")
+    parser.add_argument("--verify", action="store_true",
+                        help="Check template rendering against boofuzz rendering for every test case")
+    args = parser.parse_args()
+    if not args.verify:
+        parser.print_help()
+        return 0
+
+    from mqtt_fuzzer import define_requests
+    from mqtt_fuzzer_stateful import define_stateful_requests
+    print("[*] Verifying templates against boofuzz rendering")
+    mismatches = verify(define_requests(fuzz_all=True) + define_stateful_requests())
+    if mismatches:
+        print(f"[!] {mismatches} test cases render differently")
+        return 1
+    print("[*] All templates byte-identical")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
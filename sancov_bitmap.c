@@ -0,0 +1,71 @@
+/*
+ * sancov_bitmap.c
+ * SanitizerCoverage edge counters in a shared-memory bitmap
+ *
+ * Link into a broker built with clang -fsanitize-coverage=trace-pc-guard
+ * (compile this file itself without that flag). Every instrumented edge
+ * gets a guard number in 1..65535 and each hit increments that byte of the
+ * bitmap. mqtt_fuzzer.py --coverage maps the same file and reads the
+ * counters after every test case.
+ *
+ * The bitmap is the file named by MQTT_COVERAGE_MAP (default
+ * /dev/shm/mqtt-coverage). Guard numbers are assigned in module load order,
+ * so they are stable across broker restarts and the fuzzer's record of
+ * edges already seen stays valid after a crash.
+ *
+ * Usage (see Dockerfile.mosquitto-asan / Dockerfile.nanomq-asan):
+ *   clang -O2 -c sancov_bitmap.c -o sancov_bitmap.o
+ *   clang -fsanitize=address -fsanitize-coverage=trace-pc-guard ... sancov_bitmap.o
+ */
+
+#include <fcntl.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+#define COVERAGE_MAP_SIZE (1 << 16)
+#define DEFAULT_COVERAGE_MAP "/dev/shm/mqtt-coverage"
+
+/* Counters go here until (or if) the shared bitmap cannot be mapped. */
+static uint8_t private_map[COVERAGE_MAP_SIZE];
+static uint8_t *coverage_map = private_map;
+static uint32_t next_guard = 1;
+
+static void coverage_map_open(void)
+{
+    const char *path = getenv("MQTT_COVERAGE_MAP");
+    if (path == NULL || *path == '\0')
+        path = DEFAULT_COVERAGE_MAP;
+
+    int fd = open(path, O_RDWR | O_CREAT, 0666);
+    if (fd < 0)
+        return;
+    /* The fuzzer may run as another user than the broker. */
+    fchmod(fd, 0666);
+    struct stat st;
+    if (fstat(fd, &st) == 0 && (st.st_size >= COVERAGE_MAP_SIZE || ftruncate(fd, COVERAGE_MAP_SIZE) == 0)) {
+        void *mapped = mmap(NULL, COVERAGE_MAP_SIZE, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+        if (mapped != MAP_FAILED)
+            coverage_map = mapped;
+    }
+    close(fd);
+}
+
+void __sanitizer_cov_trace_pc_guard_init(uint32_t *start, uint32_t *stop)
+{
+    if (start == stop || *start)
+        return;  /* Already initialized (the callback can run more than once per module). */
+    if (coverage_map == private_map)
+        coverage_map_open();
+    for (uint32_t *guard = start; guard < stop; guard++) {
+        *guard = next_guard;
+        next_guard = next_guard % (COVERAGE_MAP_SIZE - 1) + 1;
+    }
+}
+
+void __sanitizer_cov_trace_pc_guard(uint32_t *guard)
+{
+    coverage_map[*guard]++;
+}